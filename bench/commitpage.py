@@ -0,0 +1,182 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Measures rendering of commit page of a commit which changes many files:
+time to the first byte written to request, total time, number of writes
+to request and peak memory of process.
+
+Usage: python bench/commitpage.py [--pitweb DIR] [--files N] [--lines N]
+                                  [--repeat N] [--backend B] [--dir DIR]
+
+Each request is rendered in a forked process so that peak memory
+(ru_maxrss) belongs to that request only. Run it once against the current
+tree and once with --pitweb pointing to a checkout of an older version to
+get before/after numbers.
+"""
+
+import sys
+import os
+import time
+import shutil
+import resource
+import tempfile
+import optparse
+import subprocess
+
+import fakereq
+
+
+def createRepo(path, files, lines):
+    """ Creates bare repository whose HEAD commit modifies files files
+        (each of lines lines) of its parent
+    """
+    subprocess.check_call(['git', 'init', '-q', '--bare', path])
+
+    stream = []
+    for c in range(0, 2):
+        msg = 'commit {0}\n'.format(c)
+        stream.append('commit refs/heads/master\n')
+        stream.append('mark :{0}\n'.format(c + 1))
+        stream.append('committer Bench <bench@example.com> {0} +0000\n'.format(1300000000 + c * 3600))
+        stream.append('data {0}\n{1}'.format(len(msg), msg))
+        if c > 0:
+            stream.append('from :{0}\n'.format(c))
+
+        for i in range(0, files):
+            data = ''.join(['line {0} of file {1} <{2}>\n'.format(l, i, c * (l % 3))
+                            for l in range(0, lines)])
+            stream.append('M 100644 inline dir{0}/file{1}.txt\n'.format(i % 50, i))
+            stream.append('data {0}\n{1}\n'.format(len(data), data))
+
+    p = subprocess.Popen(['git', '--git-dir=' + path, 'fast-import', '--quiet'],
+                         stdin = subprocess.PIPE)
+    p.communicate(''.join(stream))
+
+    if p.returncode != 0:
+        raise RuntimeError('git fast-import failed')
+
+
+class Request(fakereq.Request):
+    """ Request remembering when the first byte was written """
+
+    def __init__(self, *args, **kwargs):
+        super(Request, self).__init__(*args, **kwargs)
+        self.first = None
+        self.writes = 0
+
+    def write(self, s, flush = 1):
+        if self.first is None:
+            self.first = time.time()
+        self.writes += 1
+        super(Request, self).write(s, flush)
+
+
+def render(dir):
+    """ Renders commit page of HEAD, returns tuple (ms to first byte,
+        ms total, bytes, writes)
+    """
+    import project
+
+    req = Request('/', 'a=commit;id=HEAD', keep = False)
+    start = time.time()
+    project.Project(req, dir).run()
+    end = time.time()
+
+    first = end
+    if req.first is not None:
+        first = req.first
+    return ((first - start) * 1000., (end - start) * 1000., req.bytes, req.writes)
+
+def measure(dir):
+    """ Renders page in forked process, returns result of render() and
+        peak memory of the process in kB
+    """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        try:
+            res = render(dir)
+            res += (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,)
+            os.write(wfd, repr(res))
+        finally:
+            os._exit(0)
+
+    os.close(wfd)
+    data = ''
+    while True:
+        chunk = os.read(rfd, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(rfd)
+    os.waitpid(pid, 0)
+
+    if not data:
+        raise RuntimeError('rendering failed')
+    return eval(data)
+
+def main():
+    parser = optparse.OptionParser(usage = '%prog [options]')
+    parser.add_option('--pitweb', default = os.path.join(os.path.dirname(__file__), '..'),
+                      help = 'directory with pitweb sources to measure')
+    parser.add_option('--files', type = 'int', default = 5000,
+                      help = 'number of files changed by the commit')
+    parser.add_option('--lines', type = 'int', default = 10,
+                      help = 'number of lines of each file')
+    parser.add_option('--repeat', type = 'int', default = 3,
+                      help = 'number of requests')
+    parser.add_option('--backend', default = None,
+                      help = 'object backend of git.Git (git or native)')
+    parser.add_option('--dir', default = None,
+                      help = 'directory to create repository in (kept)')
+    opts, args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(opts.pitweb))
+
+    dir = opts.dir
+    if dir is None:
+        dir = tempfile.mkdtemp(prefix = 'pitweb-bench-')
+
+    try:
+        repo = os.path.join(dir, 'repo.git')
+        if not os.path.isdir(repo):
+            createRepo(repo, opts.files, opts.lines)
+
+        config = open(os.path.join(repo, 'pitweb.py'), 'w')
+        if opts.backend:
+            config.write('backend = {0!r}\n'.format(opts.backend))
+        config.close()
+
+        print '{0:>12} {1:>12} {2:>12} {3:>8} {4:>12}'.format('first ms', 'total ms',
+                                                            'bytes', 'writes', 'peak kB')
+        for i in range(0, opts.repeat):
+            first, total, bytes, writes, rss = measure(repo)
+            print '{0:>12.1f} {1:>12.1f} {2:>12} {3:>8} {4:>12}'.format(first, total,
+                                                                      bytes, writes, rss)
+    finally:
+        if opts.dir is None:
+            shutil.rmtree(dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+"""
+Measures decoration of a log page with refs (Git.commitsSetRefs()) for
+synthetic sets of refs, compared with the former loop over all refs for
+each commit.
+
+Usage: python bench/decorate.py [--commits N] [--repeat N] [REFS ...]
+
+REFS are numbers of refs to test with (10000, 50000 and 100000 by default),
+90% of them are annotated tags and the rest heads and remotes.
+
+Columns:
+    legacy - the former loop, refs already parsed to GitTag/GitHead objects
+    index  - index built from the parsed refs for each page
+    cold   - Git.decorations() built from packed-refs for each page (cold
+             cache; the former code had to parse all refs first)
+    cached - the index cached together with stamp of refs
+"""
+
+import sys
+import os
+import time
+import random
+import optparse
+import shutil
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import git
+import refstore
+
+
+def randomId():
+    return '%040x' % random.getrandbits(160)
+
+def makeRefs(g, count, ids):
+    """ Returns tuple (tags, heads, remotes), some of refs point to ids """
+    tags    = []
+    heads   = []
+    remotes = []
+    for i in range(0, count):
+        id = randomId()
+        if i % 100 == 0:
+            id = random.choice(ids)
+
+        if i % 10 < 9:
+            tags.append(git.GitTag(g, id, objid = id, name = 'tag{0}'.format(i)))
+        elif i % 20 == 9:
+            heads.append(git.GitHead(g, id, name = 'head{0}'.format(i)))
+        else:
+            remotes.append(git.GitHead(g, id, name = 'origin/r{0}'.format(i)))
+    return (tags, heads, remotes)
+
+def writePackedRefs(dir, tags, heads, remotes):
+    """ Writes the refs to packed-refs of a new repository in dir, tags
+        are written as annotated ones (with peeled ids).
+    """
+    subprocess.check_call(['git', 'init', '-q', '--bare', dir])
+
+    lines = ['# pack-refs with: peeled fully-peeled sorted \n']
+    for t in tags:
+        lines.append('{0} refs/tags/{1}\n^{2}\n'.format(randomId(), t.name, t.objid))
+    for h in heads:
+        lines.append('{0} refs/heads/{1}\n'.format(h.id, h.name))
+    for r in remotes:
+        lines.append('{0} refs/remotes/{1}\n'.format(r.id, r.name))
+
+    lines = [lines[0]] + sorted(lines[1:], key = lambda l: l.split()[1])
+    f = open(os.path.join(dir, 'packed-refs'), 'w')
+    f.write(''.join(lines))
+    f.close()
+
+def makeCommits(g, ids):
+    return [git.GitCommit(g, id, None, [], None, None, '') for id in ids]
+
+def coldSetRefs(dir, ids):
+    """ Decorates a page with all per-process caches of refs dropped """
+    git._decorations_cache.clear()
+    with refstore._lock:
+        for packed in refstore._packed.values():
+            packed.close()
+        refstore._packed.clear()
+        refstore._listings.clear()
+
+    g = git.Git(dir)
+    return list(g.commitsSetRefs(makeCommits(g, ids)))
+
+
+def legacySetRefs(commits, tags, heads, remotes):
+    for c in commits:
+        for t in tags:
+            if t.objid == c.id:
+                c.tags = list(c.tags) + [t]
+
+        for h in heads:
+            if h.id == c.id:
+                c.heads = list(c.heads) + [h]
+
+        for r in remotes:
+            if r.id == c.id:
+                c.remotes = list(c.remotes) + [r]
+
+    return commits
+
+
+def measure(func, repeat):
+    start = time.time()
+    for i in range(0, repeat):
+        func()
+    return (time.time() - start) * 1000. / repeat
+
+def main():
+    parser = optparse.OptionParser(usage = '%prog [options] [REFS ...]')
+    parser.add_option('--commits', type = 'int', default = 50,
+                      help = 'number of commits on page')
+    parser.add_option('--repeat', type = 'int', default = 5,
+                      help = 'number of pages per measurement')
+    opts, args = parser.parse_args()
+
+    counts = [int(a) for a in args]
+    if len(counts) == 0:
+        counts = [10000, 50000, 100000]
+
+    g = git.Git.__new__(git.Git)
+    ids = [randomId() for i in range(0, opts.commits)]
+
+    print '{0:>8} {1:>12} {2:>12} {3:>12} {4:>12}'.format('refs',
+                                'legacy ms', 'index ms', 'cold ms', 'cached ms')
+    for count in counts:
+        tags, heads, remotes = makeRefs(g, count, ids)
+        index = git._decorationIndex(tags, heads, remotes)
+
+        dir = tempfile.mkdtemp(prefix = 'pitweb-bench-')
+        try:
+            writePackedRefs(dir, tags, heads, remotes)
+            cold = measure(lambda: coldSetRefs(dir, ids), opts.repeat)
+        finally:
+            shutil.rmtree(dir)
+
+        legacy = measure(lambda: legacySetRefs(makeCommits(g, ids),
+                                               tags, heads, remotes),
+                         opts.repeat)
+        # index built for each page (refs passed explicitly)
+        built = measure(lambda: list(g.commitsSetRefs(makeCommits(g, ids),
+                                                      tags, heads, remotes)),
+                        opts.repeat)
+        # index cached together with refs (the way log and summary use it)
+        g.decorations = lambda: index
+        cached = measure(lambda: list(g.commitsSetRefs(makeCommits(g, ids))),
+                         opts.repeat)
+
+        print '{0:>8} {1:>12.2f} {2:>12.2f} {3:>12.2f} {4:>12.2f}'.format(count,
+                                                legacy, built, cold, cached)
+
+if __name__ == '__main__':
+    main()
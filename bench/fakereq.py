@@ -0,0 +1,60 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Fake mod_python request object for benchmarks. Output is collected in
+memory (or only counted if keep is False).
+"""
+
+import sys
+import os
+
+# use stand-in mod_python unless the real one is installed
+try:
+    import mod_python.apache
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class Request(object):
+    def __init__(self, uri = '/', args = None, headers_in = None, keep = True):
+        self.uri          = uri
+        self.args         = args
+        self.headers_in   = headers_in or {}
+        self.headers_out  = {}
+        self.content_type = None
+        self.status       = 200
+
+        self.bytes  = 0
+        self._keep  = keep
+        self._out   = []
+
+    def write(self, s, flush = 1):
+        self.bytes += len(s)
+        if self._keep:
+            self._out.append(s)
+
+    def set_content_length(self, length):
+        self.headers_out['Content-Length'] = str(length)
+
+    def body(self):
+        return ''.join(self._out)
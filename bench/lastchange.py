@@ -0,0 +1,174 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+"""
+Measures the project list page (ProjectListDir) on many synthetic
+repositories: dates of last change computed one after another without
+caching (the former way), concurrently with cold cache and with warm cache
+(unchanged repositories).
+
+Usage: python bench/lastchange.py [--repos N] [--backend B] [--threads N] [--dir DIR]
+
+Repositories share objects of one generated repository through
+objects/info/alternates so that creating them is cheap.
+"""
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+import fakereq
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import git
+import project_list
+
+
+def createSource(path, commits):
+    """ Creates bare repository with commits on master by git fast-import """
+    subprocess.check_call(['git', 'init', '-q', '--bare', path])
+
+    stream = []
+    for i in range(0, commits):
+        data = 'file {0}\n'.format(i)
+        msg  = 'commit {0}\n'.format(i)
+        stream.append('commit refs/heads/master\n')
+        stream.append('mark :{0}\n'.format(i + 1))
+        stream.append('committer Bench <bench@example.com> {0} +0000\n'.format(1300000000 + i * 3600))
+        stream.append('data {0}\n{1}'.format(len(msg), msg))
+        if i > 0:
+            stream.append('from :{0}\n'.format(i))
+        stream.append('M 100644 inline file\ndata {0}\n{1}\n'.format(len(data), data))
+
+    p = subprocess.Popen(['git', '--git-dir=' + path, 'fast-import', '--quiet'],
+                         stdin = subprocess.PIPE)
+    p.communicate(''.join(stream))
+
+    out = subprocess.Popen(['git', '--git-dir=' + path, 'rev-list', 'master'],
+                           stdout = subprocess.PIPE).communicate()[0]
+    return out.split()
+
+def writeFile(path, data):
+    f = open(path, 'w')
+    f.write(data)
+    f.close()
+
+def createRepo(path, source, id, backend):
+    """ Creates bare repository borrowing objects from source without
+        spawning git
+    """
+    for d in ['objects/info', 'objects/pack', 'refs/heads', 'refs/tags']:
+        os.makedirs(os.path.join(path, d))
+
+    writeFile(os.path.join(path, 'HEAD'), 'ref: refs/heads/master\n')
+    writeFile(os.path.join(path, 'config'),
+              '[core]\n\trepositoryformatversion = 0\n\tbare = true\n')
+    writeFile(os.path.join(path, 'objects', 'info', 'alternates'),
+              os.path.join(source, 'objects') + '\n')
+    writeFile(os.path.join(path, 'refs', 'heads', 'master'), id + '\n')
+    writeFile(os.path.join(path, 'pitweb.py'),
+              'description = "Synthetic repository"\n'
+              'backend = {0!r}\n'.format(backend))
+
+
+def countSpawns():
+    counter = { 'spawns' : 0 }
+    popen = git.Popen
+
+    def Popen(*args, **kwargs):
+        counter['spawns'] += 1
+        return popen(*args, **kwargs)
+
+    git.Popen = Popen
+    return counter
+
+def listPage(dir):
+    req = fakereq.Request('/')
+    project_list.ProjectListDir(req, dir).run()
+    return req
+
+def sequential(dir):
+    """ The former way: last change of each project one after another """
+    req = fakereq.Request('/')
+    for prj in project_list.ProjectListDir(req, dir).projects():
+        prj.lastChange()
+
+def main():
+    parser = optparse.OptionParser(usage = '%prog [options]')
+    parser.add_option('--repos', type = 'int', default = 1000,
+                      help = 'number of repositories')
+    parser.add_option('--commits', type = 'int', default = 50,
+                      help = 'number of commits in shared history')
+    parser.add_option('--backend', default = 'git',
+                      help = 'object backend of projects (git or native)')
+    parser.add_option('--threads', type = 'int',
+                      default = project_list.last_change_threads,
+                      help = 'number of threads computing last changes')
+    parser.add_option('--dir', default = None,
+                      help = 'directory to create repositories in (kept)')
+    opts, args = parser.parse_args()
+    project_list.last_change_threads = opts.threads
+
+    dir = opts.dir
+    if dir is None:
+        dir = tempfile.mkdtemp(prefix = 'pitweb-bench-')
+
+    try:
+        source = os.path.join(dir, 'source')
+        ids = createSource(source, opts.commits)
+        repos = os.path.join(dir, 'repos')
+        os.makedirs(repos)
+        for i in range(0, opts.repos):
+            createRepo(os.path.join(repos, 'repo{0:05d}.git'.format(i)),
+                       source, ids[i % len(ids)], opts.backend)
+
+        counter = countSpawns()
+
+        # the first request loads configuration of all projects
+        listPage(repos)
+
+        print '{0:<22} {1:>10} {2:>10}'.format('', 'ms', 'spawns')
+        runs = [('sequential, uncached', lambda: sequential(repos), True),
+                ('concurrent, cold',     lambda: listPage(repos), True),
+                ('concurrent, warm',     lambda: listPage(repos), False)]
+        for name, func, clear in runs:
+            if clear:
+                git._last_change_cache.clear()
+            counter['spawns'] = 0
+
+            start = time.time()
+            func()
+            elapsed = time.time() - start
+
+            print '{0:<22} {1:>10.1f} {2:>10}'.format(name, elapsed * 1000.,
+                                                      counter['spawns'])
+    finally:
+        if opts.dir is None:
+            shutil.rmtree(dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Measures memory taken by parsed commits held in memory (e.g. in a cache):
+N raw commit objects are parsed by Git._parseCommitObject() and kept in a
+list, growth of resident memory of the process is reported.
+
+Usage: python bench/objects.py [--pitweb DIR] [--commits N]
+
+Run it once against the current tree and once with --pitweb pointing to
+a checkout of an older version to get before/after numbers.
+"""
+
+import sys
+import os
+import time
+import resource
+import optparse
+
+
+def rss():
+    """ Returns resident memory of current process in bytes """
+    try:
+        f = open('/proc/self/statm')
+        try:
+            return int(f.read().split()[1]) * resource.getpagesize()
+        finally:
+            f.close()
+    except IOError:
+        # peak memory is the best we can get
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def rawCommit(i):
+    """ Returns tuple (id, raw commit object) of i-th synthetic commit """
+    id = '%040x' % (i * 7919 + 1)
+    data  = 'tree %040x\n' % (i * 104729 + 3)
+    data += 'parent %040x\n' % ((i - 1) * 7919 + 1)
+    data += 'author Joe Doe <joe@example.com> {0} +0100\n'.format(1300000000 + i * 60)
+    data += 'committer Joe Doe <joe@example.com> {0} +0100\n'.format(1300000000 + i * 60)
+    data += '\n'
+    data += 'Change number {0}\n\nLonger description of change {0}.\n'.format(i)
+    return (id, data)
+
+def main():
+    parser = optparse.OptionParser(usage = '%prog [options]')
+    parser.add_option('--pitweb', default = os.path.join(os.path.dirname(__file__), '..'),
+                      help = 'directory with pitweb sources to measure')
+    parser.add_option('--commits', type = 'int', default = 1000000,
+                      help = 'number of commits')
+    opts, args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(opts.pitweb))
+    import git
+
+    g = git.Git.__new__(git.Git)
+    g._patterns = git.patterns
+
+    commits = []
+    before = rss()
+    start = time.time()
+    for i in range(0, opts.commits):
+        id, data = rawCommit(i)
+        commits.append(g._parseCommitObject(id, data))
+    elapsed = time.time() - start
+    used = rss() - before
+
+    print 'commits        {0}'.format(len(commits))
+    print 'memory         {0:.1f} MB'.format(used / 1024. / 1024.)
+    print 'per commit     {0:.0f} B'.format(float(used) / len(commits))
+    print 'parse time     {0:.2f} s'.format(elapsed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Microbenchmark of rendering of patches (Project._fPatch) against the
+former implementation which compiled its patterns on each call, escaped
+each line separately and generated one piece of output per line.
+
+Usage: python bench/patchrender.py [--lines N] [--files N] [--repeat N] [GIT_DIR]
+
+Patches of HEAD commit of GIT_DIR are rendered, if no repository is given
+a commit changing files files of lines lines each is generated.
+"""
+
+import sys
+import os
+import re
+import time
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+import fakereq
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import project
+
+
+def legacyPatch(self, d, patch):
+    """ _fPatch() before it was rewritten, self is Project """
+    pat_head  = re.compile(r'^diff --git (a/.*) (b/.*)$')
+    pat_index = re.compile(r'^index ([^\.]*)..([^ ]*)(.*)$')
+    pat_from_file = re.compile(r'^---')
+    pat_chunk = re.compile(r'^(@@.*@@)(.*)$')
+
+    lines = patch.split('\n')
+
+    html = ''
+    html += '<div class="patch">'
+
+    cur = 0
+    length = len(lines)
+
+    # header line
+    m = pat_head.match(lines[cur])
+    if m:
+        path = d.from_file.rsplit('/', 1)
+        if len(path) == 2:
+            blobpath     = path[0]
+            blobfilename = path[1]
+        else:
+            blobpath = '/'
+            blobfilename = d.to_file
+        blobv1 = { 'a'        : 'blob',
+                   'id'       : self._id,
+                   'blobid'   : d.from_id,
+                   'path'     : blobpath,
+                   'filename' : blobfilename }
+
+        path = d.to_file.rsplit('/', 1)
+        if len(path) == 2:
+            blobpath     = path[0]
+            blobfilename = path[1]
+        else:
+            blobpath = '/'
+            blobfilename = d.to_file
+        blobv2 = { 'a'        : 'blob',
+                   'id'       : self._id,
+                   'blobid'   : d.to_id,
+                   'path'     : blobpath,
+                   'filename' : blobfilename }
+
+        a = m.group(1)
+        b = m.group(2)
+        html += '<a name="{0}"></a>'.format(d.from_id + d.to_id)
+        html += '<div class="patch-header">'
+        html += 'diff --git '
+        html += self.anchor(a, v = blobv1, cls = '')
+        html += '&nbsp;'
+        html += self.anchor(b, v = blobv2, cls = '')
+        html += '</div>'
+        cur += 1
+
+    html += '<div class="patch-index">'
+    while cur < length and not pat_index.match(lines[cur]):
+        if len(lines[cur]) > 0:
+            html += lines[cur] + '<br />'
+        cur += 1
+    if cur < length:
+        html += lines[cur]
+    html += '</div>'
+    cur += 1
+
+    if cur < length:
+        html += '<div class="patch-from-file">' + self._esc(lines[cur]) + '</div>'
+        cur += 1
+    if cur < length:
+        html += '<div class="patch-to-file">' + self._esc(lines[cur]) + '</div>'
+        cur += 1
+
+    yield html
+
+    for line in lines[cur:]:
+        m = pat_chunk.match(line)
+        if m:
+            html  = '<div class="patch-chunk">'
+            html += '<span class="patch-chunk-range">' + m.group(1) + '</span>'
+            html += str(m.group(2))
+            html += '</div>'
+            yield html
+            continue
+
+        if len(line) > 0 and line[0] == '-':
+            yield '<div class="patch-rm">' + self._esc(line) + '</div>'
+        elif len(line) > 0 and line[0] == '+':
+            yield '<div class="patch-add">' + self._esc(line) + '</div>'
+        else:
+            yield '<div class="patch-line">' + self._esc(line) + '</div>'
+
+    yield '</div>'
+
+
+def createRepo(path, files, lines):
+    """ Creates bare repository whose HEAD commit rewrites every line of
+        files files (each of lines lines) of its parent
+    """
+    subprocess.check_call(['git', 'init', '-q', '--bare', path])
+
+    stream = []
+    for c in range(0, 2):
+        msg = 'commit {0}\n'.format(c)
+        stream.append('commit refs/heads/master\n')
+        stream.append('mark :{0}\n'.format(c + 1))
+        stream.append('committer Bench <bench@example.com> {0} +0000\n'.format(1300000000 + c * 3600))
+        stream.append('data {0}\n{1}'.format(len(msg), msg))
+        if c > 0:
+            stream.append('from :{0}\n'.format(c))
+
+        for i in range(0, files):
+            # lines are indented so that they don't appear in hunk headers
+            data = ''.join(['\tif (a[{0}] < {1} && b->c > {2}) return;\n'.format(l, i, c)
+                            for l in range(0, lines)])
+            stream.append('M 100644 inline file{0}.c\n'.format(i))
+            stream.append('data {0}\n{1}\n'.format(len(data), data))
+
+    p = subprocess.Popen(['git', '--git-dir=' + path, 'fast-import', '--quiet'],
+                         stdin = subprocess.PIPE)
+    p.communicate(''.join(stream))
+
+    if p.returncode != 0:
+        raise RuntimeError('git fast-import failed')
+
+
+def render(func, prj, diff_trees):
+    return ''.join([''.join(func(prj, d, d.patch)) for d in diff_trees])
+
+def measure(func, prj, diff_trees, repeat):
+    """ Returns best time (in ms) of rendering of all patches """
+    best = None
+    for i in range(0, repeat):
+        start = time.time()
+        render(func, prj, diff_trees)
+        elapsed = (time.time() - start) * 1000.
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main():
+    parser = optparse.OptionParser(usage = '%prog [options] [GIT_DIR]')
+    parser.add_option('--files', type = 'int', default = 1,
+                      help = 'number of files changed by generated commit')
+    parser.add_option('--lines', type = 'int', default = 50000,
+                      help = 'number of lines of each generated file')
+    parser.add_option('--repeat', type = 'int', default = 5,
+                      help = 'number of runs, the best one is reported')
+    opts, args = parser.parse_args()
+
+    dir = None
+    if len(args) > 0:
+        repo = args[0]
+    else:
+        dir = tempfile.mkdtemp(prefix = 'pitweb-bench-')
+        repo = os.path.join(dir, 'repo.git')
+        createRepo(repo, opts.files, opts.lines)
+
+    try:
+        prj = project.Project(fakereq.Request('/'), repo)
+        commit = prj._git.commit('HEAD')
+        parent = None
+        if len(commit.parents) == 1:
+            parent = commit.parents[0]
+        diff_trees = list(prj._git.diffTree(commit.id, parent, patch = True))
+        lines = sum([d.patch.count('\n') for d in diff_trees])
+
+        legacy = measure(legacyPatch, prj, diff_trees, opts.repeat)
+        current = measure(project.Project._fPatch, prj, diff_trees, opts.repeat)
+        same = render(legacyPatch, prj, diff_trees) \
+                    == render(project.Project._fPatch, prj, diff_trees)
+
+        print '{0} files, {1} lines of patches'.format(len(diff_trees), lines)
+        print '{0:<10} {1:>10}'.format('', 'ms')
+        print '{0:<10} {1:>10.1f}'.format('legacy', legacy)
+        print '{0:<10} {1:>10.1f}'.format('current', current)
+        print 'speedup    {0:.2f}x, identical output: {1}'.format(legacy / current, same)
+    finally:
+        if dir:
+            shutil.rmtree(dir)
+
+if __name__ == '__main__':
+    main()
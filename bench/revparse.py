@@ -0,0 +1,193 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Benchmark of parsing of `git rev-list --parents --header` output
+(Git._parseCommit) against the former parser which went through all lines
+of each record and parsed people and dates eagerly.
+
+Usage: python bench/revparse.py [--commits N] [--repeat N] [GIT_DIR]
+
+Output of rev-list of HEAD of GIT_DIR is captured once (a repository with
+commits commits is generated if none is given) and parsed repeatedly.
+Parsing is measured alone (as needed by pages showing only subjects) and
+together with reading of names and dates of authors.
+"""
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import git
+
+
+def createRepo(path, commits):
+    """ Creates bare repository with commits commits on master """
+    subprocess.check_call(['git', 'init', '-q', '--bare', path])
+
+    stream = []
+    for i in range(0, commits):
+        msg  = 'Change number {0}\n\n'.format(i)
+        msg += 'Longer description of change {0} which\n'.format(i)
+        msg += 'spans several lines of text.\n\n    indented code\n'
+        data = 'file {0}\n'.format(i)
+        stream.append('commit refs/heads/master\n')
+        stream.append('mark :{0}\n'.format(i + 1))
+        stream.append('author Joe Doe <joe@example.com> {0} +0100\n'.format(1300000000 + i * 60))
+        stream.append('committer Jane Doe <jane@example.com> {0} +0100\n'.format(1300000000 + i * 60))
+        stream.append('data {0}\n{1}'.format(len(msg), msg))
+        if i > 0:
+            stream.append('from :{0}\n'.format(i))
+        stream.append('M 100644 inline file\ndata {0}\n{1}\n'.format(len(data), data))
+
+    p = subprocess.Popen(['git', '--git-dir=' + path, 'fast-import', '--quiet'],
+                         stdin = subprocess.PIPE)
+    p.communicate(''.join(stream))
+
+    if p.returncode != 0:
+        raise RuntimeError('git fast-import failed')
+
+def capture(path):
+    """ Returns list of records of rev-list output """
+    out = subprocess.Popen(['git', '--git-dir=' + path, 'rev-list', '--parents',
+                            '--header', 'HEAD'], stdout = subprocess.PIPE).communicate()[0]
+    return [r for r in out.split('\x00') if len(r) > 1]
+
+
+def legacyParsePerson(line):
+    person = line
+    epoch = '0'
+    tz = '+0000'
+
+    match = git.patterns['person'].match(line)
+    if match:
+        person = match.group(1)
+        epoch  = match.group(2)
+        tz     = match.group(3)
+
+    date   = git.GitDate(epoch = epoch, tz = tz)
+    person = git.GitPerson(person = person, date = date)
+    return person
+
+def legacyParseCommit(self, s):
+    """ Git._parseCommit() before it was rewritten, self is Git """
+    lines = s.split('\n')
+
+    ids         = lines.pop(0).split(' ')
+    id          = ids[0]
+    parents     = ids[1:]
+    tree        = None
+    author      = None
+    committer   = None
+    comment     = ''
+    for line in lines:
+        if line[:4] == 'tree':
+            tree = line[5:]
+        if line[:6] == 'parent' and line[7:] not in parents:
+            parents.append(line[7:])
+        if line[:6] == 'author':
+            author = legacyParsePerson(line)
+        if line[:9] == 'committer':
+            committer = legacyParsePerson(line)
+
+        if line[:4] == '    ':
+            comment += line[4:] + '\n'
+
+    commit = git.GitCommit(self, id = id, tree = tree, parents = parents,
+                           author = author, committer = committer,
+                           comment = comment)
+    return commit
+
+
+def parse(func, g, records, people):
+    commits = [func(g, r) for r in records]
+    if people:
+        for c in commits:
+            c.author.name()
+            c.author.date.epoch
+    return commits
+
+def measure(func, g, records, people, repeat):
+    """ Returns best time (in ms) of parsing of all records """
+    best = None
+    for i in range(0, repeat):
+        start = time.time()
+        parse(func, g, records, people)
+        elapsed = (time.time() - start) * 1000.
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def same(a, b):
+    for x, y in zip(a, b):
+        if (x.id, x.tree, x.parents, x.comment) != (y.id, y.tree, y.parents, y.comment):
+            return False
+        for p, q in [(x.author, y.author), (x.committer, y.committer)]:
+            if (p.person, p.date.epoch, p.date.local_tz) \
+                    != (q.person, q.date.epoch, q.date.local_tz):
+                return False
+    return len(a) == len(b)
+
+def main():
+    parser = optparse.OptionParser(usage = '%prog [options] [GIT_DIR]')
+    parser.add_option('--commits', type = 'int', default = 100000,
+                      help = 'number of commits of generated repository')
+    parser.add_option('--repeat', type = 'int', default = 3,
+                      help = 'number of runs, the best one is reported')
+    opts, args = parser.parse_args()
+
+    dir = None
+    if len(args) > 0:
+        repo = args[0]
+    else:
+        dir = tempfile.mkdtemp(prefix = 'pitweb-bench-')
+        repo = os.path.join(dir, 'repo.git')
+        createRepo(repo, opts.commits)
+
+    try:
+        records = capture(repo)
+
+        g = git.Git.__new__(git.Git)
+        g._patterns = git.patterns
+
+        print '{0} commits, {1:.1f} MB of rev-list output'.format(len(records),
+                    sum([len(r) for r in records]) / 1024. / 1024.)
+        print '{0:<16} {1:>12} {2:>12} {3:>10}'.format('', 'legacy ms', 'current ms', 'speedup')
+        for name, people in [('subjects only', False), ('with people', True)]:
+            legacy  = measure(legacyParseCommit, g, records, people, opts.repeat)
+            current = measure(git.Git._parseCommit, g, records, people, opts.repeat)
+            print '{0:<16} {1:>12.1f} {2:>12.1f} {3:>9.2f}x'.format(name, legacy,
+                                                                   current, legacy / current)
+
+        print 'identical result: {0}'.format(same(parse(legacyParseCommit, g, records, False),
+                                                  parse(git.Git._parseCommit, g, records, False)))
+    finally:
+        if dir:
+            shutil.rmtree(dir)
+
+if __name__ == '__main__':
+    main()
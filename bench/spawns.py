@@ -0,0 +1,124 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Counts git processes spawned (and time spent) by git calls which pitweb
+does while rendering summary, log, commit, tree and blob pages.
+
+Usage: python bench/spawns.py [--pitweb DIR] [--repeat N] [--backend B] GIT_DIR
+
+Run it once against the current tree and once with --pitweb pointing to
+a checkout of an older version to get before/after numbers.
+"""
+
+import sys
+import os
+import time
+import optparse
+
+
+def countSpawns(git):
+    """ Wraps git.Popen so that each spawned process is counted """
+    counter = { 'spawns' : 0 }
+    popen = git.Popen
+
+    def Popen(*args, **kwargs):
+        counter['spawns'] += 1
+        return popen(*args, **kwargs)
+
+    git.Popen = Popen
+    return counter
+
+
+def pageSummary(g):
+    tags, heads, remotes = g.refs()
+    list(g.revList('HEAD', max_count = 15))
+    list(g.revList(None, all = True, max_count = 1))
+    for h in heads + remotes:
+        h.commit()
+
+def pageLog(g):
+    list(g.revList('HEAD', max_count = 50))
+    g.refs()
+
+def pageCommit(g):
+    c = g.commit('HEAD')
+    parent = None
+    if len(c.parents) == 1:
+        parent = c.parents[0]
+    list(g.diffTree(c.id, parent, patch = True))
+
+def pageTree(g):
+    for obj in g.tree('HEAD'):
+        if obj.__class__.__name__ == 'GitTree':
+            list(g.tree(obj.id))
+            break
+
+def pageBlob(g):
+    for obj in g.tree('HEAD'):
+        if obj.__class__.__name__ == 'GitBlob':
+            g.blob(obj.id)
+            break
+
+pages = [('summary', pageSummary),
+         ('log',     pageLog),
+         ('commit',  pageCommit),
+         ('tree',    pageTree),
+         ('blob',    pageBlob)]
+
+
+def main():
+    parser = optparse.OptionParser(usage = '%prog [options] GIT_DIR')
+    parser.add_option('--pitweb', default = os.path.join(os.path.dirname(__file__), '..'),
+                      help = 'directory with pitweb sources to measure')
+    parser.add_option('--repeat', type = 'int', default = 20,
+                      help = 'number of requests per page')
+    parser.add_option('--backend', default = None,
+                      help = 'object backend of git.Git (git or native)')
+    opts, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('GIT_DIR is required')
+
+    sys.path.insert(0, os.path.abspath(opts.pitweb))
+    import git
+
+    counter = countSpawns(git)
+
+    kwargs = {}
+    if opts.backend:
+        kwargs['backend'] = opts.backend
+
+    print '{0:<10} {1:>16} {2:>14}'.format('page', 'spawns/request', 'ms/request')
+    for name, page in pages:
+        counter['spawns'] = 0
+        start = time.time()
+        for i in range(0, opts.repeat):
+            # a new Git object for each request, the same way Project does
+            page(git.Git(args[0], **kwargs))
+        elapsed = time.time() - start
+
+        print '{0:<10} {1:>16.2f} {2:>14.2f}'.format(name,
+                    float(counter['spawns']) / opts.repeat,
+                    elapsed * 1000. / opts.repeat)
+
+if __name__ == '__main__':
+    main()
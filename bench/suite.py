@@ -0,0 +1,366 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Benchmark suite: generates synthetic repositories by git fast-import and
+renders every action of Project and the list of projects (ProjectListDir)
+through fake request.
+
+Usage: python bench/suite.py [--pitweb DIR] [--commits N] [--files N]
+                             [--depth N] [--branches N] [--tags N]
+                             [--blob-size N] [--projects N] [--repeat N]
+                             [--backend B] [--dir DIR] [--json FILE]
+
+Each action is measured in a forked process: the first (cold) request,
+then repeat-1 more requests of the same page (warm, with whatever caches
+pitweb keeps in process). Wall time, number of spawned processes (git,
+compressors), bytes written and peak memory (ru_maxrss) of the process
+are reported. With --json the results together with the shape of the
+repository are written to FILE ('-' is stdout) so that runs against
+different versions (--pitweb) can be compared.
+"""
+
+import sys
+import os
+import time
+import json
+import shutil
+import resource
+import tempfile
+import optparse
+import subprocess
+
+import fakereq
+
+
+def gitOut(path, *args):
+    p = subprocess.Popen(['git', '--git-dir=' + path] + list(args),
+                         stdout = subprocess.PIPE)
+    out = p.communicate()[0]
+    if p.returncode != 0:
+        raise RuntimeError('git {0} failed'.format(args[0]))
+    return out
+
+def filePath(i, depth):
+    """ Returns path of i-th file, files are spread over directories
+        depth levels deep (ten subdirectories per level)
+    """
+    dirs = []
+    n = i
+    for l in range(0, depth):
+        dirs.append('d{0}{1}'.format(l, n % 10))
+        n //= 10
+    return '/'.join(dirs + ['file{0}.txt'.format(i)])
+
+def fileData(i, c, size):
+    """ Returns content of i-th file as of c-th commit, about size bytes """
+    line = 'line of file {0} changed by commit {1}\n'.format(i, c)
+    lines = max(1, size // len(line))
+    return ''.join(['{0:>6} {1}'.format(l, line) for l in range(0, lines)])
+
+def createRepo(path, opts):
+    """ Creates bare repository of the given shape. The first commit adds
+        all files, each further commit modifies a few of them. Branches and
+        annotated tags point to commits spread over the history.
+    """
+    subprocess.check_call(['git', 'init', '-q', '--bare', path])
+
+    changes = max(1, min(opts.files, 10))
+    stream = []
+    for c in range(0, opts.commits):
+        msg = 'Commit {0}\n\nSynthetic commit number {0} of benchmark repository.\n'.format(c)
+        stream.append('commit refs/heads/master\n')
+        stream.append('mark :{0}\n'.format(c + 1))
+        stream.append('author Author {0} <author{0}@example.com> {1} +0100\n'.format(c % 7, 1300000000 + c * 3600))
+        stream.append('committer Bench <bench@example.com> {0} +0000\n'.format(1300000000 + c * 3600))
+        stream.append('data {0}\n{1}'.format(len(msg), msg))
+        if c > 0:
+            stream.append('from :{0}\n'.format(c))
+            files = [(c * changes + i) % opts.files for i in range(0, changes)]
+        else:
+            files = range(0, opts.files)
+
+        for i in files:
+            data = fileData(i, c, opts.blob_size)
+            stream.append('M 100644 inline {0}\n'.format(filePath(i, opts.depth)))
+            stream.append('data {0}\n{1}\n'.format(len(data), data))
+
+    for b in range(0, opts.branches):
+        stream.append('reset refs/heads/branch{0}\n'.format(b))
+        stream.append('from :{0}\n\n'.format(opts.commits - b * opts.commits // max(1, opts.branches)))
+
+    for t in range(0, opts.tags):
+        msg = 'Release {0}\n'.format(t)
+        stream.append('tag v{0}\n'.format(t))
+        stream.append('from :{0}\n'.format(1 + t * opts.commits // max(1, opts.tags)))
+        stream.append('tagger Bench <bench@example.com> {0} +0000\n'.format(1300000000 + t * 3600))
+        stream.append('data {0}\n{1}'.format(len(msg), msg))
+
+    p = subprocess.Popen(['git', '--git-dir=' + path, 'fast-import', '--quiet'],
+                         stdin = subprocess.PIPE)
+    p.communicate(''.join(stream))
+    if p.returncode != 0:
+        raise RuntimeError('git fast-import failed')
+
+def createProjects(dir, source, opts):
+    """ Creates directory with opts.projects repositories (the first one is
+        source, the others share its objects), returns its path
+    """
+    projects = os.path.join(dir, 'projects')
+    os.makedirs(projects)
+
+    config = 'description = "Synthetic repository"\n'
+    if opts.backend:
+        config += 'backend = {0!r}\n'.format(opts.backend)
+
+    for i in range(0, opts.projects):
+        path = os.path.join(projects, 'project{0:04d}.git'.format(i))
+        if i == 0:
+            os.rename(source, path)
+        else:
+            subprocess.check_call(['git', 'clone', '-q', '--bare', '--shared',
+                                   os.path.join(projects, 'project0000.git'), path])
+
+        f = open(os.path.join(path, 'pitweb.py'), 'w')
+        f.write(config)
+        f.close()
+
+    return projects
+
+def requests(repo):
+    """ Returns list of tuples (name, query string) of requests covering
+        all actions of Project
+    """
+    head, parent = gitOut(repo, 'rev-list', '--max-count=2', 'HEAD').split()[:2]
+    changed = gitOut(repo, 'diff-tree', '-r', '--name-only', parent, head).split()
+    path = changed[0]
+    treepath = os.path.dirname(path)
+    tree = gitOut(repo, 'rev-parse', '{0}:{1}'.format(head, treepath)).strip()
+    blob = gitOut(repo, 'rev-parse', '{0}:{1}'.format(head, path)).strip()
+
+    return [('summary',   'a=summary'),
+            ('log',       'a=log'),
+            ('log-page',  'a=log;showmsg=1;page=2'),
+            ('refs',      'a=refs'),
+            ('commit',    'a=commit;id={0}'.format(head)),
+            ('diff',      'a=diff;id={0};id2={1}'.format(parent, head)),
+            ('filediff',  'a=filediff;id={0};path={1}'.format(head, path)),
+            ('patch',     'a=patch;id={0}'.format(head)),
+            ('tree',      'a=tree;id={0}'.format(head)),
+            ('tree-path', 'a=tree;id={0};treeid={1};path={2}'.format(head, tree, treepath)),
+            ('blob',      'a=blob;id={0};blobid={1};path={2};filename={3}'
+                                .format(head, blob, treepath, os.path.basename(path))),
+            ('blob-raw',  'a=blob-raw;blobid={0};filename={1}'
+                                .format(blob, os.path.basename(path))),
+            ('snapshot',  'a=snapshot;id={0};format=tgz'.format(head)),
+            ('pull',      'a=pull;path=HEAD')]
+
+
+def countSpawns(git):
+    """ Wraps git.Popen so that each spawned process is counted """
+    counter = { 'spawns' : 0 }
+    popen = git.Popen
+
+    def Popen(*args, **kwargs):
+        counter['spawns'] += 1
+        return popen(*args, **kwargs)
+
+    git.Popen = Popen
+    return counter
+
+def render(page, repeat):
+    """ Renders page (function taking request) repeat times, returns
+        dictionary with results
+    """
+    # modules are loaded before the first request is timed
+    import git
+    import project
+    import project_list
+    counter = countSpawns(git)
+
+    res = {}
+    for i in range(0, repeat):
+        req = fakereq.Request('/', keep = False)
+        counter['spawns'] = 0
+        start = time.time()
+        status = page(req)
+        elapsed = (time.time() - start) * 1000.
+
+        if i == 0:
+            res['cold_ms']     = elapsed
+            res['cold_spawns'] = counter['spawns']
+            res['bytes']       = req.bytes
+            res['status']      = status
+            res['warm_ms']     = []
+            res['warm_spawns'] = []
+        else:
+            res['warm_ms'].append(elapsed)
+            res['warm_spawns'].append(counter['spawns'])
+
+    res['peak_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return res
+
+def measure(page, repeat):
+    """ Runs render() in forked process so that caches are cold and peak
+        memory belongs to the page only
+    """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        try:
+            os.write(wfd, json.dumps(render(page, repeat)))
+        finally:
+            os._exit(0)
+
+    os.close(wfd)
+    data = ''
+    while True:
+        chunk = os.read(rfd, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(rfd)
+    os.waitpid(pid, 0)
+
+    if not data:
+        raise RuntimeError('rendering failed')
+
+    res = json.loads(data)
+    warm_ms = res.pop('warm_ms')
+    warm_spawns = res.pop('warm_spawns')
+    res['warm_ms'] = None
+    res['warm_spawns'] = None
+    if warm_ms:
+        res['warm_ms'] = sorted(warm_ms)[len(warm_ms) // 2]
+        res['warm_spawns'] = float(sum(warm_spawns)) / len(warm_spawns)
+    return res
+
+
+def projectPage(repo, args):
+    def page(req):
+        import project
+        req.args = args
+        return project.Project(req, repo).run()
+    return page
+
+def listPage(projects, uri = '/', args = None):
+    def page(req):
+        import project_list
+        req.uri  = uri
+        req.args = args
+        return project_list.ProjectListDir(req, projects).run()
+    return page
+
+def fmt(value, spec):
+    if value is None:
+        return '{0:>{1}}'.format('-', spec.split('.')[0])
+    return '{0:{1}}'.format(value, spec)
+
+def main():
+    parser = optparse.OptionParser(usage = '%prog [options]')
+    parser.add_option('--pitweb', default = os.path.join(os.path.dirname(__file__), '..'),
+                      help = 'directory with pitweb sources to measure')
+    parser.add_option('--commits', type = 'int', default = 1000,
+                      help = 'number of commits')
+    parser.add_option('--files', type = 'int', default = 500,
+                      help = 'number of files')
+    parser.add_option('--depth', type = 'int', default = 3,
+                      help = 'depth of directories holding files')
+    parser.add_option('--branches', type = 'int', default = 10,
+                      help = 'number of branches besides master')
+    parser.add_option('--tags', type = 'int', default = 20,
+                      help = 'number of annotated tags')
+    parser.add_option('--blob-size', type = 'int', default = 4096,
+                      help = 'approximate size of files in bytes')
+    parser.add_option('--projects', type = 'int', default = 20,
+                      help = 'number of projects in directory of projects')
+    parser.add_option('--repeat', type = 'int', default = 5,
+                      help = 'number of requests of each page')
+    parser.add_option('--backend', default = None,
+                      help = 'object backend of git.Git (git or native)')
+    parser.add_option('--dir', default = None,
+                      help = 'directory to create repositories in (kept)')
+    parser.add_option('--json', default = None,
+                      help = 'file to write results to as JSON (- is stdout)')
+    opts, args = parser.parse_args()
+    if opts.commits < 2 or opts.files < 1 or opts.projects < 1:
+        parser.error('at least 2 commits, 1 file and 1 project are required')
+
+    sys.path.insert(0, os.path.abspath(opts.pitweb))
+
+    dir = opts.dir
+    if dir is None:
+        dir = tempfile.mkdtemp(prefix = 'pitweb-bench-')
+
+    try:
+        projects = os.path.join(dir, 'projects')
+        if not os.path.isdir(projects):
+            createRepo(os.path.join(dir, 'source.git'), opts)
+            createProjects(dir, os.path.join(dir, 'source.git'), opts)
+        repo = os.path.join(projects, 'project0000.git')
+
+        pages = [(name, projectPage(repo, args)) for name, args in requests(repo)]
+        pages.append(('list', listPage(projects)))
+        pages.append(('list-summary', listPage(projects, uri = '/project0000',
+                                               args = 'a=summary')))
+
+        out = sys.stdout
+        if opts.json == '-':
+            out = sys.stderr
+
+        results = []
+        print >>out, '{0:<14} {1:>8} {2:>10} {3:>8} {4:>10} {5:>10} {6:>10}'.format(
+                        'action', 'cold ms', 'cold spawn', 'warm ms', 'warm spawn',
+                        'bytes', 'peak kB')
+        for name, page in pages:
+            res = measure(page, opts.repeat)
+            res['action'] = name
+            results.append(res)
+
+            print >>out, '{0:<14} {1} {2:>10} {3} {4} {5:>10} {6:>10}'.format(
+                            name, fmt(res['cold_ms'], '8.1f'), res['cold_spawns'],
+                            fmt(res['warm_ms'], '8.1f'), fmt(res['warm_spawns'], '10.1f'),
+                            res['bytes'], res['peak_kb'])
+
+        if opts.json:
+            shape = dict([(k, getattr(opts, k))
+                            for k in ['commits', 'files', 'depth', 'branches', 'tags',
+                                      'blob_size', 'projects', 'repeat', 'backend']])
+            doc = { 'pitweb'  : os.path.abspath(opts.pitweb),
+                    'shape'   : shape,
+                    'results' : results }
+
+            if opts.json == '-':
+                f = sys.stdout
+            else:
+                f = open(opts.json, 'w')
+            json.dump(doc, f, indent = 1, sort_keys = True)
+            f.write('\n')
+            if f is not sys.stdout:
+                f.close()
+    finally:
+        if opts.dir is None:
+            shutil.rmtree(dir)
+
+if __name__ == '__main__':
+    main()
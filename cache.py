@@ -0,0 +1,351 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+import os
+import errno
+import fcntl
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ Process-wide least-recently-used cache.
+
+        The cache is bounded by number of items (max_items) and/or by sum
+        of sizes of stored values (max_bytes) where size of a value is
+        computed by sizeof function (len() by default). Zero or None means
+        no limit.
+
+        If on_evict is given it is called as on_evict(key, value) for each
+        item which is pushed out of the cache, replaced by set() or dropped
+        by clear() (not for items removed by delete()).
+
+        All methods are thread-safe.
+    """
+
+    def __init__(self, max_items = None, max_bytes = None, sizeof = len,
+                       on_evict = None):
+        self._max_items = max_items
+        self._max_bytes = max_bytes
+        self._sizeof    = sizeof
+        self._on_evict  = on_evict
+
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock  = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default = None):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return default
+
+            # move to the most recently used end
+            self._items[key] = item
+            return item[0]
+
+    def set(self, key, value):
+        size = 0
+        if self._max_bytes:
+            size = self._sizeof(value)
+            if size > self._max_bytes:
+                # never store values which would flush whole cache
+                self.delete(key)
+                return
+
+        with self._lock:
+            evicted = self._store(key, value, size)
+        self._evict(evicted)
+
+    def setDefault(self, key, create):
+        """ Returns value stored under key. If there is no such value,
+            create() is called and its result is stored and returned. The
+            lookup and the store are atomic, create() is called under lock
+            of the cache so it should be cheap.
+        """
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None:
+                self._items[key] = item
+                return item[0]
+
+            value = create()
+            size = 0
+            if self._max_bytes:
+                size = self._sizeof(value)
+            evicted = self._store(key, value, size)
+
+        self._evict(evicted)
+        return value
+
+    def _store(self, key, value, size):
+        """ Stores value, returns list of (key, value) of evicted items.
+            Must be called with the lock held.
+        """
+        evicted = []
+        old = self._items.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+            if old[0] is not value:
+                evicted.append((key, old[0]))
+
+        self._items[key] = (value, size)
+        self._bytes += size
+
+        while len(self._items) > 0 \
+              and ((self._max_items and len(self._items) > self._max_items) \
+                   or (self._max_bytes and self._bytes > self._max_bytes)):
+            k, item = self._items.popitem(last = False)
+            self._bytes -= item[1]
+            evicted.append((k, item[0]))
+        return evicted
+
+    def _evict(self, evicted):
+        if self._on_evict:
+            for k, v in evicted:
+                self._on_evict(k, v)
+
+    def delete(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None:
+                self._bytes -= item[1]
+
+    def clear(self):
+        with self._lock:
+            items = self._items
+            self._items = OrderedDict()
+            self._bytes = 0
+
+        if self._on_evict:
+            for k, item in items.iteritems():
+                self._on_evict(k, item[0])
+
+
+class DiskCache(object):
+    """ Cache of strings stored as files in directory dir.
+
+        The cache is bounded by sum of sizes of stored values (max_bytes,
+        zero or None means no limit). When the limit is exceeded least
+        recently used files (by mtime which is updated on each read) are
+        removed until the cache shrinks below 90% of the limit.
+
+        The directory may be shared by several processes, values are
+        written to temporary files which are atomically renamed.
+    """
+
+    def __init__(self, dir, max_bytes = None):
+        self._dir       = dir
+        self._max_bytes = max_bytes
+        self._bytes     = None
+        self._lock      = threading.Lock()
+
+    def _path(self, key):
+        h = hashlib.sha1(key).hexdigest()
+        return os.path.join(self._dir, h[:2], h[2:])
+
+    def _open(self, path):
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return f
+
+    def _makeDir(self, path):
+        """ Creates directory of path if it doesn't exist """
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _store(self, path, write):
+        """ Stores value written by write(file) to path, returns its size """
+        self._makeDir(path)
+
+        fd, tmp = tempfile.mkstemp(dir = os.path.dirname(path), prefix = '.tmp-')
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                write(f)
+                size = f.tell()
+            finally:
+                f.close()
+            os.rename(tmp, path)
+        except:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        return size
+
+    def _added(self, size):
+        if not self._max_bytes:
+            return
+
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += size
+            if self._bytes is None or self._bytes > self._max_bytes:
+                self._shrink()
+
+    def get(self, key, default = None):
+        f = self._open(self._path(key))
+        if f is None:
+            return default
+
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def set(self, key, value):
+        if self._max_bytes and len(value) > self._max_bytes:
+            return
+
+        size = self._store(self._path(key), lambda f: f.write(value))
+        self._added(size)
+
+    def generate(self, key, write):
+        """ Returns file object (opened for reading) of value stored under
+            key. If there is no such value it is generated by write(file)
+            first. Generating of the same key is serialized (even among
+            processes) so each value is generated only once.
+        """
+        path = self._path(key)
+        f = self._open(path)
+        if f:
+            return f
+
+        self._makeDir(path)
+        lock = self._lockFile(path)
+        try:
+            # somebody else could generate it meanwhile
+            f = self._open(path)
+            if f:
+                return f
+
+            size = self._store(path, write)
+            f = open(path, 'rb')
+            if self._max_bytes and size > self._max_bytes:
+                # too big to be kept, it would flush whole cache
+                os.unlink(path)
+            else:
+                self._added(size)
+            return f
+        finally:
+            lock.close()
+
+    def _lockFile(self, path):
+        """ Returns opened lock file of value on path locked exclusively """
+        while True:
+            lock = open(path + '.lock', 'a')
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+
+            # the lock file could have been removed (see _remove()) while
+            # we were waiting, the lock is valid only if it is still there
+            try:
+                if os.fstat(lock.fileno()).st_ino == os.stat(path + '.lock').st_ino:
+                    return lock
+            except OSError:
+                pass
+            lock.close()
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            for size, mtime, path in self._files():
+                self._remove(path)
+            self._bytes = 0
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            return False
+
+        # lock file is removed only if nobody holds it, whoever waits for
+        # it finds out it was removed once he gets it
+        try:
+            fd = os.open(path + '.lock', os.O_WRONLY)
+        except OSError:
+            return True
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.unlink(path + '.lock')
+        except (IOError, OSError):
+            pass
+        finally:
+            os.close(fd)
+        return True
+
+    def _files(self):
+        """ Returns list of tuples (size, mtime, path) of stored values """
+        files = []
+        for root, dirs, names in os.walk(self._dir):
+            for name in names:
+                if name.startswith('.tmp-') or name.endswith('.lock'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_size, st.st_mtime, path))
+        return files
+
+    def _shrink(self):
+        # other processes may have changed the directory, so the size is
+        # always recomputed
+        files = self._files()
+        total = sum([f[0] for f in files])
+
+        if total > self._max_bytes:
+            limit = self._max_bytes * 9 // 10
+            files.sort(key = lambda f: f[1])
+            for size, mtime, path in files:
+                if total <= limit:
+                    break
+                if self._remove(path):
+                    total -= size
+
+        self._bytes = total
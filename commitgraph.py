@@ -0,0 +1,260 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+import os
+import re
+import mmap
+import heapq
+import struct
+import itertools
+import threading
+
+patterns = {
+    'committer' : re.compile(r'^committer .* ([0-9]+) [\+-][0-9]+$', re.M),
+}
+
+_NO_PARENT    = 0x70000000
+_EXTRA_EDGES  = 0x80000000
+_LAST_EDGE    = 0x80000000
+
+
+class CommitGraph(object):
+    """ Reader of objects/info/commit-graph file (see
+        Documentation/technical/commit-graph-format.txt in git sources).
+
+        Commits are addressed by their position in the file (index into
+        OID lookup chunk).
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        f = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        m = self._map
+        sig, version, hash_version, num_chunks, num_base \
+            = struct.unpack_from('>4sBBBB', m, 0)
+        if sig != 'CGPH' or version != 1 or hash_version != 1:
+            raise ValueError('Unsupported commit-graph file')
+        if num_base != 0:
+            raise ValueError('Split commit-graph files are not supported')
+
+        self._chunks = {}
+        for i in range(0, num_chunks):
+            id, offset = struct.unpack_from('>4sQ', m, 8 + 12 * i)
+            self._chunks[id] = offset
+
+        for id in ['OIDF', 'OIDL', 'CDAT']:
+            if id not in self._chunks:
+                raise ValueError('Missing {0} chunk in commit-graph'.format(id))
+
+        self._fanout = struct.unpack_from('>256I', m, self._chunks['OIDF'])
+        self.count = self._fanout[255]
+
+        self._oidl = self._chunks['OIDL']
+        self._cdat = self._chunks['CDAT']
+        self._edge = self._chunks.get('EDGE')
+
+    def close(self):
+        self._map.close()
+
+    def lookup(self, id):
+        """ Returns position of commit with hex id or None """
+        sha = id.decode('hex')
+
+        first = ord(sha[0])
+        lo = 0
+        if first > 0:
+            lo = self._fanout[first - 1]
+        hi = self._fanout[first]
+
+        m = self._map
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self._oidl + 20 * mid
+            cur = m[pos:pos + 20]
+            if cur < sha:
+                lo = mid + 1
+            elif cur > sha:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def id(self, pos):
+        """ Returns hex id of commit at position """
+        off = self._oidl + 20 * pos
+        return self._map[off:off + 20].encode('hex')
+
+    def _data(self, pos):
+        return struct.unpack_from('>IIII', self._map, self._cdat + 36 * pos + 20)
+
+    def parents(self, pos):
+        """ Returns list of positions of parents """
+        p1, p2, gen, time = self._data(pos)
+
+        parents = []
+        if p1 != _NO_PARENT:
+            parents.append(p1)
+
+        if p2 == _NO_PARENT:
+            return parents
+
+        if not p2 & _EXTRA_EDGES:
+            parents.append(p2)
+            return parents
+
+        # octopus merge, parents 2..n are stored in EDGE chunk
+        off = self._edge + 4 * (p2 & 0x7fffffff)
+        while True:
+            edge = struct.unpack_from('>I', self._map, off)[0]
+            parents.append(edge & 0x7fffffff)
+            if edge & _LAST_EDGE:
+                break
+            off += 4
+        return parents
+
+    def commitTime(self, pos):
+        """ Returns committer date (epoch) of commit at position """
+        p1, p2, gen, time = self._data(pos)
+        return ((gen & 0x3) << 32) | time
+
+
+_graphs = {}
+_lock = threading.Lock()
+
+def load(dir):
+    """ Returns CommitGraph of repository in dir (cached per process and
+        re-read when the file changes) or None if there is no usable
+        commit-graph file.
+    """
+    path = os.path.join(dir, 'objects', 'info', 'commit-graph')
+    try:
+        st = os.stat(path)
+        stamp = (st.st_mtime, st.st_size, st.st_ino)
+    except OSError:
+        stamp = None
+
+    with _lock:
+        cached = _graphs.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        graph = None
+        if stamp:
+            try:
+                graph = CommitGraph(path)
+            except (IOError, OSError, ValueError, struct.error):
+                graph = None
+        _graphs[path] = (stamp, graph)
+
+        if cached and cached[1] is not None:
+            cached[1].close()
+        return graph
+
+
+def _readCommit(id, objects):
+    """ Returns tuple (committer date, list of parents) of commit read by
+        objects or None if there is no such commit.
+    """
+    obj = objects.catFileBatch(id)
+    if not obj or obj[1] != 'commit':
+        return None
+
+    header = obj[3].split('\n\n', 1)[0]
+    parents = [l[7:47] for l in header.split('\n') if l[:7] == 'parent ']
+    m = patterns['committer'].search(header)
+    time = 0
+    if m:
+        time = int(m.group(1))
+    return (time, parents)
+
+def walk(starts, graph, objects):
+    """ Generates ids of commits reachable from starts (list of commit ids)
+        in the same order as git rev-list does it (by committer date,
+        newest first).
+
+        Parents and dates are taken from graph (which may be None) and
+        commits which are not in the graph are read by objects (anything
+        with catFileBatch() method, i.e. GitComm or ObjectStore).
+    """
+    queue   = []
+    seen    = set()
+    counter = itertools.count()
+
+    # load() closes replaced graph, the walk goes on without it then
+    current = [graph]
+
+    def push(id, pos):
+        if id in seen:
+            return
+        seen.add(id)
+
+        time    = None
+        parents = None
+        graph   = current[0]
+        if graph is not None:
+            try:
+                if pos is None:
+                    pos = graph.lookup(id)
+                if pos is not None:
+                    time = graph.commitTime(pos)
+            except ValueError:
+                current[0] = None
+
+        if time is None:
+            pos = None
+            commit = _readCommit(id, objects)
+            if commit is None:
+                # e.g. missing parents in shallow repository
+                return
+            time, parents = commit
+
+        heapq.heappush(queue, (-time, next(counter), id, pos, parents))
+
+    for id in starts:
+        push(id, None)
+
+    while len(queue) > 0:
+        time, c, id, pos, parents = heapq.heappop(queue)
+        yield id
+
+        edges = None
+        graph = current[0]
+        if pos is not None and graph is not None:
+            try:
+                edges = [(graph.id(p), p) for p in graph.parents(pos)]
+            except ValueError:
+                current[0] = None
+
+        if edges is None:
+            if parents is None:
+                commit = _readCommit(id, objects)
+                parents = commit and commit[1] or []
+            edges = [(p, None) for p in parents]
+
+        for p, ppos in edges:
+            push(p, ppos)
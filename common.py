@@ -22,11 +22,17 @@
 
 from mod_python import apache, util
 
+# output is passed to the request in chunks of (at least) this size
+write_buffer_size = 32 * 1024
+
 class ModPythonOutput(object):
     """ Class able to produce output using mod_python's request object """
 
     def __init__(self, req):
         self._req = req
+        self._capture = None
+        self._buffer = []
+        self._buffered = 0
 
     def _esc(self, s):
         """ Replaces special characters by HTML escape sequences """
@@ -36,15 +42,73 @@ class ModPythonOutput(object):
         return s
 
     def write(self, s):
-        self._req.write(s)
+        """ Writes s to buffer which is passed to request once it is big
+            enough (or by flush()).
+        """
+        self._buffer.append(s)
+        self._buffered += len(s)
+        if self._buffered >= write_buffer_size:
+            self.flush()
+
+    def writeAll(self, chunks):
+        """ Writes all strings from iterable chunks """
+        for s in chunks:
+            self.write(s)
+
+    def flush(self):
+        """ Passes buffered output to request """
+        if len(self._buffer) == 0:
+            return
+
+        data = ''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+
+        if self._capture is not None:
+            self._capture.append(data)
+        self._req.write(data)
+
+    def startCapture(self):
+        """ Starts recording of everything written by write() """
+        self.flush()
+        self._capture = []
+
+    def stopCapture(self):
+        """ Stops recording and returns recorded output """
+        self.flush()
+        out = ''.join(self._capture)
+        self._capture = None
+        return out
 
     def setContentType(self, type):
         self._req.content_type = type
 
+    def setContentLength(self, length):
+        self._req.set_content_length(length)
+
+    def setETag(self, etag, cache_control = 'no-cache'):
+        self._req.headers_out['ETag'] = etag
+        self._req.headers_out['Cache-Control'] = cache_control
+
+    def notModified(self, etag):
+        """ Returns True if If-None-Match header of request matches etag """
+        header = self._req.headers_in.get('If-None-Match')
+        if not header:
+            return False
+
+        for tag in header.split(','):
+            tag = tag.strip()
+            if tag[:2] == 'W/':
+                tag = tag[2:]
+            if tag == '*' or tag == etag:
+                return True
+        return False
+
     def setFilename(self, filename):
         self._req.headers_out['Content-disposition'] = ' attachment; filename="{0}"'.format(filename)
 
     def run(self):
         self.write("This method should be overloaded")
+        self.flush()
         return apache.OK
 
@@ -21,10 +21,17 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 ##
 
+import os
 import re
 import datetime
-from subprocess import Popen, PIPE, STDOUT
+from subprocess import Popen, PIPE, STDOUT, CalledProcessError
 import stat
+import threading
+
+import cache
+import commitgraph
+import objstore
+import refstore
 
 basic_patterns = {
     'id' : r'[0-9a-fA-F]{40}',
@@ -37,8 +44,263 @@ patterns = {
     'person2'   : re.compile(r'(.*) <(.*)>'),
 	'diff-tree' : re.compile(r'^:([0-7]{6}) ([0-7]{6}) ([0-9a-fA-F]{40}) ([0-9a-fA-F]{40}) (.)([0-9]{0,3})\t(.*)$'),
 	'diff-tree-patch' : re.compile(r'^diff --git'),
+    'full-id'   : re.compile(r'^[0-9a-f]{40}$'),
 }
 
+_object_types = ('commit', 'tree', 'blob', 'tag')
+
+# Maximal number of live `git cat-file --batch(-check)` processes held by
+# one worker process (each repository needs up to two of them).
+cat_file_max_procs = 8
+
+# Number of queries written to cat-file process before its answers are
+# read back (the answers must fit into pipe buffer).
+cat_file_chunk = 256
+
+# Number of repositories whose parsed refs are cached by Git.refs()
+refs_cache_size = 64
+
+# Size of chunks read from pipes by GitComm iterators
+pipe_chunk = 64 * 1024
+
+# Blobs bigger than this (in bytes) are streamed from `git cat-file blob`
+# instead of being read whole
+blob_stream_size = 1024 * 1024
+
+# Number of repositories whose date of last change is cached by
+# Git.lastChange()
+last_change_cache_size = 4096
+
+# Number of parsed tree objects (and of resolved paths to trees) cached by
+# Git.tree()
+tree_cache_size = 1024
+
+
+class GitCatFile(object):
+    """ Long-lived `git cat-file --batch` (or `--batch-check` if check is
+        True) process connected to current process through pipes.
+
+        Objects are queried by query() and queryMany() methods. If the
+        process dies it is transparently started again. Once the object is
+        closed (evicted from the pool of processes) queries are passed to
+        the process of the pool.
+    """
+
+    def __init__(self, gitbin, dir, check = False):
+        self._gitbin = gitbin
+        self._dir    = dir
+        self._check  = check
+        self._pipe   = None
+        self._closed = False
+        self._lock   = threading.Lock()
+
+    def _start(self):
+        comm = [self._gitbin, '--git-dir={0}'.format(self._dir), 'cat-file']
+        if self._check:
+            comm.append('--batch-check')
+        else:
+            comm.append('--batch')
+
+        devnull = open(os.devnull, 'w')
+        try:
+            self._pipe = Popen(comm, stdin = PIPE, stdout = PIPE,
+                                     stderr = devnull, bufsize = -1,
+                                     close_fds = True)
+        finally:
+            devnull.close()
+
+    def _alive(self):
+        return self._pipe is not None and self._pipe.poll() is None
+
+    def _readAnswer(self):
+        """ Reads one answer from the process and returns tuple
+            (id, type, size, data) or None if the object is missing.
+            In --batch-check mode data is None.
+        """
+        header = self._pipe.stdout.readline()
+        if not header:
+            raise IOError('git cat-file terminated')
+
+        # "<obj> missing" or "<obj> ambiguous" (obj may contain spaces)
+        header = header.rstrip('\n')
+        if header.endswith((' missing', ' ambiguous')):
+            return None
+
+        p = header.split(' ')
+        if len(p) != 3 or p[1] not in _object_types:
+            raise ValueError('Unexpected answer of git cat-file')
+
+        id, type, size = p[0], p[1], int(p[2])
+
+        data = None
+        if not self._check:
+            data = self._pipe.stdout.read(size + 1)
+            if len(data) != size + 1:
+                raise IOError('git cat-file terminated')
+            data = data[:-1]
+
+        return (id, type, size, data)
+
+    def _queryMany(self, objs):
+        answers = []
+        for i in range(0, len(objs), cat_file_chunk):
+            chunk = objs[i:i + cat_file_chunk]
+            self._pipe.stdin.write(''.join([o + '\n' for o in chunk]))
+            self._pipe.stdin.flush()
+
+            for o in chunk:
+                answers.append(self._readAnswer())
+        return answers
+
+    def queryMany(self, objs):
+        """ Returns list of answers (see query()) for all objects in objs """
+        with self._lock:
+            if not self._closed:
+                if not self._alive():
+                    self._start()
+
+                try:
+                    return self._queryMany(objs)
+                except (IOError, OSError, ValueError):
+                    # the process died (or it is out of sync), start new
+                    # one and try it once more
+                    self._kill()
+                    self._start()
+                    return self._queryMany(objs)
+
+        # evicted from the pool meanwhile, don't start a process outside
+        # of it
+        cat_file = catFileProcess(self._gitbin, self._dir, self._check)
+        return cat_file.queryMany(objs)
+
+    def query(self, obj):
+        """ Returns tuple (id, type, size, data) describing the object or
+            None if there is no such object. In --batch-check mode data is
+            always None.
+        """
+        return self.queryMany([obj])[0]
+
+    def _kill(self):
+        if self._pipe is None:
+            return
+
+        try:
+            self._pipe.stdin.close()
+            self._pipe.stdout.close()
+            if self._pipe.poll() is None:
+                self._pipe.kill()
+            self._pipe.wait()
+        except (IOError, OSError):
+            pass
+        self._pipe = None
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._kill()
+
+
+def _catFileEvict(key, cat_file):
+    cat_file.close()
+
+# Process-wide pool of cat-file processes keyed by (gitbin, dir, check)
+_cat_files = cache.LRUCache(max_items = cat_file_max_procs,
+                            on_evict = _catFileEvict)
+
+def catFileProcess(gitbin, dir, check = False):
+    """ Returns (possibly already running) GitCatFile from the pool """
+    key = (gitbin, dir, check)
+    return _cat_files.setDefault(key, lambda: GitCatFile(gitbin, dir, check))
+
+
+# Process-wide cache of parsed refs, dir -> (refstore stamp, refs)
+_refs_cache = cache.LRUCache(max_items = refs_cache_size)
+
+# Process-wide cache of decorations, dir -> (refstore stamp, index)
+_decorations_cache = cache.LRUCache(max_items = refs_cache_size)
+
+# Process-wide cache of dates of last change, dir -> (refstore stamp, date)
+_last_change_cache = cache.LRUCache(max_items = last_change_cache_size)
+
+# Process-wide cache of tree listings,
+# tree id -> tuple of entries (mode, name, id, size of blob or '-')
+_trees = cache.LRUCache(max_items = tree_cache_size)
+
+# Process-wide cache of resolved paths, (full id, path) -> tree id
+_tree_paths = cache.LRUCache(max_items = tree_cache_size)
+
+
+def _kill(pipe):
+    try:
+        pipe.kill()
+    except OSError:
+        pass
+
+def _pipeChunks(pipes, check = False):
+    """ Generates chunks of output of the last of pipes (processes
+        connected by pipes) as they are produced. If the generator is not
+        exhausted (closed earlier), the processes are killed.
+
+        If check is True, CalledProcessError is raised at the end of output
+        if any of the processes failed.
+    """
+    fd = pipes[-1].stdout.fileno()
+    finished = False
+    try:
+        while True:
+            # returns whatever is available, doesn't wait for full chunk
+            chunk = os.read(fd, pipe_chunk)
+            if not chunk:
+                break
+            yield chunk
+        finished = True
+    finally:
+        pipes[-1].stdout.close()
+        for pipe in pipes:
+            # processes which wrote whole output are about to exit
+            if not finished and pipe.poll() is None:
+                _kill(pipe)
+            pipe.wait()
+
+    if check and finished:
+        for pipe in pipes:
+            if pipe.returncode != 0:
+                raise CalledProcessError(pipe.returncode, pipe.comm)
+
+def _sliceChunks(chunks, start, length):
+    """ Generates chunks of length bytes starting at offset start of data
+        generated by chunks (to the end if length is None).
+    """
+    try:
+        for chunk in chunks:
+            if start >= len(chunk):
+                start -= len(chunk)
+                continue
+            if start > 0:
+                chunk = chunk[start:]
+                start = 0
+
+            if length is not None:
+                if len(chunk) >= length:
+                    yield chunk[:length]
+                    break
+                length -= len(chunk)
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def _fileChunks(f):
+    """ Generates chunks of content of file f and closes it """
+    try:
+        while True:
+            chunk = f.read(pipe_chunk)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
 
 class GitComm(object):
     """ This class is 1:1 interface to git commands. Meaning of most
@@ -46,13 +308,20 @@ class GitComm(object):
         of corresponding git commands.
 
         Each method returns whole output of corresponding git command
-        without any modifications (no parsing is performed).
+        without any modifications (no parsing is performed). Methods which
+        accept sep argument return generator of records (output split by
+        sep) instead, records are generated as they are read from the pipe
+        so the whole output is never held in memory.
 
         Meaning of this class is as thin layer between git commands and
         python which is easier to use. All commands are run in other
         process using subprocess module and connected to currect process
         using pipe - subsequently, whole output is read and returned.
 
+        The exceptions are catFileBatch*() methods which talk to long-lived
+        `git cat-file --batch` processes shared by all GitComm objects of
+        the same repository (see GitCatFile).
+
         The only argument of constructor is pathname to directory where git
         repository is located (see doc of git --git-dir).
     """
@@ -61,24 +330,72 @@ class GitComm(object):
         self._dir = dir
         self._gitbin = gitbin
 
-    def _gitPipe(self, args):
+    def _gitPipe(self, args, stderr = STDOUT):
         comm = [self._gitbin, '--git-dir={0}'.format(self._dir)]
         comm.extend(args)
 
-        pipe = Popen(comm, stdout = PIPE, stderr = STDOUT)
+        pipe = Popen(comm, stdout = PIPE, stderr = stderr)
+        pipe.comm = comm
         return pipe
 
-    def _git(self, args):
+    def _git(self, args, timeout = None):
         pipe = self._gitPipe(args)
-        out = pipe.stdout.read()
-        pipe.stdout.close()
+
+        timer = None
+        if timeout:
+            # git running too long is killed, output read so far is returned
+            timer = threading.Timer(timeout, _kill, [pipe])
+            timer.daemon = True
+            timer.start()
+
+        try:
+            out = pipe.stdout.read()
+        finally:
+            pipe.stdout.close()
+            if timer:
+                timer.cancel()
 
         return out
 
+    def _gitIter(self, args, sep):
+        """ Generates records of output of git command separated by sep.
+            If the generator is not exhausted (closed earlier), git process
+            is killed.
+        """
+        chunks = _pipeChunks([self._gitPipe(args)])
+        try:
+            pending = []
+            for chunk in chunks:
+                if sep not in chunk:
+                    pending.append(chunk)
+                    continue
+
+                records = chunk.split(sep)
+                pending.append(records[0])
+                yield ''.join(pending)
+
+                for i in range(1, len(records) - 1):
+                    yield records[i]
+                pending = [records[-1]]
+
+            rest = ''.join(pending)
+            if len(rest) > 0:
+                yield rest
+        finally:
+            chunks.close()
+
+    def _run(self, args, sep, timeout = None):
+        if sep is None:
+            return self._git(args, timeout)
+        return self._gitIter(args, sep)
+
     def revList(self, obj = 'HEAD', parents = False, header = False,
-                      max_count = -1, all = False):
+                      max_count = -1, all = False, skip = 0, sep = None,
+                      timeout = None):
         """ git-rev-list(1)
                 Lists commit objects in reverse chronological order.
+                If timeout (in seconds) is given, git is killed after that
+                time (not used with sep).
         """
 
         comm = ['rev-list']
@@ -89,13 +406,15 @@ class GitComm(object):
             comm.append('--header')
         if max_count > 0:
             comm.append('--max-count={0}'.format(max_count))
+        if skip > 0:
+            comm.append('--skip={0}'.format(skip))
 
         if not all and obj:
             comm.append(obj)
         if all:
             comm.append('--all')
 
-        return self._git(comm)
+        return self._run(comm, sep, timeout)
 
     def forEachRef(self, format = None, sort = None, pattern = None):
         """ git-for-each-ref(1)
@@ -120,9 +439,10 @@ class GitComm(object):
 
 
     def catFile(self, obj = 'HEAD', type = 'commit', size = False,
-                      pretty = False):
+                      pretty = False, sep = None, stream = False):
         """ git-cat-file(1)
                 Provide content or type and size information for repository objects.
+                If stream is True, generator of chunks of output is returned.
         """
 
         comm = ['cat-file']
@@ -137,9 +457,33 @@ class GitComm(object):
             comm.append('-p')
 
         comm.append(obj)
-        return self._git(comm)
+        if stream:
+            return _pipeChunks([self._gitPipe(comm)])
+        return self._run(comm, sep)
+
+    def catFileBatch(self, obj):
+        """ git-cat-file(1) --batch
+                Returns tuple (id, type, size, data) or None if object does
+                not exist.
+        """
+        return catFileProcess(self._gitbin, self._dir).query(obj)
+
+    def catFileBatchMany(self, objs):
+        """ git-cat-file(1) --batch
+                Returns list of answers of catFileBatch() for all objects
+                from objs list (queried in one batch).
+        """
+        return catFileProcess(self._gitbin, self._dir).queryMany(objs)
 
-    def diffTree(self, obj = 'HEAD', parent = None, patch = False):
+    def catFileBatchCheck(self, objs):
+        """ git-cat-file(1) --batch-check
+                Returns list of tuples (id, type, size, None) (or None for
+                missing objects), one for each object from objs list.
+        """
+        return catFileProcess(self._gitbin, self._dir, True).queryMany(objs)
+
+    def diffTree(self, obj = 'HEAD', parent = None, patch = False, paths = None,
+                       sep = None):
         comm = ['diff-tree']
 
         comm.append('-r')
@@ -157,10 +501,14 @@ class GitComm(object):
             comm.append('-c')
 
         comm.append(obj)
-        return self._git(comm)
+
+        if paths:
+            comm.append('--')
+            comm.extend(paths)
+        return self._run(comm, sep)
 
     def lsTree(self, obj = 'HEAD', recursive = False, long = False,
-                     full_tree = False, zeroterm = True):
+                     full_tree = False, zeroterm = True, sep = None):
         comm = ['ls-tree']
 
         if recursive:
@@ -173,9 +521,9 @@ class GitComm(object):
             comm.append('-z')
 
         comm.append(obj)
-        return self._git(comm)
+        return self._run(comm, sep)
 
-    def formatPatch(self, id, id2):
+    def formatPatch(self, id, id2, sep = None):
         comm = ['format-patch']
 
         comm.append('-n')
@@ -189,30 +537,67 @@ class GitComm(object):
         else:
             comm.append(id + '..' + id2)
 
-        return self._git(comm)
+        return self._run(comm, sep)
 
-    def archive(self, id, format = 'tar', prefix = 'a/', compress = None):
+    def archive(self, id, format = 'tar', prefix = 'a/', compress = None,
+                      stream = False):
+        """ git-archive(1)
+                Output of git archive is piped through compress command (if
+                given). If stream is True, generator of chunks of the
+                archive is returned. Error output is discarded and
+                CalledProcessError is raised if git or compressor fails.
+        """
         comm = ['archive']
         comm.append('--format={0}'.format(format))
         comm.append('--prefix={0}'.format(prefix))
         comm.append(id)
 
-        if compress:
-            pipe = self._gitPipe(comm)
-            compressor = Popen([compress], stdout = PIPE, stderr = STDOUT, stdin = pipe.stdout)
-            s = compressor.stdout.read()
-            compressor.stdout.close()
-            return s
-        else:
-            return self._git(comm)
+        devnull = open(os.devnull, 'w')
+        try:
+            pipes = [self._gitPipe(comm, stderr = devnull)]
+            if compress:
+                compressor = Popen([compress], stdout = PIPE, stderr = devnull,
+                                   stdin = pipes[0].stdout)
+                compressor.comm = [compress]
+                # only compressor reads output of git now
+                pipes[0].stdout.close()
+                pipes.append(compressor)
+        finally:
+            devnull.close()
+
+        chunks = _pipeChunks(pipes, check = True)
+        if stream:
+            return chunks
+        return ''.join(chunks)
 
 class GitDate(object):
+    """ Date kept as epoch and timezone (as written by git), datetime
+        objects are created only when the date is formatted.
+    """
+
+    __slots__ = ('epoch', 'local_tz')
+
     def __init__(self, epoch, tz):
-        self.gmt      = None
-        self.local    = None
-        self.local_tz = None
+        self.epoch    = int(epoch)
+        self.local_tz = tz
+
+    @property
+    def local(self):
+        return datetime.datetime.fromtimestamp(self.epoch)
 
-        self._parseEpochTz(epoch, tz)
+    @property
+    def gmt(self):
+        tz = self.local_tz
+
+        # prepare gmt epoch
+        h = int(tz[1:3])
+        m = int(tz[4:])
+        if tz[0] == '+':
+            gmtepoch = self.epoch - ((h + m/60) * 3600)
+        else:
+            gmtepoch = self.epoch + ((h + m/60) * 3600)
+
+        return datetime.datetime.fromtimestamp(gmtepoch)
 
     def format(self, format):
         return self.local.strftime(format)
@@ -234,28 +619,46 @@ class GitDate(object):
 
         return date
 
-    def _parseEpochTz(self, epoch, tz):
-        epoch = int(epoch)
+class GitPerson(object):
+    """ Person with date. It is given either by person and date or by raw
+        line of commit or tag header which is parsed on first access.
+    """
 
-        # prepare gmt epoch
-        h = int(tz[1:3])
-        m = int(tz[4:])
-        if tz[0] == '+':
-            gmtepoch = epoch - ((h + m/60) * 3600)
-        else:
-            gmtepoch = epoch + ((h + m/60) * 3600)
+    __slots__ = ('_line', '_person', '_date')
 
-        date = datetime.datetime.fromtimestamp(epoch)
-        gmtdate = datetime.datetime.fromtimestamp(gmtepoch)
+    def __init__(self, person = None, date = None, line = None):
+        self._line   = line
+        self._person = person
+        self._date   = date
 
-        self.gmt      = gmtdate
-        self.local    = date
-        self.local_tz = tz
+    def _parse(self):
+        global patterns
 
-class GitPerson(object):
-    def __init__(self, person, date):
-        self.person = person
-        self.date   = date
+        person = self._line
+        epoch = '0'
+        tz = '+0000'
+
+        match = patterns['person'].match(self._line)
+        if match:
+            person = match.group(1)
+            epoch  = match.group(2)
+            tz     = match.group(3)
+
+        self._person = person
+        self._date   = GitDate(epoch = epoch, tz = tz)
+        self._line   = None
+
+    @property
+    def person(self):
+        if self._line is not None:
+            self._parse()
+        return self._person
+
+    @property
+    def date(self):
+        if self._line is not None:
+            self._parse()
+        return self._date
 
     def __str__(self):
         return '<GitPerson person={0}, date={1}>'.format(self.person, str(self.date))
@@ -268,6 +671,8 @@ class GitPerson(object):
         return m.group(1)
 
 class GitObj(object):
+    __slots__ = ('git', 'id')
+
     def __init__(self, git, id = None):
         self.git = git
         self.id  = id
@@ -310,18 +715,38 @@ class GitObj(object):
             return 'unknown'
 
 class GitCommit(GitObj):
+    """ Author and committer are GitPerson objects or raw header lines
+        (turned into GitPerson on first access).
+    """
+
+    __slots__ = ('tree', 'parents', '_author', '_committer', 'comment',
+                 'tags', 'heads', 'remotes')
+
     def __init__(self, git, id, tree, parents, author, committer, comment):
         super(GitCommit, self).__init__(git, id)
 
-        self.tree      = tree
-        self.parents   = parents
-        self.author    = author
-        self.committer = committer
-        self.comment   = comment
-
-        self.tags    = []
-        self.heads   = []
-        self.remotes = []
+        self.tree       = tree
+        self.parents    = parents
+        self._author    = author
+        self._committer = committer
+        self.comment    = comment
+
+        # most commits have no refs, they share one empty tuple
+        self.tags    = ()
+        self.heads   = ()
+        self.remotes = ()
+
+    @property
+    def author(self):
+        if type(self._author) is str:
+            self._author = GitPerson(line = self._author)
+        return self._author
+
+    @property
+    def committer(self):
+        if type(self._committer) is str:
+            self._committer = GitPerson(line = self._committer)
+        return self._committer
 
     def commentFirstLine(self):
         lines = self.comment.split('\n', 1)
@@ -335,6 +760,8 @@ class GitCommit(GitObj):
         return lines[1]
 
 class GitTag(GitObj):
+    __slots__ = ('objid', 'name', 'msg', 'tagger')
+
     def __init__(self, git, id, objid = None, name = '', msg = '', tagger = None):
         super(GitTag, self).__init__(git, id)
 
@@ -344,18 +771,30 @@ class GitTag(GitObj):
         self.tagger = tagger
 
 class GitHead(GitObj):
-    def __init__(self, git, id, name = ''):
+    __slots__ = ('name', '_commit')
+
+    def __init__(self, git, id, name = '', commit = None):
         super(GitHead, self).__init__(git, id)
 
         self.name  = name
+        self._commit = commit
 
     def commit(self):
-        c = self.git.revList(self.id, max_count = 1)
-        return c[0]
+        """ Returns tip commit (read together with refs if possible) """
+        if self._commit is None:
+            self._commit = self.git.commit(self.id)
+        return self._commit
 
 class GitDiffTree(GitObj):
+    __slots__ = ('from_mode', 'to_mode', 'from_id', 'to_id', 'status',
+                 'similarity', 'from_file', 'to_file', 'patch',
+                 'from_mode_oct', 'to_mode_oct', 'from_file_type',
+                 'to_file_type')
+
     def __init__(self, git, from_mode, to_mode, from_id, to_id, status,
                             similarity, from_file, to_file, patch = ''):
+        super(GitDiffTree, self).__init__(git)
+
         self.from_mode = from_mode
         self.to_mode   = to_mode
         self.from_id   = from_id
@@ -375,6 +814,8 @@ class GitDiffTree(GitObj):
             self.similarity = '{0}%'.format(int(self.similarity))
 
 class GitTree(GitObj):
+    __slots__ = ('name', 'mode', 'size', 'mode_oct')
+
     def __init__(self, git, id, name, mode, size):
         super(GitTree, self).__init__(git, id)
 
@@ -385,6 +826,8 @@ class GitTree(GitObj):
         self.mode_oct = int(mode, 8)
 
 class GitBlob(GitObj):
+    __slots__ = ('name', 'mode', 'size', 'data', 'mode_oct')
+
     def __init__(self, git, id, name = '', mode = '', size = '', data = ''):
         super(GitBlob, self).__init__(git, id)
 
@@ -399,177 +842,583 @@ class GitBlob(GitObj):
 
 
 
+# Snapshot types, type -> (format of git archive, compressor, extension)
+_archive_types = {
+    'tgz'  : ('tar', 'gzip',  '.tar.gz'),
+    'tbz2' : ('tar', 'bzip2', '.tar.bz2'),
+    'txz'  : ('tar', 'xz',    '.tar.xz'),
+    'zip'  : ('zip', None,    '.zip'),
+}
+
+def _addDecoration(index, target, ref):
+    refs = index.get(target)
+    if refs is None:
+        index[target] = [ref]
+    else:
+        refs.append(ref)
+
+def _decorationIndex(tags, heads, remotes):
+    """ Returns index of given GitTag and GitHead objects in the form of
+        Git.decorations()
+    """
+    index = {}
+    for t in tags:
+        _addDecoration(index, t.objid, ('refs/tags/' + t.name, t.id, t.objid))
+    for h in heads:
+        _addDecoration(index, h.id, ('refs/heads/' + h.name, h.id, h.id))
+    for r in remotes:
+        _addDecoration(index, r.id, ('refs/remotes/' + r.name, r.id, r.id))
+    return index
+
+
 class Git(object):
-    def __init__(self, dir, gitbin = '/usr/bin/git'):
+    """ Parsed view of git repository.
+
+        Objects (commits, trees, blobs) are read according to backend:
+        'git' uses `git cat-file --batch` processes (see GitComm), 'native'
+        reads loose objects and packfiles directly (see objstore).
+    """
+
+    def __init__(self, dir, gitbin = '/usr/bin/git', backend = 'git'):
         global patterns
 
+        self._dir = os.path.realpath(dir)
+        self._backend = backend
         self._git = GitComm(dir, gitbin)
+        self._refs = refstore.RefStore(dir)
         self._patterns = patterns
 
-    def revList(self, obj = 'HEAD', max_count = -1, all = False):
-        # get raw data
-        res = self._git.revList(obj, parents = True, header = True,
-                                     max_count = max_count, all = all)
+        if backend == 'native':
+            self._objects = objstore.ObjectStore(dir, fallback = self._git)
+        else:
+            self._objects = self._git
 
-        # split into hunks (each corresponding with one commit)
-        commits_str = res.split('\x00')
+    def revList(self, obj = 'HEAD', max_count = -1, all = False, skip = 0):
+        """ Generates at most max_count commits (all if max_count is not
+            positive) reachable from obj, the first skip commits are
+            omitted.
+        """
+        ids = self._revWalk(obj, all)
+        if ids is None:
+            for commit in self._revListGit(obj, max_count, all, skip):
+                yield commit
+            return
+
+        # only commits which are really returned are read and parsed
+        count = 0
+        for id in ids:
+            if skip > 0:
+                skip -= 1
+                continue
+            if max_count > 0 and count >= max_count:
+                break
+
+            o = self._objects.catFileBatch(id)
+            if o:
+                count += 1
+                yield self._parseCommitObject(id, o[3])
+
+    def _revWalk(self, obj, all):
+        """ Returns generator of ids of commits in rev-list order (see
+            commitgraph.walk()) or None if the history should be rather
+            walked by git rev-list (no commit-graph file and not native
+            backend, or obj is not a single revision).
+        """
+        graph = commitgraph.load(self._dir)
+        if graph is None and self._backend != 'native':
+            return None
+
+        if all:
+            # the same order as git uses (it matters for commits with the
+            # same date)
+            names = [r[1] for r in self._refs.refs()] + ['HEAD']
+        elif obj and '..' not in obj and obj[0] != '^':
+            names = [obj]
+        else:
+            return None
+
+        infos = self._objects.catFileBatchCheck([n + '^{commit}' for n in names])
+        starts = [info[0] for info in infos if info]
+        return commitgraph.walk(starts, graph, self._objects)
+
+    def _revListGit(self, obj, max_count, all, skip):
+        # hunks (each corresponding with one commit) as they come from git
+        commits_str = self._git.revList(obj, parents = True, header = True,
+                                             max_count = max_count, all = all,
+                                             skip = skip, sep = '\x00')
 
         # create GitCommit object from each string hunk
-        commits = []
         for commit_str in commits_str:
             if len(commit_str) > 1:
-                commits.append(self._parseCommit(commit_str))
+                yield self._parseCommit(commit_str)
 
-        return commits
+    def stamp(self):
+        """ Returns hashable value which changes whenever any ref or HEAD
+            changes.
+        """
+        head = self._refs.symbolicRef('HEAD')
+        if head is None:
+            head = self._refs.lookup('HEAD')
+        return (self._refs.stamp(), head)
+
+    def resolve(self, names):
+        """ Returns list of full ids of objects referred by names (None for
+            names which don't refer to any object).
+        """
+        ids = []
+        for info in self._objects.catFileBatchCheck(names):
+            if info:
+                ids.append(info[0])
+            else:
+                ids.append(None)
+        return ids
+
+    def lastChange(self, timeout = None):
+        """ Returns committer date (GitDate) of the newest commit reachable
+            from any ref or None if there is no commit.
+
+            The date is cached per process until some ref changes. timeout
+            limits time git rev-list may run (if it is needed at all), False
+            is returned without caching if it runs out. Reading commit-graph
+            and objects directly is not limited, callers which must not
+            wait (list of projects) stop waiting for the result instead.
+        """
+        stamp = self._refs.stamp()
+        cached = _last_change_cache.get(self._dir)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        commit = None
+        ids = self._revWalk(None, True)
+        if ids is not None:
+            for id in ids:
+                commit = self.commit(id)
+                break
+        else:
+            out = self._git.revList(None, header = True, max_count = 1,
+                                          all = True, timeout = timeout)
+            if len(out) > 0 and out[-1] != '\x00':
+                # killed before the commit was written whole
+                return False
+            if len(out) > 1:
+                commit = self._parseCommit(out[:-1])
+
+        date = None
+        if commit:
+            date = commit.committer.date
+        _last_change_cache.set(self._dir, (stamp, date))
+        return date
 
     def commit(self, id = 'HEAD'):
-        c = self.revList(id, max_count = 1)
-        if len(c) == 0:
+        obj = self._objects.catFileBatch(id + '^{commit}')
+        if not obj:
             return None
-        return c[0]
+        return self._parseCommitObject(obj[0], obj[3])
 
     def refs(self):
-        format  = '%(objectname) %(objecttype) %(refname) <%(*objectname)> %(subject)%00%(creator)'
+        """ Returns tuple (tags, heads, remotes) sorted the same way as
+            `git for-each-ref --sort=-*authordate` (tags) and
+            `--sort=-committerdate` (heads, remotes) would do.
+
+            Refs are read by refstore and the result is cached per process
+            until some ref changes.
+        """
+        return self._refsCached()
+
+    def decorations(self):
+        """ Returns dictionary mapping object id to list of refs (tuples
+            (refname, id, peeled id or None) as returned by refstore)
+            pointing to the object; tags are listed under the id they peel
+            to.
+
+            The index is built directly from refstore (peeled ids from
+            packed-refs are used, only loose tags are read) and it is cached
+            per process until some ref changes.
+        """
+        stamp = self._refs.stamp()
+        cached = _decorations_cache.get(self._dir)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        index = {}
+        tags  = []
+        for ref in self._refs.refs():
+            if ref[2]:
+                _addDecoration(index, ref[2], ref)
+            elif ref[0][:10] == 'refs/tags/':
+                tags.append((ref, ref[1]))
+            else:
+                _addDecoration(index, ref[1], ref)
+
+        # peel tags without peeled id, all of them at once
+        while tags:
+            objs = self._objects.catFileBatchMany([t[1] for t in tags])
+            unpeeled = []
+            for (ref, target), obj in zip(tags, objs):
+                if obj is None:
+                    continue
+
+                if obj[1] == 'tag':
+                    target = self._parseTagObject(target, '', obj[3]).objid
+                    if target:
+                        unpeeled.append((ref, target))
+                else:
+                    _addDecoration(index, target, ref)
+            tags = unpeeled
+
+        _decorations_cache.set(self._dir, (stamp, index))
+        return index
+
+    def _refsCached(self):
+        """ Returns refs() result """
+        stamp = self._refs.stamp()
+        cached = _refs_cache.get(self._dir)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        refs = filter(lambda x: x[0][:10] == 'refs/tags/'
+                                or x[0][:11] == 'refs/heads/'
+                                or x[0][:13] == 'refs/remotes/',
+                      self._refs.refs())
+
+        # objects of refs and commits the tags peel to (known for tags from
+        # packed-refs) are read in one batch, targets of the other tags in
+        # the second one
+        ids = set()
+        for refname, id, peeled in refs:
+            ids.add(id)
+            if peeled:
+                ids.add(peeled)
+        objects = self._readObjects(ids)
+
+        annotated = {}
+        targets   = set()
+        for refname, id, peeled in refs:
+            obj = objects.get(id)
+            if refname[:10] == 'refs/tags/' and obj and obj[1] == 'tag':
+                tag = self._parseTagObject(id, refname[10:], obj[3])
+                annotated[refname] = tag
+                if tag.objid and tag.objid not in objects:
+                    targets.add(tag.objid)
+        objects.update(self._readObjects(targets))
 
         tags    = []
         heads   = []
         remotes = []
 
-        # tags
-        res = self._git.forEachRef(format = format, sort = '-*authordate', pattern = 'refs/tags')
-        lines = res.split('\n')
-        for line in lines:
-            tag = self._parseTag(line)
-            if tag:
-                tags.append(tag)
+        for refname, id, peeled in refs:
+            obj = objects.get(id)
+            if refname in annotated:
+                tags.append(self._refAnnotatedTag(annotated[refname], objects))
+            elif refname[:10] == 'refs/tags/':
+                if obj:
+                    tags.append(self._refTag(refname[10:], obj))
+            elif refname[:11] == 'refs/heads/':
+                heads.append(self._refHead(refname[11:], id, obj))
+            else:
+                remotes.append(self._refHead(refname[13:], id, obj))
 
+        # sort by date (newest first), refs with the same date by name
+        tags.sort(key = lambda x: (-x[0], x[1].name))
+        heads.sort(key = lambda x: (-x[0], x[1].name))
+        remotes.sort(key = lambda x: (-x[0], x[1].name))
 
-        # heads, remotes
-        res = self._git.forEachRef(format = format,
-                                   sort = '-committerdate', 
-                                   pattern = ['refs/heads', 'refs/remotes'])
-        lines = res.split('\n')
-        for line in lines:
-            d = line.split(' ')
-            if len(d) < 3:
-                continue
+        res = ([x[1] for x in tags], [x[1] for x in heads],
+               [x[1] for x in remotes], )
+        _refs_cache.set(self._dir, (stamp, res))
+        return res
 
-            if d[2][:11] == 'refs/heads/':
-                id = d[0]
-                name = d[2][11:]
-                o = GitHead(self, id, name = name)
-                heads.append(o)
-            elif d[2][:13] == 'refs/remotes/':
-                id = d[0]
-                name = d[2][13:]
-                o = GitHead(self, id, name = name)
-                remotes.append(o)
+    def _readObjects(self, ids):
+        """ Returns dictionary mapping id to tuple (id, type, size, data) of
+            existing objects of ids read in one batch
+        """
+        ids = list(ids)
+        objs = self._objects.catFileBatchMany(ids)
+        return dict([(id, obj) for id, obj in zip(ids, objs) if obj])
+
+    def _refAnnotatedTag(self, tag, objects):
+        """ Returns tuple (author date of tagged commit, GitTag) """
+        date = 0
+        target = objects.get(tag.objid)
+        if target and target[1] == 'commit':
+            date = self._parseCommitObject(target[0], target[3]).author.date.epoch
+        return (date, tag)
+
+    def _refTag(self, name, obj):
+        """ Returns tuple (0, GitTag) of lightweight tag pointing to obj """
+        id     = obj[0]
+        msg    = ''
+        tagger = self._parsePerson('')
+        if obj[1] == 'commit':
+            commit = self._parseCommitObject(id, obj[3])
+            msg    = self._subject(commit.comment)
+            tagger = commit.committer
+
+        tag = GitTag(self, id = id, objid = id, name = name, msg = msg, tagger = tagger)
+        return (0, tag)
+
+    def _refHead(self, name, id, obj):
+        """ Returns tuple (committer date, GitHead), the head carries its
+            tip commit so that it doesn't have to be read again.
+        """
+        date   = 0
+        commit = None
+        if obj and obj[1] == 'commit':
+            commit = self._parseCommitObject(id, obj[3])
+            date   = commit.committer.date.epoch
 
-        return (tags, heads, remotes, )
+        return (date, GitHead(self, id, name = name, commit = commit))
 
 
-    def commitsSetRefs(self, commits, tags, heads, remotes):
+    def commitsSetRefs(self, commits, tags = None, heads = None, remotes = None):
+        """ Generates commits with tags, heads and remotes pointing to them
+            filled in. If no refs are given, all refs of repository are used
+            (through cached decorations()).
+        """
+        if tags is None and heads is None and remotes is None:
+            index = self.decorations()
+        else:
+            index = _decorationIndex(tags or [], heads or [], remotes or [])
+
         for c in commits:
-            for t in tags:
-                if t.objid == c.id:
-                    c.tags.append(t)
+            refs = index.get(c.id)
+            if not refs:
+                yield c
+                continue
 
-            for h in heads:
-                if h.id == c.id:
-                    c.heads.append(h)
+            tags    = []
+            heads   = []
+            remotes = []
+            for refname, id, peeled in refs:
+                if refname[:10] == 'refs/tags/':
+                    tags.append(GitTag(self, id, objid = c.id, name = refname[10:]))
+                elif refname[:11] == 'refs/heads/':
+                    heads.append(GitHead(self, c.id, name = refname[11:]))
+                elif refname[:13] == 'refs/remotes/':
+                    remotes.append(GitHead(self, c.id, name = refname[13:]))
 
-            for r in remotes:
-                if r.id == c.id:
-                    c.remotes.append(r)
+            c.tags    = list(c.tags) + tags
+            c.heads   = list(c.heads) + heads
+            c.remotes = list(c.remotes) + remotes
 
-        return commits
+            yield c
 
 
-    def diffTree(self, id, parent, patch = False):
-        s = self._git.diffTree(id, parent = parent, patch = patch)
+    def diffTree(self, id, parent, patch = False, paths = None):
+        """ Generates GitDiffTree objects (of files in paths only if given).
+            If patch is True, each of them is generated once its patch was
+            read.
+        """
+        lines = self._git.diffTree(id, parent = parent, patch = patch,
+                                       paths = paths, sep = '\n')
 
         diff_trees = []
+        for line in lines:
+            # empty line separates raw output from patches
+            if len(line) == 0:
+                break
+
+            o = self._parseDiffTree(line)
+            if o and patch:
+                diff_trees.append(o)
+            elif o:
+                yield o
 
-        lines = s.split('\n')
-        patch_lines = []
-        for i in range(0, len(lines)):
-            line = lines[i]
+        if patch:
+            for o in self._parseDiffTreePatch(diff_trees, lines):
+                yield o
+
+    def diffTreePatches(self, id, parent, max_files = None):
+        """ Runs one git diff-tree and returns tuple (list of GitDiffTree
+            objects, generator of the same objects once their patches were
+            read). If more than max_files files changed, git is stopped
+            before patches are read and the generator is None. The
+            generator must be closed if it is not exhausted.
+        """
+        lines = self._git.diffTree(id, parent = parent, patch = True,
+                                       sep = '\n')
 
+        diff_trees = []
+        for line in lines:
+            # empty line separates raw output from patches
             if len(line) == 0:
-                patch_lines = lines[i+1:]
                 break
 
             o = self._parseDiffTree(line)
             if o:
                 diff_trees.append(o)
 
-        if len(patch_lines) > 0:
-            self._parseDiffTreePatch(diff_trees, patch_lines)
+        if max_files is not None and len(diff_trees) > max_files:
+            lines.close()
+            return (diff_trees, None)
+        return (diff_trees, self._diffTreePatches(diff_trees, lines))
 
-        return diff_trees
+    def _diffTreePatches(self, diff_trees, lines):
+        try:
+            for o in self._parseDiffTreePatch(diff_trees, lines):
+                yield o
+        finally:
+            lines.close()
 
     def formatPatch(self, id, id2):
         return self._git.formatPatch(id, id2)
 
-    def tree(self, id):
-        s = self._git.lsTree(id, long = True, zeroterm = True)
+    def tree(self, id, path = ''):
+        """ Generates GitTree and GitBlob objects of entries of tree of id
+            (of its subtree path if given)
+        """
+        tree = self._treeId(id, path)
+        if not tree:
+            return
+
+        entries = self._treeEntries(tree)
+        if entries is None:
+            return
 
-        # try to detect older version of git which does not know --long
-        # option and in this case simply omit size
-        if s.startswith('usage'):
-            s = self._git.lsTree(id, zeroterm = True)
+        for mode, name, id, size in entries:
+            if mode == '040000':
+                yield GitTree(self, id = id, mode = mode, size = size, name = name)
+            else:
+                yield GitBlob(self, id = id, mode = mode, size = size, name = name)
 
-        objs = []
+    def _treeId(self, id, path):
+        """ Returns id of (sub)tree path of id or None. Paths are resolved
+            by a single lookup and cached if id is a full id.
+        """
+        path = '/'.join(filter(lambda x: len(x) > 0, path.split('/')))
+        if '\n' in path:
+            # can't be passed to cat-file
+            return None
 
-        lines = s.split('\x00')
-        for line in lines:
-            if len(line) > 0:
-                objs.append(self._parseTree(line))
+        key = None
+        if patterns['full-id'].match(id):
+            key = (id, path)
+            tree = _tree_paths.get(key)
+            if tree:
+                return tree
 
-        return objs
+        if len(path) > 0:
+            info = self._objects.catFileBatchCheck([id + ':' + path])[0]
+        else:
+            info = self._objects.catFileBatchCheck([id + '^{tree}'])[0]
+        if not info or info[1] != 'tree':
+            return None
+
+        if key:
+            _tree_paths.set(key, info[0])
+        return info[0]
+
+    def _treeEntries(self, tree):
+        """ Returns tuple of entries (mode, name, id, size) of tree object
+            or None, tree objects are read only once.
+        """
+        entries = _trees.get(tree)
+        if entries is not None:
+            return entries
+
+        obj = self._objects.catFileBatch(tree)
+        if not obj or obj[1] != 'tree':
+            return None
+
+        entries = list(self._parseTreeObject(obj[3]))
+
+        # sizes of blobs (the same what `ls-tree --long` shows)
+        blobs = filter(lambda x: x[0] not in ['040000', '160000'], entries)
+        if len(blobs) > 0:
+            infos = self._objects.catFileBatchCheck([b[2] for b in blobs])
+            sizes = {}
+            for b, info in zip(blobs, infos):
+                if info:
+                    sizes[b[2]] = str(info[2])
+            entries = [(mode, name, id, sizes.get(id, size))
+                       for mode, name, id, size in entries]
+
+        entries = tuple(entries)
+        _trees.set(tree, entries)
+        return entries
 
     def blob(self, id):
-        s = self._git.catFile(id, 'blob')
+        obj = self._objects.catFileBatch(id + '^{blob}')
+        s = ''
+        if obj:
+            s = obj[3]
         obj = GitBlob(self, id, data = s)
         return obj
 
+    def blobSize(self, id):
+        """ Returns size of blob or None if there is no such blob """
+        info = self._objects.catFileBatchCheck([id + '^{blob}'])[0]
+        if not info:
+            return None
+        return info[2]
 
-    def archive(self, id, project, type):
-        name = project + '-' + id
+    def blobChunks(self, id, start = 0, length = None):
+        """ Generates chunks of content of blob, length bytes from offset
+            start (to the end if length is None).
+
+            Blobs bigger than blob_stream_size are streamed from git
+            cat-file and they are never held in memory whole.
+        """
+        info = self._objects.catFileBatchCheck([id + '^{blob}'])[0]
+        if not info:
+            return iter([])
 
-        if type == 'tgz':
-            arch = self._git.archive(id, 'tar', name + '/', 'gzip')
-            filename = name + '.tar.gz'
-        elif type == 'tbz2':
-            arch = self._git.archive(id, 'tar', name + '/', 'bzip2')
-            filename = name + '.tar.bz2'
-        elif type == 'txz':
-            arch = self._git.archive(id, 'tar', name + '/', 'xz')
-            filename = name + '.tar.xz'
-        elif type == 'zip':
-            arch = self._git.archive(id, 'zip', name + '/')
-            filename = name + '.zip'
-
-        return (arch, filename)
-
-
-
-    def _parseTree(self, line):
-        data, name = line.split('\t', 1)
-        p = data.split()
-        mode = p[0]
-        type = p[1]
-        id   = p[2]
-        size = ''
-        if len(p) > 3:
-            size = p[3]
-            
-        if type == 'tree':
-            obj = GitTree(self, id = id, mode = mode, size = size, name = name)
+        if info[2] > blob_stream_size:
+            chunks = self._git.catFile(info[0], type = 'blob', stream = True)
         else:
-            obj = GitBlob(self, id = id, mode = mode, size = size, name = name)
+            obj = self._objects.catFileBatch(info[0])
+            chunks = iter([obj[3]])
+        return _sliceChunks(chunks, start, length)
+
+
+    def archive(self, id, project, type, cache = None):
+        """ Returns tuple (generator of chunks of archive, filename).
+
+            If cache (cache.DiskCache) is given, archives are stored there
+            keyed by tree id, prefix and type. The prefix contains id as it
+            was requested, so different names of the same tree (e.g. two
+            tags) don't share an archive.
+        """
+        name = project + '-' + id
+        format, compress, ext = _archive_types[type]
+        filename = name + ext
+
+        def generate():
+            return self._git.archive(id, format, name + '/', compress,
+                                     stream = True)
+
+        tree = None
+        if cache is not None:
+            tree = self.resolve([id + '^{tree}'])[0]
+        if tree is None:
+            return (generate(), filename)
+
+        def write(out):
+            for chunk in generate():
+                out.write(chunk)
+
+        key = repr((tree, name + '/', type))
+        f = cache.generate(key, write)
+        return (_fileChunks(f), filename)
+
 
-        return obj
+
+    def _parseTreeObject(self, s):
+        """ Parses raw tree object (entries "<mode> <name>\\0<binary id>"),
+            generates tuples (mode, name, id, '-')
+        """
+        pos = 0
+        length = len(s)
+        while pos < length:
+            sp  = s.index(' ', pos)
+            nul = s.index('\x00', sp)
+
+            mode = '{0:06o}'.format(int(s[pos:sp], 8))
+            name = s[sp + 1:nul]
+            id   = s[nul + 1:nul + 21].encode('hex')
+            pos  = nul + 21
+
+            yield (mode, name, id, '-')
 
     def _parseDiffTree(self, line):
         global patterns
@@ -595,103 +1444,119 @@ class Git(object):
         return diff_tree
 
     def _parseDiffTreePatch(self, diff_trees, lines):
+        """ Generates diff_trees with patches read from lines filled in """
         global patterns
 
         cur = 0
-        patch = ''
+        patch = []
         for line in lines:
             match = patterns['diff-tree-patch'].match(line)
             if match and len(patch) > 0:
-                diff_trees[cur].patch = patch
+                if cur < len(diff_trees):
+                    diff_trees[cur].patch = '\n'.join(patch) + '\n'
+                    yield diff_trees[cur]
                 cur += 1
-                patch = ''
+                patch = []
 
-            patch += line + '\n'
+            patch.append(line)
 
         if len(patch) > 0 and cur < len(diff_trees):
-            diff_trees[cur].patch = patch
+            diff_trees[cur].patch = '\n'.join(patch) + '\n'
+            yield diff_trees[cur]
+            cur += 1
+
+        for o in diff_trees[cur:]:
+            yield o
 
     def _parsePerson(self, line):
-        person = line
-        epoch = '0'
-        tz = '+0000'
+        """ Returns GitPerson of header line (parsed once it is used) """
+        return GitPerson(line = line)
 
-        match = self._patterns['person'].match(line)
-        if match:
-            person = match.group(1)
-            epoch  = match.group(2)
-            tz     = match.group(3)
+    def _parseCommit(self, s):
+        """ Parses record of `git rev-list --parents --header`. Only header
+            lines are scanned, message (indented by four spaces) is taken
+            at once.
+        """
+        header, sep, message = s.partition('\n\n')
+        lines = header.split('\n')
+
+        ids       = lines[0].split(' ')
+        id        = ids[0]
+        parents   = ids[1:]
+        tree      = None
+        author    = None
+        committer = None
+
+        # git writes tree, parents, author and committer in this order,
+        # people are parsed only when they are used
+        for line in lines[1:]:
+            if line[:7] == 'parent ':
+                if line[7:] not in parents:
+                    parents.append(line[7:])
+            elif line[:5] == 'tree ':
+                tree = line[5:]
+            elif line[:7] == 'author ':
+                author = line
+            elif line[:10] == 'committer ':
+                committer = line
+                break
 
-        date   = GitDate(epoch = epoch, tz = tz)
-        person = GitPerson(person = person, date = date)
-        return person
+        comment = message[4:].replace('\n    ', '\n')
 
-    def _parseIdParents(self, line):
-        ids = line.split(' ')
-        id      = ids[0]
-        parents = []
-        if len(ids) > 1:
-            parents = ids[1:]
-        return (id, parents, )
+        return GitCommit(self, id, tree, parents, author, committer, comment)
 
-    def _parseCommit(self, s):
-        lines = s.split('\n')
+    def _parseCommitObject(self, id, s):
+        """ Parses raw commit object (as printed by git cat-file) """
+        header, sep, comment = s.partition('\n\n')
 
-        id, parents = self._parseIdParents(lines.pop(0))
-        tree        = None
-        author      = None
-        committer   = None
-        comment     = ''
-        for line in lines:
-            if line[:4] == 'tree':
+        tree      = None
+        parents   = []
+        author    = None
+        committer = None
+        encoding  = None
+        for line in header.split('\n'):
+            if line[:5] == 'tree ':
                 tree = line[5:]
-            if line[:6] == 'parent' and line[7:] not in parents:
+            elif line[:7] == 'parent ':
                 parents.append(line[7:])
-            if line[:6] == 'author':
+            elif line[:7] == 'author ':
                 author = self._parsePerson(line)
-            if line[:9] == 'committer':
+            elif line[:10] == 'committer ':
                 committer = self._parsePerson(line)
+            elif line[:9] == 'encoding ':
+                encoding = line[9:]
 
-            if line[:4] == '    ':
-                comment += line[4:] + '\n'
+        # rev-list re-encodes messages to utf-8, do the same
+        if encoding and encoding.lower() not in ['utf-8', 'utf8']:
+            try:
+                comment = comment.decode(encoding).encode('utf-8')
+            except (LookupError, UnicodeError):
+                pass
 
         commit = GitCommit(self, id = id, tree = tree, parents = parents,
                                  author = author, committer = committer,
                                  comment = comment)
         return commit
 
-    def _parseTag(self, s):
-        lines = s.split('\x00')
-
-        if len(lines) != 2:
-            return None
-
-        try:
-            (objectname, objecttype, refname,
-                    pobjectname, msg) = lines[0].split(' ', 4)
-        except:
-            return None
-
-        try:
-            (tagger, date, tz) = lines[1].rsplit(' ', 2)
-        except:
-            return None
+    def _parseTagObject(self, id, name, s):
+        """ Parses raw tag object (as printed by git cat-file) """
+        header, sep, msg = s.partition('\n\n')
 
-        id = objectname
-        if objecttype == "commit":
-            # this is a lightweight tag
-            objid = objectname
-        else:
-            objid = pobjectname[1:-1]
-
-        # remove "refs/tags/"
-        name = refname[10:]
+        objid  = None
+        tagger = None
+        for line in header.split('\n'):
+            if line[:7] == 'object ':
+                objid = line[7:]
+            elif line[:7] == 'tagger ':
+                tagger = self._parsePerson(line)
 
         if not tagger:
             tagger = self._parsePerson('')
-        else:
-            tagger = self._parsePerson("tagger: "+lines[1])
 
-        tag = GitTag(self, id = id, objid = objid, name = name, msg = msg, tagger = tagger)
+        tag = GitTag(self, id = id, objid = objid, name = name,
+                           msg = self._subject(msg), tagger = tagger)
         return tag
 
+    def _subject(self, msg):
+        """ Returns subject of message (its first paragraph on one line) """
+        return msg.strip('\n').split('\n\n', 1)[0].replace('\n', ' ').strip()
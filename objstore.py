@@ -0,0 +1,648 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+import os
+import re
+import zlib
+import mmap
+import struct
+import threading
+
+import cache
+import refstore
+
+# Maximal size (in bytes) of process-wide cache of delta bases
+delta_base_cache_bytes = 32 * 1024 * 1024
+
+# Size of chunks in which compressed data are read from packfiles
+inflate_chunk = 64 * 1024
+
+_types = { 1 : 'commit', 2 : 'tree', 3 : 'blob', 4 : 'tag' }
+_OFS_DELTA = 6
+_REF_DELTA = 7
+
+patterns = {
+    'id'     : re.compile(r'^[0-9a-fA-F]{40}$'),
+    'peel'   : re.compile(r'^(.*)\^\{([a-z]*)\}$'),
+    'nav'    : re.compile(r'^(.*?)((?:[~^][0-9]*)+)$'),
+    'navop'  : re.compile(r'([~^])([0-9]*)'),
+    'toplvl' : re.compile(r'^[A-Z_]+$'),
+}
+
+# (pack path, offset) -> (type, data)
+_delta_bases = cache.LRUCache(max_bytes = delta_base_cache_bytes,
+                              sizeof = lambda x: len(x[1]))
+
+
+def _mapFile(path):
+    f = open(path, 'rb')
+    try:
+        return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+def _deltaSize(delta, i):
+    """ Reads size from header of delta starting at position i, returns
+        tuple (size, next position).
+    """
+    size = shift = 0
+    while True:
+        c = ord(delta[i])
+        i += 1
+        size |= (c & 0x7f) << shift
+        shift += 7
+        if not c & 0x80:
+            break
+    return (size, i)
+
+def _applyDelta(src, delta):
+    src_size, i = _deltaSize(delta, 0)
+    dst_size, i = _deltaSize(delta, i)
+    if src_size != len(src):
+        raise ValueError('Delta does not match its base')
+
+    out = []
+    length = len(delta)
+    while i < length:
+        cmd = ord(delta[i])
+        i += 1
+
+        if cmd & 0x80:
+            # copy from base
+            off = size = 0
+            if cmd & 0x01:
+                off = ord(delta[i])
+                i += 1
+            if cmd & 0x02:
+                off |= ord(delta[i]) << 8
+                i += 1
+            if cmd & 0x04:
+                off |= ord(delta[i]) << 16
+                i += 1
+            if cmd & 0x08:
+                off |= ord(delta[i]) << 24
+                i += 1
+            if cmd & 0x10:
+                size = ord(delta[i])
+                i += 1
+            if cmd & 0x20:
+                size |= ord(delta[i]) << 8
+                i += 1
+            if cmd & 0x40:
+                size |= ord(delta[i]) << 16
+                i += 1
+            if size == 0:
+                size = 0x10000
+            out.append(src[off:off + size])
+
+        elif cmd:
+            # insert data from delta
+            out.append(delta[i:i + cmd])
+            i += cmd
+
+        else:
+            raise ValueError('Invalid delta opcode')
+
+    data = ''.join(out)
+    if len(data) != dst_size:
+        raise ValueError('Delta produced object of wrong size')
+    return data
+
+
+class Pack(object):
+    """ One packfile together with its index (version 1 or 2). """
+
+    def __init__(self, idx_path):
+        self.path = idx_path[:-4] + '.pack'
+        self.closed = False
+
+        self._idx  = _mapFile(idx_path)
+        self._pack = _mapFile(self.path)
+
+        if self._idx[:4] == '\377tOc':
+            self._version = struct.unpack_from('>I', self._idx, 4)[0]
+            if self._version != 2:
+                raise ValueError('Unsupported pack index version')
+            fanout = 8
+        else:
+            self._version = 1
+            fanout = 0
+
+        self._fanout = struct.unpack_from('>256I', self._idx, fanout)
+        self.count = self._fanout[255]
+
+        if self._version == 2:
+            self._sha_off   = fanout + 1024
+            self._ofs_off   = self._sha_off + 24 * self.count
+            self._large_off = self._ofs_off + 4 * self.count
+        else:
+            self._sha_off = 1024 + 4
+
+    def close(self):
+        self.closed = True
+        self._idx.close()
+        self._pack.close()
+
+    def _sha(self, i):
+        if self._version == 2:
+            pos = self._sha_off + 20 * i
+        else:
+            pos = self._sha_off + 24 * i
+        return self._idx[pos:pos + 20]
+
+    def _offset(self, i):
+        if self._version == 1:
+            return struct.unpack_from('>I', self._idx, 1024 + 24 * i)[0]
+
+        off = struct.unpack_from('>I', self._idx, self._ofs_off + 4 * i)[0]
+        if off & 0x80000000:
+            pos = self._large_off + 8 * (off & 0x7fffffff)
+            off = struct.unpack_from('>Q', self._idx, pos)[0]
+        return off
+
+    def find(self, sha):
+        """ Returns offset of object with binary id sha or None """
+        first = ord(sha[0])
+        lo = 0
+        if first > 0:
+            lo = self._fanout[first - 1]
+        hi = self._fanout[first]
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            cur = self._sha(mid)
+            if cur < sha:
+                lo = mid + 1
+            elif cur > sha:
+                hi = mid
+            else:
+                return self._offset(mid)
+        return None
+
+    def _header(self, offset):
+        """ Returns tuple (type, size, position of data) of entry at offset """
+        m = self._pack
+        c = ord(m[offset])
+        offset += 1
+
+        type  = (c >> 4) & 7
+        size  = c & 0x0f
+        shift = 4
+        while c & 0x80:
+            c = ord(m[offset])
+            offset += 1
+            size |= (c & 0x7f) << shift
+            shift += 7
+        return (type, size, offset)
+
+    def _deltaBase(self, type, offset, pos):
+        """ Returns tuple (base, position of delta data) where base is
+            offset of base in this pack (OFS_DELTA) or binary id of base
+            (REF_DELTA).
+        """
+        m = self._pack
+        if type == _REF_DELTA:
+            return (m[pos:pos + 20], pos + 20)
+
+        c = ord(m[pos])
+        pos += 1
+        off = c & 0x7f
+        while c & 0x80:
+            c = ord(m[pos])
+            pos += 1
+            off = ((off + 1) << 7) | (c & 0x7f)
+        return (offset - off, pos)
+
+    def _inflate(self, pos, size):
+        d = zlib.decompressobj()
+        chunks = []
+        got = 0
+        step = size + 64
+        end = len(self._pack)
+        while got < size and pos < end:
+            data = d.decompress(self._pack[pos:pos + step])
+            pos += step
+            step = inflate_chunk
+            chunks.append(data)
+            got += len(data)
+
+        data = ''.join(chunks)
+        if len(data) != size:
+            raise ValueError('Corrupted pack {0}'.format(self.path))
+        return data
+
+    def read(self, offset, store):
+        """ Returns tuple (type, data) of object stored at offset """
+        chain = []
+        while True:
+            base = _delta_bases.get((self.path, offset))
+            if base:
+                type, data = base
+                break
+
+            type, size, pos = self._header(offset)
+            if type == _OFS_DELTA:
+                base, pos = self._deltaBase(type, offset, pos)
+                chain.append((offset, pos, size))
+                offset = base
+            elif type == _REF_DELTA:
+                base, pos = self._deltaBase(type, offset, pos)
+                chain.append((offset, pos, size))
+                type, data = store._readBinary(base)
+                offset = None
+                break
+            else:
+                type = _types[type]
+                data = self._inflate(pos, size)
+                break
+
+        for delta_offset, pos, size in reversed(chain):
+            # bases are usually shared by many deltas, keep them around
+            if offset is not None:
+                _delta_bases.set((self.path, offset), (type, data))
+            data = _applyDelta(data, self._inflate(pos, size))
+            offset = delta_offset
+
+        return (type, data)
+
+    def info(self, offset, store):
+        """ Returns tuple (type, size) of object stored at offset without
+            reading whole object.
+        """
+        type, size, pos = self._header(offset)
+        if type not in [_OFS_DELTA, _REF_DELTA]:
+            return (_types[type], size)
+
+        # size is stored in header of delta
+        base, pos = self._deltaBase(type, offset, pos)
+        delta = zlib.decompressobj().decompress(self._pack[pos:pos + 4096], 32)
+        src_size, i = _deltaSize(delta, 0)
+        size, i = _deltaSize(delta, i)
+
+        # type is type of the base at the end of delta chain
+        while True:
+            if type == _REF_DELTA:
+                return (store._infoBinary(base)[0], size)
+
+            type, _, pos = self._header(base)
+            if type not in [_OFS_DELTA, _REF_DELTA]:
+                return (_types[type], size)
+            base, pos = self._deltaBase(type, base, pos)
+
+
+class _ObjectDir(object):
+    """ One objects/ directory: loose objects and list of packs. The list
+        of packs is re-read when objects/pack directory changes.
+    """
+
+    def __init__(self, path):
+        self.path  = path
+        self.packs = []
+        self._pack_dir = os.path.join(path, 'pack')
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def refresh(self, force = False):
+        try:
+            mtime = os.stat(self._pack_dir).st_mtime
+        except OSError:
+            mtime = None
+
+        with self._lock:
+            if mtime == self._mtime and not force:
+                return
+
+            old = dict([(p.path, p) for p in self.packs])
+            packs = []
+            if mtime is not None:
+                for name in sorted(os.listdir(self._pack_dir)):
+                    if not name.endswith('.idx'):
+                        continue
+                    path = os.path.join(self._pack_dir, name)
+                    pack = old.pop(path[:-4] + '.pack', None)
+                    if pack is None:
+                        try:
+                            pack = Pack(path)
+                        except (IOError, OSError, ValueError):
+                            continue
+                    packs.append(pack)
+
+            self.packs  = packs
+            self._mtime = mtime
+
+        # packs removed from the directory (e.g. by git gc)
+        for pack in old.values():
+            pack.close()
+
+    def loosePath(self, hexid):
+        return os.path.join(self.path, hexid[:2], hexid[2:])
+
+
+_object_dirs = {}
+_object_dirs_lock = threading.Lock()
+
+def _objectDir(path):
+    """ Returns process-wide _ObjectDir for the given directory """
+    path = os.path.realpath(path)
+    with _object_dirs_lock:
+        d = _object_dirs.get(path)
+        if d is None:
+            d = _ObjectDir(path)
+            _object_dirs[path] = d
+    d.refresh()
+    return d
+
+
+class ObjectStore(object):
+    """ Reads objects directly from objects/ directory of repository
+        (loose objects and packfiles), no git process is spawned.
+
+        Methods catFileBatch() and catFileBatchCheck() provide the same
+        interface as corresponding methods of GitComm. Object names which
+        are not understood (anything else than ids, refs, <rev>^{<type>},
+        <rev>~<n>, <rev>^<n> and <rev>:<path>) are resolved using
+        fallback (GitComm) if it is given.
+    """
+
+    def __init__(self, dir, fallback = None):
+        self._dir = dir
+        self._fallback = fallback
+        self._refs = refstore.RefStore(dir)
+
+        objdir = os.path.join(dir, 'objects')
+        self._objdirs = [_objectDir(objdir)]
+
+        alternates = os.path.join(objdir, 'info', 'alternates')
+        if os.path.isfile(alternates):
+            for line in open(alternates, 'r'):
+                line = line.strip()
+                if len(line) > 0 and line[0] != '#':
+                    path = os.path.join(objdir, line)
+                    if os.path.isdir(path):
+                        self._objdirs.append(_objectDir(path))
+
+    def _find(self, sha):
+        """ Returns tuple (pack, offset) or (None, loose path) or None """
+        hexid = sha.encode('hex')
+        for refresh in [False, True]:
+            for d in self._objdirs:
+                if refresh:
+                    d.refresh(force = True)
+
+                for pack in d.packs:
+                    try:
+                        offset = pack.find(sha)
+                    except ValueError:
+                        # closed by other thread, it was replaced already
+                        if not pack.closed:
+                            raise
+                        continue
+                    if offset is not None:
+                        return (pack, offset)
+
+                path = d.loosePath(hexid)
+                if os.path.isfile(path):
+                    return (None, path)
+        return None
+
+    def _readBinary(self, sha):
+        """ Returns tuple (type, data) of object with binary id sha """
+        while True:
+            loc = self._find(sha)
+            if loc is None:
+                raise KeyError(sha.encode('hex'))
+
+            pack, where = loc
+            if not pack:
+                break
+
+            try:
+                return pack.read(where, self)
+            except ValueError:
+                # pack was closed by other thread reloading list of packs
+                if not pack.closed:
+                    raise
+
+        f = open(where, 'rb')
+        try:
+            raw = zlib.decompress(f.read())
+        finally:
+            f.close()
+        header, sep, data = raw.partition('\x00')
+        type, size = header.split(' ')
+        return (type, data)
+
+    def _infoBinary(self, sha):
+        """ Returns tuple (type, size) of object with binary id sha """
+        while True:
+            loc = self._find(sha)
+            if loc is None:
+                raise KeyError(sha.encode('hex'))
+
+            pack, where = loc
+            if not pack:
+                break
+
+            try:
+                return pack.info(where, self)
+            except ValueError:
+                # pack was closed by other thread reloading list of packs
+                if not pack.closed:
+                    raise
+
+        f = open(where, 'rb')
+        try:
+            header = zlib.decompressobj().decompress(f.read(4096), 64)
+        finally:
+            f.close()
+        type, size = header.split('\x00', 1)[0].split(' ')
+        return (type, int(size))
+
+    def readObject(self, id):
+        """ Returns tuple (type, data) of object with hex id or None """
+        try:
+            return self._readBinary(id.decode('hex'))
+        except (KeyError, TypeError):
+            return None
+
+
+    def _resolveRef(self, name):
+        """ Resolves ref name the same way git does (see gitrevisions(7)) """
+        candidates = ['refs/' + name,
+                      'refs/tags/' + name,
+                      'refs/heads/' + name,
+                      'refs/remotes/' + name,
+                      'refs/remotes/' + name + '/HEAD']
+        if patterns['toplvl'].match(name) or name.startswith('refs/'):
+            candidates.insert(0, name)
+
+        for c in candidates:
+            id = self._refs.lookup(c)
+            if id:
+                return id
+        return None
+
+    def _peel(self, id, type):
+        """ Peels object to the given type ('' means to peel tags only,
+            'object' only checks that the object exists)
+        """
+        while id:
+            try:
+                objtype = self._infoBinary(id.decode('hex'))[0]
+            except (KeyError, TypeError):
+                return None
+
+            if objtype == type or type == 'object' \
+                    or (type == '' and objtype != 'tag'):
+                return id
+
+            data = self.readObject(id)[1]
+            if objtype == 'tag':
+                id = data[7:47]
+            elif objtype == 'commit' and type == 'tree':
+                id = data[5:45]
+            else:
+                return None
+        return None
+
+    def _parent(self, id, n):
+        """ Returns n-th parent of commit (0 means commit itself) """
+        id = self._peel(id, 'commit')
+        if not id or n == 0:
+            return id
+
+        type, data = self.readObject(id)
+        parents = []
+        for line in data.split('\n'):
+            if line[:7] == 'parent ':
+                parents.append(line[7:47])
+            elif len(line) == 0:
+                break
+
+        if len(parents) < n:
+            return None
+        return parents[n - 1]
+
+    def _treeEntry(self, id, path):
+        """ Returns id of object at path relative to tree-ish id """
+        id = self._peel(id, 'tree')
+        for name in filter(lambda x: len(x) > 0, path.split('/')):
+            obj = self.readObject(id) if id else None
+            if obj is None or obj[0] != 'tree':
+                return None
+
+            data = obj[1]
+            id = None
+            pos = 0
+            while pos < len(data):
+                nul = data.index('\x00', pos)
+                if data[data.index(' ', pos) + 1:nul] == name:
+                    id = data[nul + 1:nul + 21].encode('hex')
+                    break
+                pos = nul + 21
+        return id
+
+    def resolve(self, name):
+        """ Returns hex id of object identified by name or None """
+        if ':' in name:
+            rev, path = name.split(':', 1)
+            if len(rev) == 0:
+                return self._resolveFallback(name)
+            return self._treeEntry(self.resolve(rev), path)
+
+        m = patterns['peel'].match(name)
+        if m:
+            id = self.resolve(m.group(1))
+            if not id:
+                return None
+            return self._peel(id, m.group(2))
+
+        m = patterns['nav'].match(name)
+        if m and len(m.group(1)) > 0:
+            id = self.resolve(m.group(1))
+            for op, n in patterns['navop'].findall(m.group(2)):
+                if not id:
+                    return None
+
+                if n == '':
+                    n = 1
+                n = int(n)
+
+                if op == '~':
+                    for i in range(0, n):
+                        id = self._parent(id, 1)
+                        if not id:
+                            return None
+                else:
+                    id = self._parent(id, n)
+            return id
+
+        if patterns['id'].match(name):
+            return name.lower()
+
+        id = self._resolveRef(name)
+        if id:
+            return id
+
+        return self._resolveFallback(name)
+
+    def _resolveFallback(self, name):
+        if not self._fallback:
+            return None
+
+        info = self._fallback.catFileBatchCheck([name])[0]
+        if info:
+            return info[0]
+        return None
+
+
+    def catFileBatch(self, obj):
+        """ Returns tuple (id, type, size, data) or None """
+        id = self.resolve(obj)
+        if not id:
+            return None
+
+        obj = self.readObject(id)
+        if obj is None:
+            return None
+        return (id, obj[0], len(obj[1]), obj[1])
+
+    def catFileBatchMany(self, objs):
+        """ Returns list of results of catFileBatch() for all objects """
+        return [self.catFileBatch(obj) for obj in objs]
+
+    def catFileBatchCheck(self, objs):
+        """ Returns list of tuples (id, type, size, None) (None for missing
+            objects)
+        """
+        infos = []
+        for obj in objs:
+            info = None
+            id = self.resolve(obj)
+            if id:
+                try:
+                    type, size = self._infoBinary(id.decode('hex'))
+                    info = (id, type, size, None)
+                except (KeyError, TypeError):
+                    pass
+            infos.append(info)
+        return infos
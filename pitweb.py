@@ -37,3 +37,53 @@ homepage = 'http://project.net'
 # Available formats are 'tgz', 'tbz2', 'txz', 'zip'
 # Default value is ['tgz', 'tbz2']
 snapshots = ['tgz', 'tbz2', 'txz', 'zip']
+
+### Backend used for reading objects (commits, trees, blobs)
+# 'git' reads objects through git cat-file processes, 'native' reads
+# loose objects and packfiles directly without spawning any process.
+# Default value is 'git'.
+backend = 'git'
+
+### Directory for disk cache of rendered pages of immutable views (commit,
+### diff, tree and blob addressed by ids)
+# Rendered pages are always cached in memory, if the directory is set they
+# are also stored there (the directory may be shared by several projects).
+# Default value is None (no disk cache).
+page_cache_dir = None
+
+### Maximal size of disk cache of rendered pages in bytes
+# Default value is 256MB
+page_cache_size = 256 * 1024 * 1024
+
+### Directory for disk cache of snapshots
+# Snapshots are stored keyed by tree id and requested name (the name is the
+# directory inside the archive, so only requests of the same name for the
+# same tree share one snapshot) and generated only once even if they are
+# requested concurrently.
+# Default value is None (snapshots are always generated).
+snapshot_cache_dir = None
+
+### Maximal size of disk cache of snapshots in bytes
+# Default value is 1GB
+snapshot_cache_size = 1024 * 1024 * 1024
+
+### Maximal size (in bytes) of file shown in blob view
+# Bigger files (and binary files) are offered only for download.
+# Default value is 2MB
+blob_max_size = 2 * 1024 * 1024
+
+### Number of lines of file shown on one page of blob view
+# Default value is 5000
+blob_lines_per_page = 5000
+
+### Maximal number of changed files for which commit and diff views show
+### patches inline
+# Patches of commits changing more files are not read at all, they are
+# linked to pages showing diff of one file instead (the same holds for
+# patches over patch_max_lines).
+# Default value is 100
+patch_max_files = 100
+
+### Maximal number of lines of patches shown inline in commit and diff views
+# Default value is 5000
+patch_max_lines = 5000
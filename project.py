@@ -29,6 +29,9 @@ import mimetypes
 import os
 import imp
 import hashlib
+import sys
+import marshal
+import threading
 
 pygments = False
 try:
@@ -39,52 +42,272 @@ try:
 except:
     pass
 
+import cache
 import common
 import git
 
+# Size (in bytes) of process-wide in-memory cache of rendered pages of
+# immutable views (zero disables the cache)
+page_cache_bytes = 32 * 1024 * 1024
 
-class ProjectBase(common.ModPythonOutput):
-    """ HTML interface for project specified by its directory. """
+# Bump whenever rendering changes so that disk caches are not reused
+_page_cache_format = 2
 
-    def __init__(self, req, dir):
-        super(ProjectBase, self).__init__(req)
+# Actions whose output can't change once ids are resolved to full ids,
+# action -> attributes holding ids
+_immutable_actions = {
+    'commit'   : ['_id'],
+    'diff'     : ['_id', '_id2'],
+    'filediff' : ['_id', '_id2'],
+    'tree'     : ['_id', '_treeid'],
+    'blob'     : ['_id', '_blobid', '_treeid'],
+    'blob-raw' : ['_blobid'],
+    'patch'    : ['_id', '_id2'],
+    'snapshot' : ['_id'],
+}
 
-        self._dir = dir
+# Immutable actions whose pages are rendered with resolved ids and cached
+_cached_actions = ['commit', 'diff', 'filediff', 'tree', 'blob']
 
-        self._git = git.Git(dir)
+# Actions whose pages change only if refs change
+_refs_actions = ['summary', 'log', 'refs']
 
-        self._errors = []
-        self._status = apache.OK
+# Cache-Control of responses to requests addressing objects by full ids
+cache_control_immutable = 'public, max-age=31536000'
 
-        self._config()
-        self._params()
+# Process-wide cache of rendered pages,
+# key -> (content type, content disposition, page)
+_pages = cache.LRUCache(max_bytes = page_cache_bytes,
+                        sizeof = lambda x: len(x[2]))
+
+# Style of syntax highlighting of blobs
+highlight_style = 'trac'
+
+# Size (in bytes) of process-wide cache of highlighted blobs
+highlight_cache_bytes = 16 * 1024 * 1024
+
+# Highlighted blobs, (blob id, lexer name, style) -> tuple of lines of html
+_highlighted = cache.LRUCache(max_bytes = highlight_cache_bytes,
+                              sizeof = lambda x: sum(map(len, x)))
+
+# Memoized lexers, filename -> lexer (False if there is none)
+_lexers = cache.LRUCache(max_items = 1024)
 
-    def _config(self):
-        config = None
+_formatters = {}
 
-        # Load configuration from file
-        if os.path.exists(os.path.join(self._dir, 'pitweb.py')):
-            file = pathname = desc = None
-            try:
-                file, pathname, desc = imp.find_module('pitweb', [self._dir]) 
-            except ImportError:
-                pass
+_id_pattern = re.compile(r'^[0-9a-f]{40}$')
 
-            try:
-                if file and pathname and desc:
-                    f = open(pathname, 'r')
-                    hash = hashlib.sha256(pathname + f.read())
-                    f.close()
+_span_pattern = re.compile(r'<span[^>]*>|</span>')
 
-                    name = 'config-' + hash.hexdigest()
+# Patterns of lines of patches
+_patch_head_pattern  = re.compile(r'^diff --git (a/.*) (b/.*)$')
+_patch_index_pattern = re.compile(r'^index ([^\.]*)..([^ ]*)(.*)$')
+_patch_chunk_pattern = re.compile(r'^(@@.*@@)(.*)$')
 
-                    config = imp.load_module(name, file, pathname, desc)
-            except Exception as e:
-                msg = "Can't load configuration file: "
-                msg += str(e)
-                self._errors.append(msg)
+# Number of lines of patch rendered into one piece of output
+patch_batch_lines = 1000
+
+# Beginning of html of line of patch by its first character (lines
+# starting otherwise are hunk headers or context lines)
+_patch_line_start = {
+    '+' : '<div class="patch-add">',
+    '-' : '<div class="patch-rm">',
+    ' ' : '<div class="patch-line">',
+}
+
+def _lexer(filename):
+    """ Returns pygments lexer for filename or None """
+    lexer = _lexers.get(filename)
+    if lexer is None:
+        try:
+            lexer = get_lexer_for_filename(filename)
+        except:
+            lexer = False
+        _lexers.set(filename, lexer)
+
+    if lexer is False:
+        return None
+    return lexer
+
+def _htmlLines(html):
+    """ Splits html to list of lines. Spans crossing end of line are closed
+        at the end of the line and opened again on the next one, so that
+        any range of lines is well-formed.
+    """
+    lines = html.split('\n')
+    if len(lines[-1]) == 0:
+        lines = lines[:-1]
+
+    opened = []
+    for i in range(0, len(lines)):
+        line   = lines[i]
+        prefix = ''.join(opened)
+        for m in _span_pattern.finditer(line):
+            if m.group(0) == '</span>':
+                if len(opened) > 0:
+                    opened.pop()
+            else:
+                opened.append(m.group(0))
+
+        if prefix or opened:
+            lines[i] = prefix + line + '</span>' * len(opened)
+    return tuple(lines)
+
+def _highlight(id, data, filename):
+    """ Returns tuple of lines of html of data of blob id highlighted
+        according to filename or None if it can't be highlighted. Whole
+        blob is highlighted at once (so that lexer knows the context of
+        each line) and the lines are cached.
+    """
+    lexer = _lexer(filename)
+    if lexer is None:
+        return None
+
+    # only blobs addressed by full id can be cached
+    key = None
+    if _id_pattern.match(id):
+        key = (id, lexer.name, highlight_style)
+        html = _highlighted.get(key)
+        if html is not None:
+            return html
+
+    try:
+        formatter = _formatters.get(highlight_style)
+        if formatter is None:
+            formatter = HtmlFormatter(nowrap = True, noclasses = True,
+                                      style = highlight_style)
+            _formatters[highlight_style] = formatter
+        html = _htmlLines(highlight(data, lexer, formatter))
+    except:
+        return None
+
+    if key:
+        _highlighted.set(key, html)
+    return html
+
+def _isBinary(data):
+    """ Returns True if data look like binary (the same test as git uses) """
+    return '\x00' in data[:8000]
+
+# Disk caches (pages, snapshots), directory -> cache.DiskCache
+_disk_caches = {}
+_disk_caches_lock = threading.Lock()
+
+def _diskCache(dir, max_bytes):
+    with _disk_caches_lock:
+        disk = _disk_caches.get(dir)
+        if disk is None:
+            disk = _disk_caches[dir] = cache.DiskCache(dir, max_bytes)
+    return disk
+
+
+# Process-wide cache of loaded configuration files,
+# path -> ((mtime, size), result of loadConfig())
+_configs = {}
+_configs_lock = threading.Lock()
+
+def loadConfig(dir):
+    """ Loads configuration file pitweb.py of project in dir.
+        Returns tuple (config module or None, list of error messages).
+
+        Loaded modules are cached per process and the file is loaded again
+        only if its mtime or size changes (the stale module is removed from
+        sys.modules).
+    """
+    path = os.path.join(dir, 'pitweb.py')
+    stamp = configStamp(dir)
+
+    with _configs_lock:
+        cached = _configs.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        if cached and cached[1][0] is not None:
+            sys.modules.pop(cached[1][0].__name__, None)
+
+        res = (None, [])
+        if stamp:
+            res = _loadConfig(dir)
+        _configs[path] = (stamp, res)
+        return res
+
+def configStamp(dir):
+    """ Returns (mtime, size) of configuration file in dir or None """
+    try:
+        st = os.stat(os.path.join(dir, 'pitweb.py'))
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+def _loadConfig(dir):
+    config = None
+    errors = []
+
+    file = pathname = desc = None
+    try:
+        file, pathname, desc = imp.find_module('pitweb', [dir]) 
+    except ImportError:
+        pass
+
+    try:
+        if file and pathname and desc:
+            # the name is unique per file, the previously loaded module of
+            # the same file is already removed from sys.modules
+            name = 'config-' + hashlib.sha256(pathname).hexdigest()
+
+            config = imp.load_module(name, file, pathname, desc)
+    except Exception as e:
+        msg = "Can't load configuration file: "
+        msg += str(e)
+        errors.append(msg)
+    finally:
+        if file:
+            file.close()
+
+    return (config, errors)
+
+def projectName(dir, config):
+    """ Returns name of project in dir with configuration config """
+    if config and getattr(config, 'project_name', None):
+        return config.project_name
+
+    name = ''
+
+    p = dir.split('/')
+    p = filter(lambda x: len(x) > 0, p)
+    if len(p) > 0:
+        name = p[-1]
+        if len(name) > 4 and name[-4:] == '.git':
+            name = name[:-4]
+
+    return name
+
+
+class ProjectBase(common.ModPythonOutput):
+    """ HTML interface for project specified by its directory.
 
-        self._setProjectName(config)
+        config is tuple returned by loadConfig(dir), it is loaded if not
+        given.
+    """
+
+    def __init__(self, req, dir, config = None):
+        super(ProjectBase, self).__init__(req)
+
+        self._dir = dir
+
+        self._errors = []
+        self._status = apache.OK
+
+        if config is None:
+            config = loadConfig(dir)
+        self._config(config[0])
+        self._errors.extend(config[1])
+
+        self._git = git.Git(dir, backend = self._backend)
+        self._params()
+
+    def _config(self, config):
+        self._project_name = projectName(self._dir, config)
         self._commits_per_page = self._configParam(config, 'commits_per_page', 50)
         self._commits_in_summary = self._configParam(config, 'commits_in_summary', 15)
         self._description = self._configParam(config, 'description', None)
@@ -92,6 +315,15 @@ class ProjectBase(common.ModPythonOutput):
         self._urls = self._configParam(config, 'urls', [])
         self._homepage = self._configParam(config, 'homepage', None)
         self._one_line_comment_max_len = self._configParam(config, 'one_line_comment_max_len', 50)
+        self._backend = self._configParam(config, 'backend', 'git')
+        self._page_cache_dir = self._configParam(config, 'page_cache_dir', None)
+        self._page_cache_size = self._configParam(config, 'page_cache_size', 256 * 1024 * 1024)
+        self._blob_max_size = self._configParam(config, 'blob_max_size', 2 * 1024 * 1024)
+        self._blob_lines_per_page = self._configParam(config, 'blob_lines_per_page', 5000)
+        self._snapshot_cache_dir = self._configParam(config, 'snapshot_cache_dir', None)
+        self._snapshot_cache_size = self._configParam(config, 'snapshot_cache_size', 1024 * 1024 * 1024)
+        self._patch_max_files = self._configParam(config, 'patch_max_files', 100)
+        self._patch_max_lines = self._configParam(config, 'patch_max_lines', 5000)
         self._setSnapshots(config)
 
     def _configParam(self, config, name, default):
@@ -99,23 +331,6 @@ class ProjectBase(common.ModPythonOutput):
             return getattr(config, name)
         return default
 
-    def _setProjectName(self, config):
-        name = self._configParam(config, 'project_name', None)
-        if name:
-            self._project_name = name
-            return
-
-        name = ''
-
-        p = self._dir.split('/')
-        p = filter(lambda x: len(x) > 0, p)
-        if len(p) > 0:
-            name = p[-1]
-            if len(name) > 4 and name[-4:] == '.git':
-                name = name[:-4]
-
-        self._project_name = name
-
     def _setSnapshots(self, config):
         snapshots = self._configParam(config, 'snapshots', ['tgz', 'tbz2'])
 
@@ -147,7 +362,10 @@ class ProjectBase(common.ModPythonOutput):
             self._showmsg = True
 
         self._page    = int(args.get('page', '1'))
+        self._start   = int(args.get('start', '1'))
+        self._count   = int(args.get('count', '0'))
         self._path    = args.get('path', '')
+        self._path2   = args.get('path2', None)
         self._format  = args.get('format', 'tgz')
 
     def _parseArgs(self):
@@ -181,17 +399,139 @@ class ProjectBase(common.ModPythonOutput):
             return self._description
         return default
 
-    def lastChange(self, default = ''):
-        commits = self._git.revList(None, all = True, max_count = 1)
-        if len(commits) > 0:
-            date   = commits[0].committer.date
+    def lastChange(self, default = '', timeout = None):
+        """ Returns date of the last change in repository (see
+            git.Git.lastChange()) or None if timeout ran out
+        """
+        date = self._git.lastChange(timeout = timeout)
+        if date is False:
+            return None
+        if date:
             date   = date.format('%Y-%m-%d %H:%M:%S')
             return date
         return ''
 
 
+    def stamp(self):
+        """ Returns hashable value which changes whenever configuration or
+            refs of project change.
+        """
+        return (self._dir, configStamp(self._dir), self._git.stamp())
+
     def run(self):
+        try:
+            return self._runAction()
+        finally:
+            # rest of buffered output
+            self.flush()
+
+    def _runAction(self):
         self._section = self._a
+
+        ids = None
+        if self._a in _immutable_actions:
+            ids = self._resolveIds()
+
+        # validators are checked before anything is rendered
+        etag = self._etag(ids)
+        if etag:
+            cache_control = 'no-cache'
+            if ids and self._fullIds(ids):
+                cache_control = cache_control_immutable
+            self.setETag(etag, cache_control)
+
+            if self.notModified(etag):
+                return apache.HTTP_NOT_MODIFIED
+
+        if ids and self._a in _cached_actions:
+            for a, id in ids:
+                setattr(self, a, id)
+            return self._runCached()
+        return self._run()
+
+    def _resolveIds(self):
+        """ Returns list of tuples (attribute, full id) of ids of current
+            immutable action or None if some of them can't be resolved.
+        """
+        attrs = filter(lambda x: getattr(self, x) is not None,
+                       _immutable_actions[self._a])
+        ids = self._git.resolve([getattr(self, a) for a in attrs])
+        if None in ids:
+            return None
+        return zip(attrs, ids)
+
+    def _fullIds(self, ids):
+        """ Returns True if request addressed all objects by full ids """
+        for a, id in ids:
+            if getattr(self, a) != id:
+                return False
+        return True
+
+    def _etag(self, ids):
+        """ Returns ETag of current page or None if it can't be computed
+            cheaply.
+        """
+        if ids is not None:
+            state = ids
+        elif self._a in _refs_actions:
+            state = self._git.stamp()
+        else:
+            return None
+
+        key = repr((_page_cache_format, self._dir, configStamp(self._dir),
+                    state, getattr(self, '_projects', None), self._a,
+                    self._id, self._id2, self._treeid, self._blobid,
+                    self._path, self._path2, self._filename, self._showmsg,
+                    self._page, self._format, self._start, self._count))
+        return '"{0}"'.format(hashlib.sha1(key).hexdigest())
+
+    def _pageKey(self):
+        return repr((_page_cache_format, self._dir, configStamp(self._dir),
+                     getattr(self, '_projects', None), self._a,
+                     self._id, self._id2, self._treeid, self._blobid,
+                     self._path, self._path2, self._filename, self._start,
+                     self._count))
+
+    def _runCached(self):
+        """ Runs immutable action through page cache """
+        key  = self._pageKey()
+        disk = None
+        if self._page_cache_dir:
+            disk = _diskCache(self._page_cache_dir, self._page_cache_size)
+
+        page = _pages.get(key)
+        if page is None and disk:
+            data = disk.get(key)
+            if data:
+                page = marshal.loads(data)
+                _pages.set(key, page)
+
+        if page:
+            content_type, disposition, html = page
+            if content_type:
+                self.setContentType(content_type)
+            if disposition:
+                self._req.headers_out['Content-disposition'] = disposition
+            self.write(html)
+            return apache.OK
+
+        self.startCapture()
+        try:
+            status = self._run()
+        finally:
+            html = self.stopCapture()
+
+        # pages with errors (e.g. from configuration) are not cached
+        if status == apache.OK and len(self._errors) == 0:
+            page = (self._req.content_type,
+                    self._req.headers_out.get('Content-disposition'), html)
+            if page_cache_bytes:
+                _pages.set(key, page)
+            if disk:
+                disk.set(key, marshal.dumps(page))
+        return status
+
+    def _run(self):
         if self._a == 'log':
             self.log(id = self._id, showmsg = self._showmsg, page = self._page)
         elif self._a == 'refs':
@@ -202,6 +542,10 @@ class ProjectBase(common.ModPythonOutput):
             self.commit(id = self._id)
         elif self._a == 'diff':
             self.diff(id = self._id, id2 = self._id2)
+        elif self._a == 'filediff':
+            self._section = 'diff'
+            self.fileDiff(id = self._id, id2 = self._id2, path = self._path,
+                          path2 = self._path2)
         elif self._a == 'patch':
             self.patch(id = self._id, id2 = self._id2)
         elif self._a == 'tree':
@@ -209,7 +553,8 @@ class ProjectBase(common.ModPythonOutput):
         elif self._a == 'blob':
             self._section = 'tree'
             self.blob(id = self._id, blobid = self._blobid, treeid = self._treeid, \
-                      path = self._path, filename = self._filename)
+                      path = self._path, filename = self._filename, \
+                      start = self._start, count = self._count)
         elif self._a == 'blob-raw':
             self.blobRaw(blobid = self._blobid, filename = self._filename)
         elif self._a == 'snapshot':
@@ -221,12 +566,13 @@ class ProjectBase(common.ModPythonOutput):
 
 
 class Project(ProjectBase):
-    def __init__(self, req, dir, projects = None):
-        super(Project, self).__init__(req, dir)
+    def __init__(self, req, dir, projects = None, config = None):
+        super(Project, self).__init__(req, dir, config)
 
         self._projects = projects
 
     def _fileOut(self, data, filename):
+        """ Writes data (string or iterable of chunks) as file filename """
         type = mimetypes.guess_type(filename)
         mime_type = type[0]
         if not mime_type:
@@ -234,7 +580,21 @@ class Project(ProjectBase):
 
         self.setContentType(mime_type)
         self.setFilename(filename)
-        self.write(data)
+
+        if isinstance(data, basestring):
+            self.write(data)
+            return
+
+        try:
+            for chunk in data:
+                self.write(chunk)
+            self.flush()
+        except IOError:
+            # client closed connection, nothing more to do
+            pass
+        finally:
+            if hasattr(data, 'close'):
+                data.close()
 
 
     def anchor(self, html, cls, v):
@@ -261,19 +621,20 @@ class Project(ProjectBase):
 
 
     def log(self, id = 'HEAD', showmsg = False, page = 1):
-        max_count = self._commits_per_page * page;
-        commits = self._git.revList(id, max_count = max_count)
-        commits = commits[self._commits_per_page * (page - 1):]
+        if page < 1:
+            page = 1
 
-        tags, heads, remotes = self._git.refs()
-        commits = self._git.commitsSetRefs(commits, tags, heads, remotes)
+        self.writeHeader()
 
-        html = ''
+        # only the shown window of history is read (plus one commit to
+        # find out whether there is a next page)
+        skip = self._commits_per_page * (page - 1)
+        commits = list(self._git.revList(id, max_count = self._commits_per_page + 1,
+                                             skip = skip))
+        has_next = len(commits) > self._commits_per_page
+        commits = commits[:self._commits_per_page]
 
-        if not showmsg:
-            expand = self.anchorLog('Expand', id, not showmsg, page)
-        else:
-            expand = self.anchorLog('Collapse', id, not showmsg, page)
+        commits = self._git.commitsSetRefs(commits)
 
         # Navigation
         nav = ''
@@ -285,14 +646,18 @@ class Project(ProjectBase):
 
         nav += '<span class="sep">|</span>'
 
-        nav += self.anchorLog('next', id, showmsg, page + 1)
+        if has_next:
+            nav += self.anchorLog('next', id, showmsg, page + 1)
+        else:
+            nav += '<span>next</span>'
         nav += '</div>'
 
-        html += nav
-        html += self._fLog(commits, longcomment = True, id = id, showmsg = showmsg, page = page)
-        html += nav
+        self.write(nav)
+        self.writeAll(self._fLog(commits, longcomment = True, id = id,
+                                 showmsg = showmsg, page = page))
+        self.write(nav)
 
-        self.write(self.tpl(html))
+        self.writeFooter()
 
 
     def refs(self):
@@ -318,9 +683,11 @@ class Project(ProjectBase):
         self.write(self.tpl(html))
 
     def summary(self):
+        self.writeHeader()
+
         tags, heads, remotes = self._git.refs()
         commits = self._git.revList('HEAD', max_count = self._commits_in_summary)
-        commits = self._git.commitsSetRefs(commits, tags, heads, remotes)
+        commits = self._git.commitsSetRefs(commits)
 
         html = ''
 
@@ -335,25 +702,27 @@ class Project(ProjectBase):
             html += self._fTags(tags, 10)
             html += '<br />'
 
-        html += self._fLog(commits)
+        self.write(html)
+        self.writeAll(self._fLog(commits))
 
-        self.write(self.tpl(html))
+        self.writeFooter()
 
 
     def commit(self, id):
         commit = self._git.commit(id)
+        if not commit:
+            self._setStatus(apache.HTTP_NOT_FOUND)
+            return
+
         parent = None
         if len(commit.parents) == 1:
             parent = commit.parents[0]
-        diff_trees = self._git.diffTree(id, parent, patch = True)
 
-        html = ''
-        if commit:
-            html += self._fCommitInfo(commit)
-            html += '<br />'
-            html += self._fDiffTree(diff_trees)
-
-        self.write(self.tpl(html))
+        self.writeHeader()
+        self.write(self._fCommitInfo(commit))
+        self.write('<br />')
+        self._writeDiffTree(id, parent)
+        self.writeFooter()
 
     def patch(self, id, id2):
         patch = self._git.formatPatch(id, id2)
@@ -361,32 +730,57 @@ class Project(ProjectBase):
         self.write(patch)
 
     def diff(self, id, id2):
-        diff_trees = self._git.diffTree(id, id2, patch = True)
-
-        html = ''
-        html += self._fDiffTree(diff_trees)
-
-        self.write(self.tpl(html))
+        self.writeHeader()
+        self._writeDiffTree(id, id2)
+        self.writeFooter()
+
+    def fileDiff(self, id, id2, path, path2 = None):
+        """ Diff of one file (path2 is its original name if it was renamed
+            or copied) between id and id2 or parent of id
+        """
+        self.writeHeader()
+
+        if not id2:
+            commit = self._git.commit(id)
+            if commit and len(commit.parents) == 1:
+                id2 = commit.parents[0]
+
+        paths = [path]
+        if path2 and path2 != path:
+            paths.append(path2)
+
+        diff_trees = list(self._git.diffTree(id, id2, patch = True,
+                                             paths = paths))
+        self.writeAll(self._fDiffTree(diff_trees, iter(diff_trees)))
+
+        self.writeFooter()
+
+    def _writeDiffTree(self, id, parent):
+        """ Writes list of files changed between parent and id followed by
+            their patches. Patches are read only if there are at most
+            patch_max_files files and only until patch_max_lines lines are
+            shown, the rest is linked to filediff pages.
+        """
+        diff_trees, patches = self._git.diffTreePatches(id, parent,
+                                                        self._patch_max_files)
+        try:
+            self.writeAll(self._fDiffTree(diff_trees, patches,
+                                          self._patch_max_lines))
+        finally:
+            # stops git if not all patches were read
+            if patches is not None:
+                patches.close()
 
 
     def tree(self, id, treeid, path = ''):
+        self.writeHeader()
+
         html = ''
 
-        objs = self._git.tree(id = treeid)
+        objs = self._git.tree(id = treeid, path = path)
 
         spath = path.split('/')
         spath = filter(lambda x: len(x) > 0, spath)
-        for p in spath:
-            found = False
-            for obj in objs:
-                if type(obj) is git.GitTree \
-                   and obj.name == p:
-                    objs = self._git.tree(id = obj.id)
-                    found = True
-                    break
-
-            if not found:
-                break
 
         html += self._fTreePath(path, treeid)
         html += '<br />'
@@ -414,7 +808,8 @@ class Project(ProjectBase):
             html += '<td>' + aname + '</td>'
             html += '<td>' + '</td>'
             html += '</tr>'
-            
+
+        self.write(html)
 
         for obj in objs:
             if type(obj) is git.GitTree:
@@ -443,35 +838,124 @@ class Project(ProjectBase):
 
             aname = self.anchor(obj.name, v = v, cls = cls)
 
-            html += '<tr>'
+            html  = '<tr>'
             html += '<td>' + obj.modeStr(obj.mode_oct) + '</td>'
             html += '<td>' + obj.size + '</td>'
             html += '<td>' + aname + '</td>'
             html += '<td>' + menu + '</td>'
             html += '</tr>'
-        html += '</table>'
+            self.write(html)
+        self.write('</table>')
 
-        self.write(self.tpl(html))
+        self.writeFooter()
 
 
-    def blob(self, id, blobid, treeid, path = '', filename = ''):
-        html = ''
+    def blob(self, id, blobid, treeid, path = '', filename = '', start = 1,
+                   count = 0):
+        # size is checked first so that huge blobs are never read
+        size = self._git.blobSize(blobid)
+        if size is None:
+            self._setStatus(apache.HTTP_NOT_FOUND)
+            return
+
+        self.writeHeader()
+
+        self.write(self._fTreePath(path, treeid, filename, blobid))
+        self.write('<br />')
+
+        if size > self._blob_max_size:
+            head = ''.join(self._git.blobChunks(blobid, 0, 8000))
+            self.write(self._fBlobRaw(blobid, filename, size, _isBinary(head)))
+            self.writeFooter()
+            return
 
         blob = self._git.blob(blobid)
+        if _isBinary(blob.data):
+            self.write(self._fBlobRaw(blobid, filename, size, True))
+            self.writeFooter()
+            return
 
-        html += self._fTreePath(path, treeid, filename, blobid)
-        html += '<br />'
-        html += self._fBlob(blob, filename)
+        if count <= 0:
+            count = self._blob_lines_per_page
+        v = { 'a'        : 'blob',
+              'id'       : id,
+              'blobid'   : blobid,
+              'treeid'   : treeid,
+              'path'     : path,
+              'filename' : filename }
+        self.writeAll(self._fBlob(blob, filename, start, count, v))
 
-        self.write(self.tpl(html))
+        self.writeFooter()
 
 
     def blobRaw(self, blobid, filename):
-        blob = self._git.blob(blobid)
-        return self._fileOut(blob.data, filename)
+        size = self._git.blobSize(blobid)
+        if size is None:
+            self._setStatus(apache.HTTP_NOT_FOUND)
+            return
+
+        self._req.headers_out['Accept-Ranges'] = 'bytes'
+
+        range = self._range(size)
+        if range is False:
+            self._req.headers_out['Content-Range'] = 'bytes */{0}'.format(size)
+            self._setStatus(apache.HTTP_RANGE_NOT_SATISFIABLE)
+            return
+
+        start  = 0
+        length = size
+        if range:
+            start, end = range
+            length = end - start + 1
+
+            self._req.status = apache.HTTP_PARTIAL_CONTENT
+            self._req.headers_out['Content-Range'] \
+                = 'bytes {0}-{1}/{2}'.format(start, end, size)
+
+        self.setContentLength(length)
+        chunks = self._git.blobChunks(blobid, start, length)
+        return self._fileOut(chunks, filename)
+
+    def _range(self, size):
+        """ Returns tuple (first, last) of byte range requested by Range
+            header, None if whole content should be sent or False if the
+            range can't be satisfied.
+        """
+        header = self._req.headers_in.get('Range')
+        if not header or header[:6] != 'bytes=' or ',' in header:
+            # multiple ranges are not supported, whole content is sent
+            return None
+
+        # range is valid only for the same version of content
+        if_range = self._req.headers_in.get('If-Range')
+        if if_range and if_range != self._req.headers_out.get('ETag'):
+            return None
+
+        first, sep, last = header[6:].strip().partition('-')
+        try:
+            if len(first) == 0:
+                # suffix range - last N bytes
+                first = max(size - int(last), 0)
+                last  = size - 1
+            else:
+                first = int(first)
+                last  = int(last) if len(last) > 0 else size - 1
+        except ValueError:
+            return None
+
+        if first >= size:
+            return False
+        if first < 0 or last < first:
+            return None
+        return (first, min(last, size - 1))
 
     def snapshot(self, id, format):
-        (data, filename) = self._git.archive(id, self._project_name, format)
+        disk = None
+        if self._snapshot_cache_dir:
+            disk = _diskCache(self._snapshot_cache_dir, self._snapshot_cache_size)
+
+        (data, filename) = self._git.archive(id, self._project_name, format,
+                                             cache = disk)
         return self._fileOut(data, filename)
 
     def pull(self, path):
@@ -520,46 +1004,101 @@ class Project(ProjectBase):
 
         return html
 
-    def _fBlob(self, blob, filename = ''):
-        html = ''
+    def _fBlobRaw(self, blobid, filename, size, binary):
+        v = { 'a'        : 'blob-raw',
+              'blobid'   : blobid,
+              'filename' : filename }
+
+        html = '<div class="blob-raw">'
+        if binary:
+            html += 'Binary file'
+        else:
+            html += 'File is too big to be shown'
+        html += ' ({0} bytes), '.format(size)
+        html += self.anchor('download raw file', v = v, cls = '')
+        html += '</div>'
+        return html
 
-        data = blob.data
+    def _fBlobNav(self, v, start, count, total):
+        """ Returns navigation between pages of lines of blob, v are
+            parameters of link to blob
+        """
+        def anchor(html, start):
+            va = dict(v)
+            va['start'] = start
+            va['count'] = count
+            return self.anchor(html, v = va, cls = '')
 
-        lexer     = None
-        formatter = None
+        end = min(start + count - 1, total)
+
+        nav = '<div class="blob_nav">'
+        if start <= 1:
+            nav += '<span>prev</span>'
+        else:
+            nav += anchor('prev', max(start - count, 1))
+
+        nav += '<span class="sep">|</span>'
+        nav += '<span>lines {0}-{1} of {2}</span>'.format(start, end, total)
+        nav += '<span class="sep">|</span>'
+
+        if end >= total:
+            nav += '<span>next</span>'
+        else:
+            nav += anchor('next', end + 1)
+
+        vraw = { 'a'        : 'blob-raw',
+                 'blobid'   : v['blobid'],
+                 'filename' : v['filename'] }
+        nav += '<span class="sep">|</span>'
+        nav += self.anchor('raw', v = vraw, cls = '')
+        nav += '</div>'
+        return nav
+
+    def _fBlob(self, blob, filename = '', start = 1, count = 0, v = None):
+        """ Generates html of lines start..start+count-1 of blob (all lines
+            if count is not positive), v are parameters of link to blob
+            used for navigation between pages of lines.
+        """
+        lines = None
         if pygments and len(filename) > 0:
-            try:
-                lexer     = get_lexer_for_filename(filename)
-                formatter = HtmlFormatter(nowrap = True, noclasses = True, style = 'trac')
-                data = highlight(data, lexer, formatter)
-            except:
-                lexer     = None
-                formatter = None
-
-        lines = data.split('\n')
-        if len(lines[-1]) == 0:
-            lines = lines[:-1]
+            lines = _highlight(blob.id, blob.data, filename)
+
+        highlighted = lines is not None
+        if not highlighted:
+            lines = blob.data.split('\n')
+            if len(lines[-1]) == 0:
+                lines = lines[:-1]
 
         digits = 0
         if len(lines) > 0:
             digits = int(math.ceil(math.log(len(lines), 10)))
 
-        linepat = '<div class="blob-line">'
-        linepat += '<span class="blob-linenum"> {{0: >{0}d}} </span>'
+        linepat = '<div class="blob-line" id="l{{0}}">'
+        linepat += '<span class="blob-linenum"><a href="#l{{0}}"> {{0: >{0}d}} </a></span>'
         linepat += '<span class="blob-line"> {{1}}</span>'
         linepat += '</div>'
         linepat = linepat.format(digits)
 
-        if not lexer:
+        total = len(lines)
+        start = max(start, 1)
+        if count <= 0:
+            count = max(total, 1)
+
+        nav = ''
+        if v and (start > 1 or total > count):
+            nav = self._fBlobNav(v, start, count, total)
+        lines = lines[start - 1:start - 1 + count]
+
+        if not highlighted:
             lines = map(lambda x: self._esc(x), lines)
 
-        html += '<div class="blob">'
+        yield nav
+        yield '<div class="blob">'
         for i in range(0, len(lines)):
             line = lines[i]
-            html += linepat.format(i + 1, line)
-        html += '</div>'
-
-        return html
+            yield linepat.format(start + i, line)
+        yield '</div>'
+        yield nav
 
 
     def _fSummaryInfo(self):
@@ -768,8 +1307,7 @@ class Project(ProjectBase):
 
 
     def _fLog(self, commits, id = 'HEAD', longcomment = False, showmsg = False, page = 1):
-        html = ''
-
+        """ Generates html of table of commits row by row """
         expand = ''
         if longcomment:
             if not showmsg:
@@ -778,7 +1316,7 @@ class Project(ProjectBase):
                 expand = self.anchorLog('Collapse', id, not showmsg, page)
             expand = ' (' + expand + ')'
 
-        html += '''
+        yield '''
 <table class="log">
         <tr class="log_header">
             <td>Age</td>
@@ -827,16 +1365,14 @@ class Project(ProjectBase):
                 longcomment += self._esc(commit.commentRestLines().strip(' \n\t'))
                 longcomment += '</div><br />'
 
-            html += h.format(id          = commit.id,
-                             author      = self._esc(commit.author.name()),
-                             date_full   =
-                             commit.author.date.format('%Y-%m-%d %H:%M:%S'),
-                             date        = commit.author.date.format('%Y-%m-%d'),
-                             longcomment = longcomment,
-                             tree        = commit.tree)
-        html += '</table>'
-
-        return html
+            yield h.format(id          = commit.id,
+                           author      = self._esc(commit.author.name()),
+                           date_full   =
+                           commit.author.date.format('%Y-%m-%d %H:%M:%S'),
+                           date        = commit.author.date.format('%Y-%m-%d'),
+                           longcomment = longcomment,
+                           tree        = commit.tree)
+        yield '</table>'
 
 
     def _fCommitInfoPerson(self, title, person):
@@ -908,14 +1444,15 @@ class Project(ProjectBase):
                    <div class="commit-msg">{rest}</div>'''.format(short = short, rest = rest)
         return html
 
-    def _fDiffTree(self, diff_trees):
-        html = ''
-
+    def _fDiffTree(self, diff_trees, patches = None, max_lines = None):
+        """ Generates html of list of changed files followed by patches
+            (see _fDiffTreePatch())
+        """
         if len(diff_trees) == 0:
-            return html
+            return
 
-        html += '<table class="diff-tree">'
-        html += '''
+        yield '<table class="diff-tree">'
+        yield '''
         <tr>
             <td colspan="3" class="diff-tree-num-changes">{0} files changed</td>
         </tr>
@@ -938,7 +1475,7 @@ class Project(ProjectBase):
                       'path'     : blobpath,
                       'filename' : blobfilename }
 
-            html += '<tr>'
+            html  = '<tr>'
 
             anchor = self.anchor(self._esc(d.to_file), v = blobv, cls = "diff-tree-file")
             html += '<td>{0}</td>'.format(anchor)
@@ -973,34 +1510,89 @@ class Project(ProjectBase):
                 change = change.format(self._esc(d.from_file), d.similarity)
                 html += '<td class="diff-tree-RC">{0}</td>'.format(change)
 
-            menu = '<a href="#{0}" class="menu">diff</a>'.format(d.from_id + d.to_id)
+            if patches is not None:
+                menu = '<a href="#{0}" class="menu">diff</a>'.format(d.from_id + d.to_id)
+            else:
+                menu = self.anchor('diff', v = self._fileDiffArgs(d), cls = "menu")
             menu += '&nbsp;|&nbsp;'
             menu += self.anchor('blob', v = blobv, cls = "menu")
 
             html += '<td class="diff-tree-menu">{0}</td>'.format(menu)
             html += '</tr>'
+            yield html
 
-        html += '</table>'
+        yield '</table>'
 
-        html += '<br />'
+        yield '<br />'
 
-        html += self._fDiffTreePatch(diff_trees)
+        for h in self._fDiffTreePatch(diff_trees, patches, max_lines):
+            yield h
 
-        return html
-
-    def _fDiffTreePatch(self, diff_trees):
-        html = ''
+    def _fDiffTreePatch(self, diff_trees, patches, max_lines = None):
+        """ Generates html of patches of diff_trees taken from patches
+            (iterator of the same diff trees with patches filled in, no
+            patches are shown if it is None). Once max_lines lines of
+            patches were shown, only links to filediff pages are generated.
+        """
+        if patches is None:
+            return
 
+        lines = 0
         for d in diff_trees:
-            html += self._fPatch(d, d.patch)
+            p = None
+            if patches is not None:
+                p = next(patches, None)
+
+            if p is not None and max_lines is not None:
+                lines += p.patch.count('\n')
+                if lines > max_lines:
+                    # the rest of patches is not read at all
+                    p = None
+                    patches = None
+
+            if p is None:
+                yield self._fPatchLink(d)
+                continue
+
+            for h in self._fPatch(p, p.patch):
+                yield h
+
+    def _fileDiffArgs(self, d):
+        """ Returns parameters of link to filediff page of diff tree d """
+        v = { 'a'    : 'filediff',
+              'id'   : self._id,
+              'path' : d.to_file }
+        if self._id2:
+            v['id2'] = self._id2
+        if d.from_file != d.to_file:
+            v['path2'] = d.from_file
+        return v
+
+    def _fPatchLink(self, d):
+        """ Returns placeholder of patch which is not shown """
+        html  = '<a name="{0}"></a>'.format(d.from_id + d.to_id)
+        html += '<div class="patch">'
+        html += '<div class="patch-header">'
+        html += 'diff --git a/{0} b/{1}'.format(self._esc(d.from_file),
+                                                self._esc(d.to_file))
+        html += '</div>'
+        html += '<div class="patch-more">'
+        html += self.anchor('show diff', v = self._fileDiffArgs(d), cls = '')
+        html += '</div>'
+        html += '</div>'
         return html
 
     def _fPatch(self, d, patch):
-        pat_head  = re.compile(r'^diff --git (a/.*) (b/.*)$')
-        pat_index = re.compile(r'^index ([^\.]*)..([^ ]*)(.*)$')
-        pat_from_file = re.compile(r'^---')
-        pat_chunk = re.compile(r'^(@@.*@@)(.*)$')
-
+        """ Generates html of patch of one file in batches of
+            patch_batch_lines lines
+        """
+        # header of patch (up to the first hunk) is read line by line, the
+        # rest of it is escaped and split at once
+        rest = None
+        hunk = patch.find('\n@@')
+        if hunk >= 0:
+            rest  = patch[hunk + 1:]
+            patch = patch[:hunk]
         lines = patch.split('\n')
 
         html = ''
@@ -1010,7 +1602,7 @@ class Project(ProjectBase):
         length = len(lines)
 
         # header line
-        m = pat_head.match(lines[cur])
+        m = _patch_head_pattern.match(lines[cur])
         if m:
             path = d.from_file.rsplit('/', 1)
             if len(path) == 2:
@@ -1050,7 +1642,7 @@ class Project(ProjectBase):
             cur += 1
 
         html += '<div class="patch-index">'
-        while cur < length and not pat_index.match(lines[cur]):
+        while cur < length and not _patch_index_pattern.match(lines[cur]):
             if len(lines[cur]) > 0:
                 html += lines[cur] + '<br />'
             cur += 1
@@ -1066,28 +1658,47 @@ class Project(ProjectBase):
             html += '<div class="patch-to-file">' + self._esc(lines[cur]) + '</div>'
             cur += 1
 
-        for line in lines[cur:]:
-            m = pat_chunk.match(line)
-            if m:
-                html += '<div class="patch-chunk">'
-                html += '<span class="patch-chunk-range">' + m.group(1) + '</span>'
-                html += str(m.group(2))
-                html += '</div>'
-                continue
-
-            if len(line) > 0 and line[0] == '-':
-                html += '<div class="patch-rm">' + self._esc(line) + '</div>'
-            elif len(line) > 0 and line[0] == '+':
-                html += '<div class="patch-add">' + self._esc(line) + '</div>'
-            else:
-                html += '<div class="patch-line">' + self._esc(line) + '</div>'
-
-        html += '</div>'
-
-        return html
+        yield html
+
+        lines = map(self._esc, lines[cur:])
+        if rest is not None:
+            if '<' in rest:
+                rest = rest.replace('<', '&lt;')
+            if '>' in rest:
+                rest = rest.replace('>', '&gt;')
+            lines.extend(rest.split('\n'))
+
+        chunk = _patch_chunk_pattern.match
+        line_start = _patch_line_start.get
+        for start in xrange(0, len(lines), patch_batch_lines):
+            out = []
+            append = out.append
+            for line in lines[start:start + patch_batch_lines]:
+                s = line_start(line[:1])
+                if s is None:
+                    m = line[:2] == '@@' and chunk(line)
+                    if m:
+                        append('<div class="patch-chunk"><span class="patch-chunk-range">')
+                        append(m.group(1))
+                        append('</span>')
+                        append(m.group(2))
+                        append('</div>')
+                        continue
+                    s = '<div class="patch-line">'
+
+                append(s)
+                append(line)
+                append('</div>')
+            yield ''.join(out)
+
+        yield '</div>'
 
 
     def tpl(self, content):
+        return self.tplHeader() + content + self.tplFooter()
+
+    def tplHeader(self):
+        """ Returns beginning of page up to its content """
         header = ''
         if self._projects:
             header += '<a href="{0}">projects</a>'.format(self._projects)
@@ -1132,14 +1743,26 @@ class Project(ProjectBase):
         <div class="menu">{menu}</div>
 
         <div class="content">
-            {content}
+            '''.format(css = self.css(), errors = errors,
+           project_name = self._project_name,
+           header = header, menu = menu)
+        return html
+
+    def tplFooter(self):
+        """ Returns end of page following its content """
+        return '''
         </div>
     </body>
 </html>
-'''.format(css = self.css(), errors = errors,
-           project_name = self._project_name,
-           header = header, menu = menu, content = content)
-        return html
+'''
+
+    def writeHeader(self):
+        """ Writes beginning of page and sends it to client right away """
+        self.write(self.tplHeader())
+        self.flush()
+
+    def writeFooter(self):
+        self.write(self.tplFooter())
 
 
     def css(self):
@@ -1215,6 +1838,7 @@ div.patch-chunk { background-color: #fff7ff; border-top: 1px dotted #FFE0FF; mar
 span.patch-chunk-range { background-color: #ffe0ff; display: block-inline; color: #909; }
 div.patch-rm { color: #A00; }
 div.patch-add { color: #007000; }
+div.patch-more { padding: 3px; }
 
 table.tree tr.header * { font-family: sans; }
 table.tree * { font-family: monospace; }
@@ -1224,6 +1848,11 @@ div.blob * { font-family: monospace; }
 div.blob { border-top: 1px solid black; }
 div.blob-line * { white-space: pre; }
 span.blob-linenum { color: #999; display: block-inline; border-right: 1px solid black; }
+span.blob-linenum a { color: #999; }
+div.blob-raw { margin: 10px; }
+div.blob_nav { margin: 10px; }
+div.blob_nav span.sep { margin-left: 5px; margin-right: 5px; }
+div.blob_nav span { color: #555555; }
 
 div.error { color: #A00; font-size: 12px; font-weight: bold; margin-bottom: 10px; }
         '''
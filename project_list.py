@@ -22,10 +22,110 @@
 
 from mod_python import apache, util
 import os
+import stat
+import time
+import hashlib
+import threading
+import Queue
 
-from project import Project
+from project import Project, loadConfig, projectName
 import common
 
+# Number of threads computing dates of last change for list of projects
+last_change_threads = 8
+
+# Maximal time (in seconds) the list waits for date of last change of one
+# project (git rev-list running longer is killed)
+last_change_timeout = 10
+
+
+class _Task(object):
+    def __init__(self, func, args):
+        self.func      = func
+        self.args      = args
+        self.result    = None
+        self.start     = None
+        self.started   = threading.Event()
+        self.done      = threading.Event()
+        self.abandoned = False
+
+class _Pool(object):
+    """ Fixed number of daemon threads running submitted functions. A
+        thread stuck in a task which is no longer waited for is replaced by
+        a new one (and it ends once the task finishes).
+    """
+
+    def __init__(self, size):
+        self._queue = Queue.Queue()
+        self._lock  = threading.Lock()
+        for i in range(0, size):
+            self._startWorker()
+
+    def _startWorker(self):
+        t = threading.Thread(target = self._worker)
+        t.daemon = True
+        t.start()
+
+    def _worker(self):
+        while True:
+            task = self._queue.get()
+            task.start = time.time()
+            task.started.set()
+            try:
+                result = task.func(*task.args)
+            except Exception:
+                result = None
+
+            with self._lock:
+                if task.abandoned:
+                    return
+                task.result = result
+                task.done.set()
+
+    def map(self, func, items, timeout = None):
+        """ Returns list of func(item) for each item, exceptions are
+            turned into None. If timeout is given, tasks running longer
+            than timeout are not waited for, their results are None too.
+        """
+        tasks = [_Task(func, (item, )) for item in items]
+        for t in tasks:
+            self._queue.put(t)
+
+        for t in tasks:
+            if timeout is None:
+                t.done.wait()
+                continue
+
+            # a thread is always replaced once its task is abandoned, so
+            # every task starts eventually
+            t.started.wait()
+            if t.done.wait(max(0, t.start + timeout - time.time())):
+                continue
+
+            with self._lock:
+                if not t.done.is_set():
+                    t.abandoned = True
+                    self._startWorker()
+        return [t.result for t in tasks]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _lastChanges(projects):
+    """ Returns list of dates of last change of projects computed
+        concurrently (None where it timed out or failed)
+    """
+    global _pool
+
+    # threads are started lazily, i.e. in forked child process
+    with _pool_lock:
+        if _pool is None:
+            _pool = _Pool(last_change_threads)
+
+    return _pool.map(lambda prj: prj.lastChange(timeout = last_change_timeout),
+                     projects, last_change_timeout)
+
+
 
 class ProjectListBase(common.ModPythonOutput):
     def __init__(self, req, projects = [], basepath = '/'):
@@ -37,6 +137,19 @@ class ProjectListBase(common.ModPythonOutput):
         self._projects = projects
         self._basepath = basepath
 
+        # the first project of the same name wins
+        self._projects_by_name = {}
+        for p in reversed(projects):
+            self._projects_by_name[p.projectName()] = p
+
+    def project(self, name):
+        """ Returns project of given name or None """
+        return self._projects_by_name.get(name)
+
+    def projects(self):
+        """ Returns list of all projects """
+        return self._projects
+
 
     def _uri(self):
         uri = self._req.uri.split('/')
@@ -46,15 +159,35 @@ class ProjectListBase(common.ModPythonOutput):
     def run(self):
         uri = self._uri()
         if len(uri) > 0:
-            prj_name = uri[-1]
-            for p in self._projects:
-                if prj_name == p.projectName():
-                    return p.run()
+            p = self.project(uri[-1])
+            if p:
+                return p.run()
+
+        projects = self.projects()
+
+        etag = self._etag(projects)
+        if self.notModified(etag):
+            self.setETag(etag)
+            return apache.HTTP_NOT_MODIFIED
+
+        last_changes = _lastChanges(projects)
+        if None in last_changes:
+            # some dates are missing (git timed out), the page must not be
+            # revalidated by the ETag of the complete one
+            self._req.headers_out['Cache-Control'] = 'no-store'
+        else:
+            self.setETag(etag)
 
-        self.write(self.tpl(self._fProjectList()))
+        self.write(self.tpl(self._fProjectList(projects, last_changes)))
+        self.flush()
         return apache.OK
 
-    def _fProjectList(self):
+    def _etag(self, projects):
+        """ Returns ETag of list of projects """
+        stamps = [p.stamp() for p in projects]
+        return '"{0}"'.format(hashlib.sha1(repr(stamps)).hexdigest())
+
+    def _fProjectList(self, projects, last_changes):
         html = ''
         html += '<table class="projects">'
 
@@ -65,11 +198,11 @@ class ProjectListBase(common.ModPythonOutput):
         html += '<td>Last change</td>'
         html += '</tr>'
 
-        for prj in self._projects:
+        for prj, last_change in zip(projects, last_changes):
             name        = self._esc(prj.projectName())
             owner       = self._esc(prj.owner())
             desc        = self._esc(prj.description())
-            last_change = self._esc(prj.lastChange())
+            last_change = self._esc(last_change or '')
 
             html += '<tr>'
             html += '<td><a href="{0}{1}">{1}</a></td>'.format(self._basepath, name)
@@ -130,24 +263,171 @@ a.menu { font-family: sans !important; font-size: 11px !important; }
         return h
 
 
+def _stat(path):
+    """ Returns tuple identifying current state of regular file or
+        directory on path or None if there is none.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode) and not stat.S_ISDIR(st.st_mode):
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+class _RegistryEntry(object):
+    """ One subdirectory of parent directory together with its loaded
+        configuration (valid only if the directory contains pitweb.py).
+    """
+
+    def __init__(self, path):
+        self.path   = path
+        self.stamp  = None
+        self.config = None
+        self.name   = None
+
+    def update(self):
+        """ Re-loads configuration if pitweb.py changed since the last
+            call. Returns True if the entry changed.
+        """
+        stamp = _stat(os.path.join(self.path, 'pitweb.py'))
+        if stamp == self.stamp and self.name is not None:
+            return False
+
+        self.stamp = stamp
+        if stamp is None:
+            self.config = None
+            self.name   = ''
+        else:
+            self.config = loadConfig(self.path)
+            self.name   = projectName(self.path, self.config[0])
+        return True
+
+    def valid(self):
+        return self.stamp is not None
+
+    def project(self, req, basepath):
+        return Project(req, self.path, basepath, config = self.config)
+
+class _Registry(object):
+    """ Projects found in one parent directory.
+
+        The registry is shared by all requests of the process. Listing of
+        the directory is re-read only when its mtime changes and
+        configuration of a project only when its pitweb.py changes.
+    """
+
+    def __init__(self, dir):
+        self._dir     = dir
+        self._stamp   = None
+        self._entries = []
+        self._paths   = {}
+        self._names   = {}
+        self._lock    = threading.Lock()
+
+    def _refresh(self):
+        stamp = _stat(self._dir)
+        if stamp == self._stamp:
+            return False
+
+        old = dict([(e.path, e) for e in self._entries])
+
+        entries = []
+        dirs = []
+        if stamp:
+            dirs = sorted(os.listdir(self._dir), key=str.lower)
+        for dir in dirs:
+            path = os.path.join(self._dir, dir)
+            if os.path.isdir(path):
+                entries.append(old.get(path, _RegistryEntry(path)))
+
+        self._stamp   = stamp
+        self._entries = entries
+        self._paths   = dict([(e.path, e) for e in entries])
+        return True
+
+    def _updateAll(self):
+        changed = False
+        for e in self._entries:
+            if e.update():
+                changed = True
+        return changed
+
+    def _index(self):
+        self._names = {}
+        for e in reversed(self._entries):
+            if e.valid():
+                self._names[e.name] = e
+
+    def find(self, name):
+        """ Returns entry of project of given name or None """
+        with self._lock:
+            if self._refresh():
+                self._updateAll()
+                self._index()
+
+            entry = self._names.get(name)
+            if entry is not None:
+                if not entry.update() and entry.valid():
+                    return entry
+
+                # configuration changed, the name may be different now
+                self._index()
+                return self._names.get(name)
+
+            # unknown names are answered from the index, only directories
+            # named after the project are checked as their configuration
+            # may have been just created (other changes are picked up once
+            # the directory or the whole list is re-read)
+            changed = False
+            for dir in [name, name + '.git']:
+                e = self._paths.get(os.path.join(self._dir, dir))
+                if e is not None and e.update():
+                    changed = True
+            if changed:
+                self._index()
+            return self._names.get(name)
+
+    def entries(self):
+        """ Returns list of entries of all projects """
+        with self._lock:
+            self._refresh()
+            self._updateAll()
+            self._index()
+            return [e for e in self._entries if e.valid()]
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+def _registry(dir):
+    dir = os.path.abspath(dir)
+    with _registries_lock:
+        registry = _registries.get(dir)
+        if registry is None:
+            registry = _registries[dir] = _Registry(dir)
+    return registry
+
+
 class ProjectListDir(ProjectListBase):
     """ List of projects is based on one directory.
         All subdirectories which contain config file (piteweb.py) are taken
         as project.
+
+        Directory and configuration files are read only when they change
+        (see _Registry) and Project objects are created only for projects
+        which are really needed to serve the request.
     """
 
     def __init__(self, req, dir, basepath = '/'):
-        projects = self._projects(req, dir, basepath)
-        super(ProjectListDir, self).__init__(req, projects, basepath = basepath)
-
-    def _projects(self, req, parent_dir, basepath):
-        projects = []
+        super(ProjectListDir, self).__init__(req, [], basepath = basepath)
+        self._registry = _registry(dir)
 
-        dirs = sorted(os.listdir(parent_dir), key=str.lower)
-        for dir in dirs:
-            path   = os.path.join(parent_dir, dir)
-            config = os.path.join(path, 'pitweb.py')
-            if os.path.isdir(path) and os.path.isfile(config):
-                projects.append(Project(req, path, basepath))
+    def project(self, name):
+        entry = self._registry.find(name)
+        if entry is None:
+            return None
+        return entry.project(self._req, self._basepath)
 
-        return projects
+    def projects(self):
+        return [e.project(self._req, self._basepath)
+                    for e in self._registry.entries()]
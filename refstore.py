@@ -0,0 +1,301 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+import os
+import re
+import mmap
+import threading
+
+patterns = {
+    'id' : re.compile(r'^[0-9a-fA-F]{40}$'),
+}
+
+
+def _stat(path):
+    """ Returns tuple identifying current state of file or None """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+def _readFile(path):
+    try:
+        f = open(path, 'r')
+    except IOError:
+        return None
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+class PackedRefs(object):
+    """ Memory mapped packed-refs file. """
+
+    def __init__(self, path):
+        self.stat = _stat(path)
+
+        self._map = None
+        self._start = 0
+        self._sorted = False
+        self._peeled = False
+        self._fully_peeled = False
+
+        if not self.stat or self.stat[1] == 0:
+            return
+
+        f = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        if self._map[:1] == '#':
+            end = self._map.find('\n')
+            header = self._map[:end].split()
+            self._sorted = 'sorted' in header
+            self._peeled = 'peeled' in header or 'fully-peeled' in header
+            self._fully_peeled = 'fully-peeled' in header
+            self._start = end + 1
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+
+    def _lineEnd(self, pos):
+        end = self._map.find('\n', pos)
+        if end < 0:
+            end = len(self._map)
+        return end
+
+    def _record(self, start):
+        """ Returns tuple (ref line, peeled id or None, start of next record) """
+        m = self._map
+        end = self._lineEnd(start)
+        line = m[start:end]
+
+        peeled = None
+        next = end + 1
+        if next < len(m) and m[next] == '^':
+            pend = self._lineEnd(next)
+            peeled = m[next + 1:pend].strip()
+            next = pend + 1
+        return (line, peeled, next)
+
+    def _peeledId(self, refname, id, peeled):
+        """ Returns peeled id of the record. According to the header a ref
+            without peeled line may be known to point to an object which is
+            not a tag, such ref is peeled to itself.
+        """
+        if peeled is None \
+           and (self._fully_peeled \
+                or (self._peeled and refname[:10] == 'refs/tags/')):
+            return id
+        return peeled
+
+    def lookup(self, name):
+        """ Returns tuple (id, peeled id or None) or None """
+        if self._map is None:
+            return None
+
+        m = self._map
+        if not self._sorted:
+            for refname, id, peeled in self.refs():
+                if refname == name:
+                    return (id, peeled)
+            return None
+
+        # binary search over records
+        lo = self._start
+        hi = len(m)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = m.rfind('\n', lo, mid) + 1
+            if start < lo:
+                start = lo
+            if m[start] == '^':
+                # peeled line belongs to the preceding record
+                start = m.rfind('\n', lo, start - 1) + 1
+                if start < lo:
+                    start = lo
+
+            line, peeled, next = self._record(start)
+            refname = line[41:].strip()
+            if refname == name:
+                return (line[:40], self._peeledId(refname, line[:40], peeled))
+            elif refname < name:
+                lo = next
+            else:
+                hi = start
+        return None
+
+    def refs(self):
+        """ Returns list of tuples (refname, id, peeled id or None) """
+        if self._map is None:
+            return []
+
+        refs = []
+        for line in self._map[self._start:].split('\n'):
+            if len(line) == 0 or line[0] == '#':
+                continue
+            if line[0] == '^':
+                if len(refs) > 0:
+                    refname, id, peeled = refs[-1]
+                    refs[-1] = (refname, id, line[1:].strip())
+                continue
+
+            p = line.split(' ', 1)
+            if len(p) == 2 and patterns['id'].match(p[0]):
+                refname = p[1].strip()
+                refs.append((refname, p[0], self._peeledId(refname, p[0], None)))
+        return refs
+
+
+class _Listing(object):
+    """ All refs of one repository together with state of the files they
+        were read from.
+    """
+
+    def __init__(self, dirs, stamp, refs):
+        self.dirs  = dirs
+        self.stamp = stamp
+        self.refs  = refs
+
+_packed = {}
+_listings = {}
+_lock = threading.Lock()
+
+
+class RefStore(object):
+    """ Reads refs directly from git directory (loose refs under refs/ and
+        packed-refs file), no git process is spawned.
+
+        Listing of all refs is cached per process and it is re-read only if
+        mtime of packed-refs or of some directory under refs/ changes
+        (git updates refs by renaming lock files, so each change of a loose
+        ref changes mtime of its directory).
+    """
+
+    def __init__(self, dir):
+        self._dir = os.path.realpath(dir)
+        self._packed_path = os.path.join(self._dir, 'packed-refs')
+        self._refs_dir = os.path.join(self._dir, 'refs')
+
+    def _packedRefs(self):
+        st = _stat(self._packed_path)
+        with _lock:
+            packed = _packed.get(self._packed_path)
+            if packed is None or packed.stat != st:
+                packed = PackedRefs(self._packed_path)
+                _packed[self._packed_path] = packed
+        return packed
+
+    def _readLoose(self, name):
+        """ Returns content of loose ref or None """
+        if '..' in name or name.startswith('/'):
+            return None
+
+        path = os.path.join(self._dir, name)
+        if not os.path.isfile(path):
+            return None
+
+        value = _readFile(path)
+        if value is None:
+            return None
+        return value.strip()
+
+    def lookup(self, name, depth = 0):
+        """ Returns id the ref points to (symbolic refs are followed) or
+            None if there is no such ref.
+        """
+        if depth > 5:
+            return None
+
+        value = self._readLoose(name)
+        if value is None:
+            packed = self._packedRefs().lookup(name)
+            if packed is None:
+                return None
+            return packed[0]
+
+        if value[:5] == 'ref: ':
+            return self.lookup(value[5:].strip(), depth + 1)
+        if patterns['id'].match(value):
+            return value.lower()
+        return None
+
+    def symbolicRef(self, name = 'HEAD'):
+        """ Returns name of ref the symbolic ref points to or None """
+        value = self._readLoose(name)
+        if value and value[:5] == 'ref: ':
+            return value[5:].strip()
+        return None
+
+    def _stamp(self, dirs):
+        return tuple([_stat(self._packed_path)] + [_stat(d) for d in dirs])
+
+    def _scan(self):
+        """ Reads all refs and returns new _Listing """
+        dirs  = []
+        names = []
+        for root, subdirs, files in os.walk(self._refs_dir):
+            dirs.append(root)
+            for f in files:
+                if not f.endswith('.lock'):
+                    name = os.path.join(root, f)[len(self._dir) + 1:]
+                    names.append(name.replace(os.sep, '/'))
+
+        # take the stamp before reading refs so that a concurrent change
+        # makes the listing stale rather than lost
+        stamp = self._stamp(dirs)
+
+        refs = dict([(r[0], r) for r in self._packedRefs().refs()])
+        for name in names:
+            id = self.lookup(name)
+            if id:
+                refs[name] = (name, id, None)
+
+        refs = sorted(refs.values())
+        return _Listing(dirs, stamp, refs)
+
+    def _listing(self):
+        with _lock:
+            listing = _listings.get(self._dir)
+
+        if listing is None or self._stamp(listing.dirs) != listing.stamp:
+            listing = self._scan()
+            with _lock:
+                _listings[self._dir] = listing
+        return listing
+
+    def stamp(self):
+        """ Returns hashable value which changes whenever any ref changes """
+        return self._listing().stamp
+
+    def refs(self):
+        """ Returns sorted list of tuples (refname, id, peeled id or None)
+            of all refs under refs/. Peeled id is known only for refs from
+            packed-refs (refs which don't point to a tag are peeled to
+            themselves).
+        """
+        return self._listing().refs
@@ -0,0 +1,113 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Tests of cache module.
+
+Usage: python -m unittest discover -s tests
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import cache
+
+
+class LRUCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.evicted = []
+        self.cache = cache.LRUCache(max_items = 2, on_evict = self.onEvict)
+
+    def onEvict(self, key, value):
+        self.evicted.append((key, value))
+
+    def testEvicted(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertEqual(self.evicted, [('b', 2)])
+
+        # replaced value is evicted too, the same one is not
+        self.cache.set('a', 4)
+        self.cache.set('a', 4)
+        self.assertEqual(self.evicted, [('b', 2), ('a', 1)])
+
+    def testSetDefault(self):
+        self.assertEqual(self.cache.setDefault('a', lambda: 1), 1)
+        self.assertEqual(self.cache.setDefault('a', lambda: 2), 1)
+        self.cache.setDefault('b', lambda: 3)
+        self.cache.setDefault('c', lambda: 4)
+        self.assertEqual(self.evicted, [('a', 1)])
+        self.assertEqual(self.cache.get('c'), 4)
+
+
+class DiskCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix = 'pitweb-test-')
+        self.cache = cache.DiskCache(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testGenerate(self):
+        f = self.cache.generate('key', lambda out: out.write('value'))
+        self.assertEqual(f.read(), 'value')
+        f.close()
+
+        f = self.cache.generate('key', lambda out: out.write('other'))
+        self.assertEqual(f.read(), 'value')
+        f.close()
+
+    def testGenerateFailed(self):
+        def write(out):
+            out.write('partial')
+            raise RuntimeError('failed')
+
+        self.assertRaises(RuntimeError, self.cache.generate, 'key', write)
+        self.assertEqual(self.cache.get('key'), None)
+
+        f = self.cache.generate('key', lambda out: out.write('value'))
+        self.assertEqual(f.read(), 'value')
+        f.close()
+
+    def testHeldLockKept(self):
+        self.cache.set('key', 'value')
+        path = self.cache._path('key')
+
+        lock = self.cache._lockFile(path)
+        try:
+            self.cache.clear()
+            self.assertTrue(os.path.exists(path + '.lock'))
+        finally:
+            lock.close()
+
+        self.cache.set('key', 'value')
+        self.cache.clear()
+        self.assertFalse(os.path.exists(path + '.lock'))
+
+if __name__ == '__main__':
+    unittest.main()
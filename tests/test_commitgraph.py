@@ -0,0 +1,85 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Tests of commitgraph module: walk() is compared with git rev-list.
+
+Usage: python -m unittest discover -s tests
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import commitgraph
+import objstore
+from test_objstore import createRepo, git
+
+
+class WalkTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix = 'pitweb-test-')
+        self.repo = os.path.join(self.dir, 'repo.git')
+        createRepo(self.repo)
+        git(self.repo, 'commit-graph', 'write', '--reachable')
+
+        self.objects = objstore.ObjectStore(self.repo)
+        self.starts = [git(self.repo, 'rev-parse', 'master').strip(),
+                       git(self.repo, 'rev-parse', 'topic').strip()]
+        self.expected = git(self.repo, 'rev-list', *self.starts).split()
+
+    def tearDown(self):
+        for stamp, graph in commitgraph._graphs.values():
+            if graph is not None:
+                graph.close()
+        commitgraph._graphs.clear()
+        objstore._object_dirs.clear()
+        objstore._delta_bases.clear()
+        shutil.rmtree(self.dir)
+
+    def testWalk(self):
+        graph = commitgraph.load(self.repo)
+        self.assertTrue(graph is not None)
+        self.assertEqual(list(commitgraph.walk(self.starts, graph, self.objects)),
+                         self.expected)
+        self.assertEqual(list(commitgraph.walk(self.starts, None, self.objects)),
+                         self.expected)
+
+    def testGraphReplaced(self):
+        graph = commitgraph.load(self.repo)
+        walk = commitgraph.walk(self.starts, graph, self.objects)
+        ids = [next(walk) for i in range(0, 5)]
+
+        # rewritten file is loaded again and the old graph is closed
+        path = os.path.join(self.repo, 'objects', 'info', 'commit-graph')
+        os.unlink(path)
+        git(self.repo, 'commit-graph', 'write', '--reachable')
+        self.assertFalse(commitgraph.load(self.repo) is graph)
+
+        ids.extend(walk)
+        self.assertEqual(ids, self.expected)
+
+if __name__ == '__main__':
+    unittest.main()
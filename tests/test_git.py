@@ -0,0 +1,194 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Tests of git module on a small repository created by git fast-import.
+
+Usage: python -m unittest discover -s tests
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import git
+import cache
+
+
+def createRepo(path):
+    """ Creates bare repository with one commit containing file
+        'src/with space/file.txt'
+    """
+    subprocess.check_call(['git', 'init', '-q', '--bare', path])
+
+    data = 'content\n'
+    msg  = 'commit\n'
+    stream = ['commit refs/heads/master\n',
+              'committer Test <test@example.com> 1300000000 +0000\n',
+              'data {0}\n{1}'.format(len(msg), msg),
+              'M 100644 inline src/with space/file.txt\n',
+              'data {0}\n{1}\n'.format(len(data), data)]
+
+    p = subprocess.Popen(['git', '--git-dir=' + path, 'fast-import', '--quiet'],
+                         stdin = subprocess.PIPE)
+    p.communicate(''.join(stream))
+    if p.returncode != 0:
+        raise RuntimeError('git fast-import failed')
+
+
+class CatFileTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix = 'pitweb-test-')
+        self.repo = os.path.join(self.dir, 'repo.git')
+        createRepo(self.repo)
+
+    def tearDown(self):
+        git._cat_files.clear()
+        shutil.rmtree(self.dir)
+
+    def testMissingNameWithSpaces(self):
+        for backend in ['git', 'native']:
+            g = git.Git(self.repo, backend = backend)
+            self.assertEqual(list(g.tree('HEAD', 'src/no such')), [])
+            self.assertEqual(list(g.tree('HEAD', 'src/no such/dir')), [])
+
+    def testNameWithSpaces(self):
+        for backend in ['git', 'native']:
+            g = git.Git(self.repo, backend = backend)
+            names = [o.name for o in g.tree('HEAD', 'src/with space')]
+            self.assertEqual(names, ['file.txt'])
+
+    def testProcessKept(self):
+        cat_file = git.catFileProcess('/usr/bin/git', self.repo, True)
+        self.assertEqual(cat_file.queryMany(['HEAD:no such', 'HEAD:src']),
+                         [None, cat_file.query('HEAD:src')])
+        pipe = cat_file._pipe
+        self.assertEqual(cat_file.query('HEAD:no such file'), None)
+        self.assertTrue(cat_file._pipe is pipe)
+
+    def testEvictedProcess(self):
+        max_items = git._cat_files._max_items
+        git._cat_files._max_items = 1
+        try:
+            cat_file = git.catFileProcess('/usr/bin/git', self.repo)
+            answer = cat_file.query('HEAD:src')
+            self.assertTrue(git.catFileProcess('/usr/bin/git', self.repo) is cat_file)
+
+            # evicted process is closed and queries go through the pool
+            other = git.catFileProcess('/usr/bin/git', self.repo, True)
+            self.assertEqual(cat_file._pipe, None)
+            self.assertEqual(cat_file.query('HEAD:src'), answer)
+            self.assertEqual(cat_file._pipe, None)
+            self.assertTrue(other._closed)
+            self.assertEqual(len(git._cat_files), 1)
+        finally:
+            git._cat_files._max_items = max_items
+
+
+class DecorationsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix = 'pitweb-test-')
+        self.repo = os.path.join(self.dir, 'repo.git')
+        createRepo(self.repo)
+
+        self.git('branch', 'other', 'master')
+        self.git('tag', 'light', 'master')
+        self.git('tag', '-a', '-m', 'annotated', 'annotated', 'master')
+        self.git('tag', '-a', '-m', 'tag of tag', 'outer', 'annotated')
+
+    def tearDown(self):
+        git._decorations_cache.clear()
+        shutil.rmtree(self.dir)
+
+    def git(self, *args):
+        comm = ['git', '-c', 'user.name=Test', '-c', 'user.email=test@example.com',
+                '-c', 'advice.nestedTag=false', '--git-dir=' + self.repo] + list(args)
+        return subprocess.check_output(comm)
+
+    def expected(self):
+        """ Returns decorations according to git show-ref --dereference """
+        ids = {}
+        for line in self.git('show-ref', '-d').splitlines():
+            id, refname = line.split(' ', 1)
+            if refname.endswith('^{}'):
+                ids[refname[:-3]] = (id, ids[refname[:-3]][1])
+            else:
+                ids[refname] = (id, id)
+
+        index = {}
+        for refname, (target, id) in ids.items():
+            index.setdefault(target, []).append((refname, id))
+        return index
+
+    def assertDecorations(self):
+        for backend in ['git', 'native']:
+            git._decorations_cache.clear()
+            index = git.Git(self.repo, backend = backend).decorations()
+            index = dict([(id, sorted([r[:2] for r in refs]))
+                          for id, refs in index.items()])
+            expected = dict([(id, sorted(refs))
+                             for id, refs in self.expected().items()])
+            self.assertEqual(index, expected)
+
+    def testLoose(self):
+        self.assertDecorations()
+
+    def testPacked(self):
+        self.git('pack-refs', '--all')
+        self.assertDecorations()
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix = 'pitweb-test-')
+        self.repo = os.path.join(self.dir, 'repo.git')
+        createRepo(self.repo)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testFailedNotCached(self):
+        g = git.Git(self.repo)
+        snapshots = cache.DiskCache(os.path.join(self.dir, 'cache'))
+
+        git._archive_types['fail'] = ('tar', 'false', '.tar')
+        try:
+            self.assertRaises(subprocess.CalledProcessError, g.archive,
+                              'HEAD', 'repo', 'fail', cache = snapshots)
+        finally:
+            del git._archive_types['fail']
+
+        data, filename = g.archive('HEAD', 'repo', 'tgz', cache = snapshots)
+        self.assertEqual(''.join(data)[:2], '\x1f\x8b')
+
+    def testErrorNotInArchive(self):
+        g = git.Git(self.repo)
+        chunks = g._git.archive('nosuch', stream = True)
+        self.assertRaises(subprocess.CalledProcessError, list, chunks)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Tests of objstore module: objects and names are read by ObjectStore and
+compared with what git cat-file and git rev-parse say on repositories
+packed in different ways (pack index v1/v2, OFS/REF deltas, loose
+objects).
+
+Usage: python -m unittest discover -s tests
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import objstore
+
+
+def git(repo, *args, **kwargs):
+    p = subprocess.Popen(['git', '--git-dir=' + repo] + list(args),
+                         stdin = subprocess.PIPE, stdout = subprocess.PIPE,
+                         stderr = open(os.devnull, 'w'))
+    out = p.communicate(kwargs.get('input'))[0]
+    if p.returncode != 0 and not kwargs.get('check') is False:
+        raise RuntimeError('git {0} failed'.format(args[0]))
+    return out
+
+def createRepo(path):
+    """ Creates bare repository with history of one big file changed by
+        small steps (so that it is stored as chain of deltas), a merge,
+        annotated tags (one of them pointing to another tag) and binary
+        file.
+    """
+    subprocess.check_call(['git', 'init', '-q', '--bare', path])
+
+    lines = ['line {0} of the file\n'.format(i) for i in range(0, 2000)]
+    stream = []
+    for c in range(0, 30):
+        lines[c * 37 % len(lines)] = 'line changed by commit {0}\n'.format(c)
+        data = ''.join(lines)
+        binary = ''.join([chr((i * c) % 256) for i in range(0, 3000)])
+        msg = 'commit {0}\n'.format(c)
+
+        branch = 'master'
+        if c in [20, 21]:
+            branch = 'topic'
+        stream.append('commit refs/heads/{0}\n'.format(branch))
+        stream.append('mark :{0}\n'.format(c + 1))
+        stream.append('committer Test <test@example.com> {0} +0000\n'.format(1300000000 + c * 60))
+        stream.append('data {0}\n{1}'.format(len(msg), msg))
+        if c == 20:
+            stream.append('from :19\n')
+        elif c == 22:
+            stream.append('from :20\nmerge :22\n')
+        elif c > 0:
+            stream.append('from :{0}\n'.format(c))
+        stream.append('M 100644 inline dir/sub/file.txt\ndata {0}\n{1}\n'.format(len(data), data))
+        stream.append('M 100755 inline bin/data\ndata {0}\n{1}\n'.format(len(binary), binary))
+
+    stream.append('tag v1\nfrom :10\ntagger Test <test@example.com> 1300000000 +0000\ndata 3\nv1\n')
+    stream.append('tag v2\nfrom :30\ntagger Test <test@example.com> 1300000000 +0000\ndata 3\nv2\n')
+
+    p = subprocess.Popen(['git', '--git-dir=' + path, 'fast-import', '--quiet'],
+                         stdin = subprocess.PIPE)
+    p.communicate(''.join(stream))
+    if p.returncode != 0:
+        raise RuntimeError('git fast-import failed')
+
+    # tag of tag
+    v2 = git(path, 'rev-parse', 'v2').strip()
+    tag = 'object {0}\ntype tag\ntag v3\ntagger Test <test@example.com> 1300000000 +0000\n\nv3\n'.format(v2)
+    v3 = git(path, 'hash-object', '-t', 'tag', '-w', '--stdin', input = tag).strip()
+    git(path, 'update-ref', 'refs/tags/v3', v3)
+
+
+class ObjectStoreTest(unittest.TestCase):
+    # names whose resolving is implemented by ObjectStore itself
+    names = ['HEAD', 'master', 'topic', 'refs/heads/master', 'heads/topic',
+             'v1', 'v2', 'v3', 'refs/tags/v3', 'tags/v2',
+             'v1^{}', 'v3^{}', 'v3^{tag}', 'v3^{commit}', 'v1^{tree}',
+             'HEAD^{object}', 'v3^{object}', 'HEAD^{tree}', 'HEAD^{commit}',
+             'HEAD~0', 'HEAD~1', 'HEAD~7', 'HEAD^', 'HEAD^1', 'HEAD^^',
+             'HEAD~8^2', 'HEAD~8^2~1', 'v2~3', 'v3~2^', 'master~100',
+             'HEAD:dir', 'HEAD:dir/sub/file.txt', 'HEAD:bin/data',
+             'v1:dir/sub', 'HEAD~3:dir/sub/file.txt', 'HEAD:no/such',
+             'nosuch', 'HEAD^{blob}', 'HEAD^3']
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix = 'pitweb-test-')
+        self.repo = os.path.join(self.dir, 'repo.git')
+        createRepo(self.repo)
+
+    def tearDown(self):
+        objstore._object_dirs.clear()
+        objstore._delta_bases.clear()
+        shutil.rmtree(self.dir)
+
+    def objects(self):
+        out = git(self.repo, 'cat-file', '--batch-all-objects', '--batch-check')
+        return [l.split() for l in out.splitlines()]
+
+    def assertSameAsGit(self):
+        store = objstore.ObjectStore(self.repo)
+
+        objects = self.objects()
+        self.assertTrue(len(objects) > 100)
+        for id, type, size in objects:
+            data = git(self.repo, 'cat-file', type, id)
+            self.assertEqual(store.readObject(id), (type, data))
+            self.assertEqual(store.catFileBatchCheck([id]), [(id, type, int(size), None)])
+
+        for name in self.names:
+            id = git(self.repo, 'rev-parse', '--verify', '-q', name, check = False).strip()
+            self.assertEqual(store.resolve(name), id or None, name)
+
+    def repack(self, *args):
+        git(self.repo, *(['repack', '-a', '-d', '-f', '-q', '--depth=50'] + list(args)))
+
+    def testPackV2OfsDelta(self):
+        git(self.repo, 'pack-refs', '--all')
+        self.repack()
+        self.assertSameAsGit()
+
+    def testPackV1RefDelta(self):
+        git(self.repo, 'config', 'pack.indexVersion', '1')
+        git(self.repo, 'config', 'repack.useDeltaBaseOffset', 'false')
+        self.repack()
+        self.assertSameAsGit()
+
+    def testPackedAndLoose(self):
+        self.repack()
+        data = 'loose object\n'
+        id = git(self.repo, 'hash-object', '-w', '--stdin', input = data).strip()
+        self.assertEqual(objstore.ObjectStore(self.repo).readObject(id), ('blob', data))
+        self.assertSameAsGit()
+
+    def testPacksReloaded(self):
+        self.repack()
+        store = objstore.ObjectStore(self.repo)
+        old = list(store._objdirs[0].packs)
+        self.assertEqual(len(old), 1)
+
+        # git gc replaces the pack by a new one
+        id = git(self.repo, 'hash-object', '-w', '--stdin', input = 'new\n').strip()
+        git(self.repo, 'update-ref', 'refs/tags/blob', id)
+        self.repack()
+        store._objdirs[0].refresh(force = True)
+        self.assertTrue(old[0].closed)
+        self.assertSameAsGit()
+
+if __name__ == '__main__':
+    unittest.main()